@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Benchmarks Dotbot on synthetic dotfile repositories.
+
+Each scenario generates a repository and a home directory (on tmpfs when
+/dev/shm is available, so the numbers measure Dotbot rather than the disk)
+and runs `bin/dotbot --timing` against them: once on a fresh home with no
+state ("cold") and once more straight after ("warm"), which is what a typical
+re-run of an install script looks like. Results are written as JSON, and two
+result files can be compared to check a change for regressions:
+
+    bench/bench.py run --output before.json
+    (change something)
+    bench/bench.py run --output after.json
+    bench/bench.py compare before.json after.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOTBOT = os.path.join(PROJECT_ROOT, "bin", "dotbot")
+
+# bump when the layout of the results changes, so that compare refuses to
+# compare files it would misread
+FORMAT = 1
+
+_timing = re.compile(r"^Timing: (.*) took ([0-9.]+) ms$", re.MULTILINE)
+
+
+class Scenario(object):
+    def __init__(self, name, generate, size, quick):
+        self.name = name
+        self.generate = generate
+        self.size = size
+        # whether the scenario is small enough for `run --quick`
+        self.quick = quick
+
+
+scenarios = []
+
+
+def scenario(name, size, quick=True):
+    def register(generate):
+        scenarios.append(Scenario(name, generate, size, quick))
+        return generate
+
+    return register
+
+
+def write(path, content=""):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "w") as fout:
+        fout.write(content)
+
+
+def link_scenario(size):
+    def generate(repo, home):
+        links = {}
+        for i in range(size):
+            path = "d%03d/f%02d" % (i // 100, i % 100)
+            write(os.path.join(repo, path), "%d\n" % i)
+            links["~/." + path] = path
+        return [{"defaults": {"link": {"create": True}}}, {"link": links}]
+
+    return generate
+
+
+for _size, _name in [(1000, "link-1k"), (10000, "link-10k"), (50000, "link-50k")]:
+    scenario(_name, _size, quick=_size <= 1000)(link_scenario(_size))
+
+
+@scenario("glob-deep", 6)
+def glob_deep(repo, home, depth=6, fanout=3, files=8):
+    """A tree `depth` levels deep linked through a recursive glob, with excludes."""
+    directories = [os.path.join(repo, "tree")]
+    for _ in range(depth):
+        directories = [
+            os.path.join(directory, "d%d" % i) for directory in directories for i in range(fanout)
+        ]
+    for directory in directories:
+        for i in range(files):
+            write(os.path.join(directory, "f%d.conf" % i))
+        write(os.path.join(directory, "notes.txt"))
+    return [
+        {
+            "link": {
+                "~/.tree/": {
+                    "glob": True,
+                    "create": True,
+                    "path": "tree/**/*.conf",
+                    "exclude": ["tree/d0/**", "tree/*/*/d2/**"],
+                }
+            }
+        }
+    ]
+
+
+@scenario("clean-broken", 20000)
+def clean_broken(repo, home, size=20000, per_directory=100):
+    """A home with many directories of files and links, half of them broken."""
+    os.makedirs(os.path.join(repo, "gone"))
+    for i in range(size):
+        directory = os.path.join(home, ".d%03d" % (i // per_directory))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, "e%02d" % (i % per_directory))
+        if i % 2:
+            os.symlink(os.path.join(repo, "gone", str(i)), path)
+        else:
+            write(path)
+    return [{"clean": {"~/": {"recursive": True}}}]
+
+
+@scenario("conditions-shell", 2000)
+def conditions_shell(repo, home, size=2000, conditions=10, commands=100):
+    """Links behind a handful of `if:` conditions, then serial and parallel shell commands."""
+    links = {}
+    for i in range(size):
+        path = "d%03d/f%02d" % (i // 100, i % 100)
+        write(os.path.join(repo, path))
+        links["~/." + path] = {"path": path, "if": "test %d -ge 0" % (i % conditions)}
+    serial = ["true %d" % i for i in range(commands)]
+    parallel = [{"command": "true %d" % i, "parallel": True} for i in range(commands)]
+    return [
+        {"defaults": {"link": {"create": True}}},
+        {"link": links},
+        {"shell": serial},
+        {"shell": parallel},
+    ]
+
+
+def default_root():
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def prepare(workspace, scenario):
+    """Generates the scenario's repository and home, returning the config path."""
+    if os.path.exists(workspace):
+        shutil.rmtree(workspace)
+    repo = os.path.join(workspace, "repo")
+    home = os.path.join(workspace, "home")
+    os.makedirs(repo)
+    os.makedirs(home)
+    tasks = scenario.generate(repo, home)
+    config = os.path.join(repo, "install.conf.yaml")
+    # JSON is YAML, so this goes through the same parser as a real config
+    write(config, json.dumps(tasks, indent=1) + "\n")
+    return config
+
+
+def environment(workspace):
+    env = dict(os.environ)
+    env["HOME"] = os.path.join(workspace, "home")
+    env["XDG_STATE_HOME"] = os.path.join(workspace, "state")
+    env["XDG_CACHE_HOME"] = os.path.join(workspace, "cache")
+    return env
+
+
+def run_dotbot(config, env):
+    """Runs Dotbot once, returning the wall time and the timings it reports."""
+    command = [sys.executable, DOTBOT, "--quiet", "--timing", "-c", config]
+    start = time.perf_counter()
+    result = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    wall = time.perf_counter() - start
+    output = result.stdout.decode("utf-8", "replace")
+    if result.returncode != 0:
+        raise RuntimeError("dotbot exited with %d:\n%s" % (result.returncode, output))
+    phases = {}
+    directives = {}
+    for label, milliseconds in _timing.findall(output):
+        if label.endswith(" directive"):
+            directive = label[: -len(" directive")]
+            directives[directive] = directives.get(directive, 0.0) + float(milliseconds)
+        else:
+            phases[label] = float(milliseconds)
+    return {"wall_ms": wall * 1000, "phases": phases, "directives": directives}
+
+
+def summarize(runs):
+    """Medians across repeats, which are less noisy than means on a busy machine."""
+
+    def median(key, name=None):
+        values = [run[key] if name is None else run[key].get(name, 0.0) for run in runs]
+        return round(statistics.median(values), 3)
+
+    walls = [round(run["wall_ms"], 3) for run in runs]
+    return {
+        "wall_ms": {"median": median("wall_ms"), "min": min(walls), "runs": walls},
+        "phases": dict((name, median("phases", name)) for name in runs[0]["phases"]),
+        "directives": dict((name, median("directives", name)) for name in runs[0]["directives"]),
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, stderr=subprocess.DEVNULL
+        )
+        status = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=PROJECT_ROOT,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode().strip(), bool(status.strip())
+
+
+def select(names, quick):
+    if names:
+        known = dict((scenario.name, scenario) for scenario in scenarios)
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise SystemExit("unknown scenario: %s" % ", ".join(unknown))
+        return [known[name] for name in names]
+    return [scenario for scenario in scenarios if scenario.quick or not quick]
+
+
+def command_run(options):
+    selected = select(options.scenario, options.quick)
+    root = tempfile.mkdtemp(prefix="dotbot-bench-", dir=options.root or default_root())
+    commit, dirty = git_commit()
+    results = {
+        "format": FORMAT,
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "root": root,
+        "repeat": options.repeat,
+        "scenarios": {},
+    }
+    try:
+        for scenario in selected:
+            workspace = os.path.join(root, scenario.name)
+            env = environment(workspace)
+            cold = []
+            warm = []
+            for _ in range(options.repeat):
+                config = prepare(workspace, scenario)
+                cold.append(run_dotbot(config, env))
+                warm.append(run_dotbot(config, env))
+            results["scenarios"][scenario.name] = {
+                "size": scenario.size,
+                "cold": summarize(cold),
+                "warm": summarize(warm),
+            }
+            print(
+                "%-18s cold %9.1f ms   warm %9.1f ms"
+                % (
+                    scenario.name,
+                    results["scenarios"][scenario.name]["cold"]["wall_ms"]["median"],
+                    results["scenarios"][scenario.name]["warm"]["wall_ms"]["median"],
+                ),
+                file=sys.stderr,
+            )
+    finally:
+        if not options.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    text = json.dumps(results, indent=2, sort_keys=True) + "\n"
+    if options.output:
+        with open(options.output, "w") as fout:
+            fout.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+def read_results(path):
+    with open(path) as fin:
+        results = json.load(fin)
+    if results.get("format") != FORMAT:
+        raise SystemExit("%s: unsupported results format %r" % (path, results.get("format")))
+    return results
+
+
+def command_compare(options):
+    before = read_results(options.before)
+    after = read_results(options.after)
+    print("before: %s" % (before["commit"] or "unknown"))
+    print("after:  %s" % (after["commit"] or "unknown"))
+    print("%-42s %10s %10s %8s" % ("", "before ms", "after ms", "change"))
+    regressions = 0
+    for name in sorted(set(before["scenarios"]) & set(after["scenarios"])):
+        for run in ("cold", "warm"):
+            old = before["scenarios"][name][run]
+            new = after["scenarios"][name][run]
+            rows = [("%s %s" % (name, run), old["wall_ms"]["median"], new["wall_ms"]["median"])]
+            for directive in sorted(set(old["directives"]) & set(new["directives"])):
+                rows.append(
+                    ("  %s" % directive, old["directives"][directive], new["directives"][directive])
+                )
+            for index, (label, old_ms, new_ms) in enumerate(rows):
+                change = (new_ms - old_ms) / old_ms * 100 if old_ms else 0.0
+                flag = ""
+                # only end-to-end times count towards the exit status; small
+                # per-directive times are too noisy to fail on
+                if index == 0 and change > options.threshold:
+                    flag = "  regression"
+                    regressions += 1
+                print("%-42s %10.1f %10.1f %+7.1f%%%s" % (label, old_ms, new_ms, change, flag))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Dotbot on synthetic dotfile trees.")
+    subparsers = parser.add_subparsers(dest="command")
+    run = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run.add_argument(
+        "-s", "--scenario", action="append", help="only run SCENARIO (can be repeated)"
+    )
+    run.add_argument("--quick", action="store_true", help="skip the largest scenarios")
+    run.add_argument("-n", "--repeat", type=int, default=3, help="runs per scenario (default 3)")
+    run.add_argument("-o", "--output", help="write the results to OUTPUT instead of stdout")
+    run.add_argument("--root", help="generate the trees under ROOT (default /dev/shm)")
+    run.add_argument("--keep", action="store_true", help="keep the generated trees")
+    compare = subparsers.add_parser("compare", help="compare two results files")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percentage slowdown reported as a regression (default 10)",
+    )
+    subparsers.add_parser("list", help="list the scenarios")
+    options = parser.parse_args()
+    if options.command == "run":
+        return command_run(options)
+    if options.command == "compare":
+        return command_compare(options)
+    if options.command == "list":
+        for scenario in scenarios:
+            print("%-18s%s" % (scenario.name, "" if scenario.quick else " (not run with --quick)"))
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
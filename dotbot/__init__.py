@@ -1,4 +1,18 @@
-from .cli import main
-from .plugin import Plugin
+import sys
+import time
 
 __version__ = "1.19.0"
+
+# when dotbot started loading, for --timing
+_import_start = time.perf_counter()
+
+
+def _import_submodule(package, name):
+    """Imports and returns a submodule of package, e.g. a built-in plugin."""
+    qualified = "%s.%s" % (package, name)
+    __import__(qualified)
+    return sys.modules[qualified]
+
+
+from .cli import main
+from .plugin import Plugin
@@ -1,16 +1,13 @@
-import os, glob
+import os
 import sys
+import time
 
 from argparse import ArgumentParser, RawTextHelpFormatter
 from .config import ConfigReader, ReadingError
 from .dispatcher import Dispatcher, DispatchError
-from .messenger import Messenger
-from .messenger import Level
-from .util import module
+from .messenger import Level, Messenger
 
 import dotbot
-import os
-import subprocess
 
 def add_options(parser):
     parser.add_argument('-Q', '--super-quiet', action='store_true',
@@ -36,6 +33,58 @@ def add_options(parser):
             help='only run specified directives', metavar='DIRECTIVE')
     parser.add_argument('--except', nargs='+', dest='skip',
             help='skip specified directives', metavar='DIRECTIVE')
+    parser.add_argument('-j', '--jobs', type=int,
+        help='run independent link operations on up to JOBS threads', metavar='JOBS')
+    parser.add_argument('--schedule', nargs='?', type=int, const=4,
+        help='run tasks that touch different paths concurrently,\n'
+             'on up to JOBS threads (default: 4), and report the\n'
+             'critical path',
+        metavar='JOBS')
+    parser.add_argument('--persistent-shell', action='store_true',
+        help='run shell commands and `if:` conditions on long-lived\n'
+             'shells instead of starting a shell for each')
+    parser.add_argument('--full', action='store_true',
+        help='apply every entry, even those unchanged since the last run')
+    parser.add_argument('--prune', action='store_true',
+        help='remove the links made by earlier runs that the config\n'
+             'no longer produces, or whose source is gone')
+    parser.add_argument('--plan', metavar='PLANFILE',
+        help='write the actions the config would perform to PLANFILE\n'
+             'without changing anything, reporting those still pending')
+    parser.add_argument('--apply', metavar='PLANFILE',
+        help='execute the actions in PLANFILE instead of reading a config')
+    parser.add_argument('--rollback', action='store_true',
+        help='undo the changes made by the last run with this base\n'
+             'directory, without reading the config')
+    parser.add_argument('--target-root', nargs='+', action='append', dest='target_roots',
+        help='apply the config under each ROOT, e.g. the root\n'
+             'filesystem of a container, instead of to this machine',
+        metavar='ROOT')
+    parser.add_argument('--home', nargs='+', action='append', dest='homes',
+        help='apply the config to each HOME instead of your home\n'
+             'directory (under each --target-root, if given)',
+        metavar='HOME')
+    parser.add_argument('--processes', type=int,
+        help='set up to N targets at a time (default: one per processor)',
+        metavar='N')
+    parser.add_argument('--watch', nargs='?', const='auto', choices=('auto', 'inotify', 'poll'),
+        help='keep running, and re-run the directives affected by\n'
+             'changes to the config file or the base directory, which\n'
+             'are watched with inotify where available or by polling',
+        metavar='METHOD')
+    parser.add_argument('--timing', action='store_true',
+        help='report how long loading, reading the config and each\n'
+             'directive took')
+    parser.add_argument('--trace', metavar='TRACEFILE',
+        help='write a Chrome trace of the run to TRACEFILE')
+    parser.add_argument('--summary', action='store_true',
+        help='print how many items each directive created, found\n'
+             'existing, skipped or failed instead of a line per item')
+    parser.add_argument('--log-file', metavar='LOGFILE',
+        help='also write every message, including debug messages,\n'
+             'to LOGFILE as plain text')
+    parser.add_argument('--log-json', metavar='LOGFILE',
+        help='also write every message to LOGFILE as JSON lines')
     parser.add_argument('--force-color', dest='force_color', action='store_true',
         help='force color output')
     parser.add_argument('--no-color', dest='no_color', action='store_true',
@@ -43,9 +92,120 @@ def add_options(parser):
     parser.add_argument('--version', action='store_true',
         help='show program\'s version number and exit')
 
-def read_config(config_file):
-    reader = ConfigReader(config_file)
-    return reader.get_config()
+def read_config(config_file, only=None, skip=None):
+    """Returns a ConfigReader for the config file, see its docstring for only and skip."""
+    return ConfigReader(config_file, only=only, skip=skip)
+
+
+def write_plan(dispatcher, tasks, plan_file):
+    """
+    Plans the tasks and writes the plan, reporting which of the planned
+    actions would change something on this machine.
+    """
+    log = Messenger()
+    success, plan = dispatcher.plan(tasks)
+    pending = 0
+    for action in plan.actions():
+        if action.pending():
+            pending += 1
+            log.lowinfo('Pending: %s' % action.describe())
+        else:
+            log.debug('Up to date: %s' % action.describe())
+    log.info('%d of %d planned actions are pending' % (pending, len(list(plan.actions()))))
+    plan.write(plan_file)
+    return success
+
+
+def apply_plan(options):
+    from .plan import Plan, PlanError
+
+    try:
+        plan = Plan.read(options.apply)
+    except PlanError as e:
+        raise DispatchError(str(e))
+    if options.base_directory:
+        base_directory = os.path.abspath(options.base_directory)
+    else:
+        base_directory = plan.base_directory
+    os.chdir(base_directory)
+    load_plugins(options, [directive for directive, _ in plan.tasks])
+    dispatcher = Dispatcher(base_directory, only=options.only, skip=options.skip, options=options)
+    return dispatcher.apply(plan), dispatcher
+
+
+def rollback(options):
+    if options.base_directory:
+        base_directory = os.path.abspath(options.base_directory)
+    elif options.config_file:
+        base_directory = os.path.dirname(os.path.abspath(options.config_file))
+    else:
+        raise DispatchError('No configuration file or base directory specified')
+    dispatcher = Dispatcher(base_directory, options=options)
+    return dispatcher.rollback(), dispatcher
+
+
+def load_plugins(options, directives):
+    """
+    Imports the plugins that handle the directives a run uses, from the
+    built-in plugins, the plugins given on the command line and installed
+    packages (see dotbot.registry). Returns the registry, which can load the
+    plugins for more directives later.
+    """
+    from .registry import Registry
+
+    registry = Registry()
+    if not options.disable_built_in_plugins:
+        registry.add_builtins()
+    plugin_paths = []
+    if options.plugin_dirs:
+        import glob
+        for directory in options.plugin_dirs:
+            plugin_paths.extend(sorted(glob.glob(os.path.join(directory, '*.py'))))
+    for plugin_path in options.plugins:
+        plugin_paths.append(plugin_path)
+    for plugin_path in plugin_paths:
+        registry.add_file(plugin_path)
+    registry.load(directives)
+    return registry
+
+
+def directives(tasks):
+    """Returns the directives used by the tasks of a config."""
+    found = set()
+    for task in tasks:
+        if isinstance(task, dict):
+            found.update(task.keys())
+    # these say how a task is ordered
+    found.difference_update(('id', 'after'))
+    return found
+
+
+def flatten(lists):
+    """Flattens the values of an option that can be given several times."""
+    if lists is None:
+        return None
+    return [value for values in lists for value in values]
+
+
+def write_trace(path):
+    from . import trace
+
+    log = Messenger()
+    try:
+        trace.write(path)
+    except OSError as e:
+        log.warning('Could not write trace to %s (%s)' % (path, e))
+    else:
+        log.info('Trace written to %s' % path)
+
+
+def report_timing(timings, dispatcher):
+    log = Messenger()
+    for phase, seconds in timings:
+        log.info('Timing: %s took %.1f ms' % (phase, seconds * 1000))
+    if dispatcher is not None:
+        for directive, seconds in dispatcher.timings():
+            log.info('Timing: %s directive took %.1f ms' % (directive, seconds * 1000))
 
 
 def main(additional_args=None):
@@ -55,9 +215,10 @@ def main(additional_args=None):
         add_options(parser)
         options = parser.parse_args()
         if additional_args is not None:
-            print("got explicit arguments")
+            log.debug("got explicit arguments")
             options = parser.parse_args(additional_args)
         if options.version:
+            import subprocess
             try:
                 with open(os.devnull) as devnull:
                     git_hash = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
@@ -71,8 +232,26 @@ def main(additional_args=None):
             log.set_level(Level.WARNING)
         if options.quiet:
             log.set_level(Level.INFO)
+        if options.summary and not options.verbose and log.level() < Level.INFO:
+            # the counts replace the line per item
+            log.set_level(Level.INFO)
         if options.verbose > 0:
             log.set_level(Level.DEBUG)
+        if options.log_file:
+            from .messenger import TextSink
+            try:
+                log.add_sink(TextSink(options.log_file))
+            except OSError as e:
+                log.error('Could not open log file %s (%s)' % (options.log_file, e))
+                exit(1)
+        if options.log_json:
+            from .messenger import JsonLinesSink
+            try:
+                log.add_sink(JsonLinesSink(options.log_json))
+            except OSError as e:
+                log.error('Could not open log file %s (%s)' % (options.log_json, e))
+                exit(1)
+        log.start()
 
         if options.force_color and options.no_color:
             log.error("`--force-color` and `--no-color` cannot both be provided")
@@ -84,43 +263,116 @@ def main(additional_args=None):
         else:
             log.use_color(sys.stdout.isatty())
 
-        plugin_directories = list(options.plugin_dirs)
-        if not options.disable_built_in_plugins:
-            from .plugins import Clean, Create, Link, Shell
-        plugin_paths = []
-        for directory in plugin_directories:
-          for plugin_path in glob.glob(os.path.join(directory, '*.py')):
-            plugin_paths.append(plugin_path)
-        for plugin_path in options.plugins:
-            plugin_paths.append(plugin_path)
-        for plugin_path in plugin_paths:
-            abspath = os.path.abspath(plugin_path)
-            module.load(abspath)
-        if not options.config_file:
-            log.error('No configuration file specified')
+        if options.plan and options.apply:
+            log.error("`--plan` and `--apply` cannot both be provided")
             exit(1)
-        # read tasks from config file
-        tasks = read_config(options.config_file)
-        if tasks is None:
-            log.warning('Configuration file is empty, no work to do')
-            tasks = []
-        if not isinstance(tasks, list):
-            raise ReadingError('Configuration file must be a list of tasks')
-        if options.base_directory:
-            base_directory = os.path.abspath(options.base_directory)
-        else:
-            # default to directory of config file
-            base_directory = os.path.dirname(os.path.abspath(options.config_file))
-        os.chdir(base_directory)
-        dispatcher = Dispatcher(base_directory, only=options.only, skip=options.skip, options=options)
-        success = dispatcher.dispatch(tasks)
-        if success:
-            log.info('\n==> All tasks executed successfully')
-        else:
-            raise DispatchError('\n==> Some tasks were not executed successfully')
+        if options.rollback and (options.plan or options.apply or options.watch
+                                 or options.target_roots or options.homes):
+            log.error("`--rollback` cannot be combined with `--plan`, `--apply`, `--watch`, "
+                      "`--target-root` or `--home`")
+            exit(1)
+        if options.watch and (options.plan or options.apply):
+            log.error("`--watch` cannot be combined with `--plan` or `--apply`")
+            exit(1)
+        if (options.target_roots or options.homes) and (
+                options.plan or options.apply or options.watch):
+            log.error("`--target-root` and `--home` cannot be combined with `--plan`, "
+                      "`--apply` or `--watch`")
+            exit(1)
+        targets = None
+        if options.target_roots or options.homes:
+            from .targets import Target
+            # relative to where dotbot was run from, before changing directory
+            targets = [
+                Target(root, home)
+                for root in flatten(options.target_roots) or [None]
+                for home in flatten(options.homes) or [None]
+            ]
+        timings = [('loading dotbot', time.perf_counter() - dotbot._import_start)]
+        dispatcher = None
+        from . import trace
+        if options.trace:
+            trace.enable()
+        try:
+            if options.apply:
+                success, dispatcher = apply_plan(options)
+                if success:
+                    log.info('\n==> All tasks executed successfully')
+                else:
+                    raise DispatchError('\n==> Some tasks were not executed successfully')
+                return
+            if options.rollback:
+                success, dispatcher = rollback(options)
+                if success:
+                    log.info('\n==> Rolled back the last run')
+                else:
+                    raise DispatchError('\n==> Some changes could not be rolled back')
+                return
+            if not options.config_file:
+                log.error('No configuration file specified')
+                exit(1)
+            # read tasks from config file
+            start = time.perf_counter()
+            with trace.span("read config", path=options.config_file):
+                # a watched config can change which directives it uses
+                reader = read_config(options.config_file, only=None if options.watch else options.only,
+                                     skip=None if options.watch else options.skip)
+                tasks = reader.get_config()
+            timings.append(('reading the config', time.perf_counter() - start))
+            if tasks is None:
+                log.warning('Configuration file is empty, no work to do')
+                tasks = []
+            if not isinstance(tasks, list):
+                raise ReadingError('Configuration file must be a list of tasks')
+            if options.base_directory:
+                base_directory = os.path.abspath(options.base_directory)
+            else:
+                # default to directory of config file
+                base_directory = os.path.dirname(os.path.abspath(options.config_file))
+            os.chdir(base_directory)
+            start = time.perf_counter()
+            with trace.span("load plugins"):
+                registry = load_plugins(options, directives(tasks))
+            timings.append(('loading plugins', time.perf_counter() - start))
+            dispatcher = Dispatcher(base_directory, only=options.only, skip=options.skip, options=options)
+            if options.plan:
+                success = write_plan(dispatcher, tasks, options.plan)
+                if success:
+                    log.info('\n==> Plan written to %s' % options.plan)
+                else:
+                    raise DispatchError('\n==> Some tasks could not be planned')
+                return
+            start = time.perf_counter()
+            if targets is not None:
+                from .targets import apply_to_targets
+                success = apply_to_targets(dispatcher, tasks, targets, options.processes)
+            elif options.watch:
+                from .watch import watch
+                # the config file is relative to where dotbot started, not
+                # the base directory
+                config_files = reader.files()
+                success = watch(dispatcher, tasks, base_directory, config_files[0],
+                                options.watch, included=config_files[1:], registry=registry)
+            else:
+                success = dispatcher.dispatch(tasks)
+            timings.append(('dispatch', time.perf_counter() - start))
+            if success:
+                log.info('\n==> All tasks executed successfully')
+            else:
+                raise DispatchError('\n==> Some tasks were not executed successfully')
+        finally:
+            if options.summary:
+                log.summarize()
+            if options.timing:
+                report_timing(timings, dispatcher)
+            if options.trace:
+                write_trace(options.trace)
     except (ReadingError, DispatchError) as e:
         log.error('%s' % e)
         exit(1)
     except KeyboardInterrupt:
         log.error('\n==> Operation aborted')
         exit(1)
+    finally:
+        # write out everything the background writer still holds
+        log.close()
@@ -0,0 +1,276 @@
+import json
+import os
+import threading
+from collections.abc import Mapping
+
+from . import trace
+from .facts import host
+from .messenger import Messenger
+from .state import State
+from .util.common import expand_path, shell_command, state_directory
+
+# what a native condition can check, see Conditions.evaluate()
+_facts = ("env", "exists", "hostname", "not", "os", "which")
+
+
+class Conditions(object):
+    """
+    Results of `if:` conditions, shared by every directive in a run.
+
+    Each distinct command is run once per run. A condition can also opt in to
+    being remembered across runs, in which case its result is keyed by the
+    command and the values of the environment variables it declares, and
+    reused as long as none of them change.
+
+    Native conditions (see compile_condition()) are checked in-process
+    against the facts of dotbot.facts.host(), without running anything.
+    """
+
+    version = 1
+
+    def __init__(self, cwd, path=None, reuse=True, shells=None):
+        self._cwd = cwd
+        self._shells = shells
+        self._path = path if path is not None else self.default_path()
+        self._reuse = reuse
+        self._log = Messenger()
+        self._lock = threading.Lock()
+        self._results = {}
+        self._persisted = None
+        self._dirty = False
+        self._evaluated = 0
+        self._hits = 0
+        self._remembered = 0
+        self._checked = 0
+
+    @staticmethod
+    def default_path(target=None):
+        """
+        Returns where results are remembered, separately for each target a
+        config is applied to (see dotbot.targets).
+        """
+        if target is None:
+            return os.path.join(state_directory(), "conditions.json")
+        return os.path.join(state_directory(), "conditions", "%s.json" % State.key(target))
+
+    def prefetch(self, conditions, jobs=8):
+        """
+        Evaluates (command, env) conditions that have not been evaluated yet,
+        on up to `jobs` threads. env is a list of environment variable names,
+        or None if the result should not outlive this run.
+        """
+        pending = []
+        with self._lock:
+            for command, env in conditions:
+                if not isinstance(command, str):
+                    continue  # native conditions are cheaper to check than to schedule
+                key = self._key(command, env)
+                if key not in self._results and key not in pending:
+                    pending.append(key)
+        pending = [key for key in pending if not self._remember(key)]
+        if len(pending) > 1 and jobs > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(jobs, len(pending))) as executor:
+                results = list(executor.map(self._run, pending))
+        else:
+            results = [self._run(key) for key in pending]
+        with self._lock:
+            for key, result in zip(pending, results):
+                self._store(key, result)
+
+    def evaluate(self, command, env=None):
+        """
+        Returns true if the condition holds: if a shell command succeeds, or
+        if every fact a native condition checks is true.
+        """
+        if not isinstance(command, str):
+            return self._check(compile_condition(command))
+        key = self._key(command, env)
+        with self._lock:
+            if key in self._results:
+                self._hits += 1
+                return self._results[key]
+        if not self._remember(key):
+            result = self._run(key)
+            with self._lock:
+                self._store(key, result)
+        return self._results[key]
+
+    def report(self):
+        if self._results or self._checked:
+            self._log.debug(
+                "Conditions: %d run, %d reused from earlier runs, %d cache hits, %d checked natively"
+                % (self._evaluated, self._remembered, self._hits, self._checked)
+            )
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            temporary = "%s.%d.tmp" % (self._path, os.getpid())
+            with open(temporary, "w") as fout:
+                json.dump({"version": self.version, "results": self._persisted}, fout)
+            os.replace(temporary, self._path)
+            self._dirty = False
+        except OSError as e:
+            self._log.warning("Could not save conditions to %s (%s)" % (self._path, e))
+
+    def _check(self, condition):
+        with self._lock:
+            self._checked += 1
+        facts = host()
+        environ = os.environ
+        for fact, values in condition:
+            if fact == "not":
+                holds = not self.evaluate(values)
+            elif fact == "os":
+                holds = any(facts.is_system(name) for name in values)
+            elif fact == "hostname":
+                holds = any(facts.is_host(name) for name in values)
+            elif fact == "which":
+                holds = all(facts.which(program) is not None for program in values)
+            elif fact == "env":
+                holds = all(
+                    name in environ if value is None else environ.get(name) == value
+                    for name, value in values
+                )
+            else:  # exists
+                # like a shell condition, relative paths are in the base directory
+                holds = all(
+                    os.path.exists(os.path.join(self._cwd, expand_path(path))) for path in values
+                )
+            if not holds:
+                return False
+        return True
+
+    def _key(self, command, env):
+        if env is None:
+            return command, None
+        return command, tuple(sorted(env))
+
+    def _persistent_key(self, key):
+        command, env = key
+        values = dict((name, os.environ.get(name)) for name in env)
+        return State.key("if", command, values, self._cwd)
+
+    def _remember(self, key):
+        """
+        Looks up a result from an earlier run. Returns true if one was found,
+        in which case it is stored for this run too.
+        """
+        if key[1] is None or not self._reuse:
+            return False
+        persisted = self._load()
+        result = persisted.get(self._persistent_key(key))
+        if result is None:
+            return False
+        with self._lock:
+            self._results[key] = result
+            self._remembered += 1
+        return True
+
+    def _run(self, key):
+        with trace.span("if %s" % key[0]) as span:
+            run = shell_command if self._shells is None else self._shells.run
+            result = run(key[0], cwd=self._cwd) == 0
+            span.set(result=result)
+        return result
+
+    def _store(self, key, result):
+        self._results[key] = result
+        self._evaluated += 1
+        if key[1] is not None:
+            self._load()[self._persistent_key(key)] = result
+            self._dirty = True
+
+    def _load(self):
+        if self._persisted is None:
+            try:
+                with open(self._path) as fin:
+                    data = json.load(fin)
+            except (OSError, ValueError):
+                data = None
+            if isinstance(data, dict) and data.get("version") == self.version:
+                self._persisted = data.get("results", {})
+            else:
+                self._persisted = {}
+        return self._persisted
+
+
+def compile_condition(condition):
+    """
+    Returns an `if:` condition from the config in the form
+    Conditions.evaluate() takes. A shell command is returned as it is. A
+    native condition, a mapping of facts to check, becomes a tuple of
+    (fact, values) pairs that can be hashed and compared:
+
+    - os: the operating system, or one of a list of them;
+    - hostname: the host name, or one of a list of them;
+    - which: a program, or each of a list of them, is on $PATH;
+    - env: an environment variable, or each of a list of them, is set, or
+      each variable in a mapping has the value given;
+    - exists: a path, or each of a list of them, exists;
+    - not: another condition does not hold.
+
+    Raises ValueError if the condition checks an unknown fact or operating
+    system.
+    """
+    if condition is None or isinstance(condition, (str, tuple)):
+        return condition
+    if not isinstance(condition, Mapping):
+        raise ValueError("An if condition must be a command or a mapping, not %r" % (condition,))
+    compiled = []
+    for fact in sorted(condition):
+        value = condition[fact]
+        if fact == "not":
+            values = compile_condition(value)
+        elif fact == "env" and isinstance(value, Mapping):
+            values = tuple(sorted((str(name), _string(expected)) for name, expected in value.items()))
+        elif fact == "env":
+            values = tuple((name, None) for name in _strings(value))
+        elif fact in _facts:
+            values = _strings(value)
+        else:
+            raise ValueError("Unknown fact %s in if condition (expected one of %s)"
+                             % (fact, ", ".join(_facts)))
+        if fact == "os":
+            try:
+                for name in values:
+                    host().is_system(name)
+            except KeyError as e:
+                raise ValueError(e.args[0])
+        compiled.append((fact, values))
+    return tuple(compiled)
+
+
+def describe_condition(condition):
+    """Returns a condition as it could be written in a config, for messages."""
+    if not isinstance(condition, tuple):
+        return condition
+    parts = []
+    for fact, values in condition:
+        if fact == "not":
+            text = describe_condition(values)
+        elif fact == "env":
+            text = ", ".join(
+                name if value is None else "%s=%s" % (name, value) for name, value in values)
+        else:
+            text = ", ".join(values)
+        parts.append("%s: %s" % (fact, text))
+    return "{%s}" % "; ".join(parts)
+
+
+def _strings(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(str(item) for item in value)
+    return (str(value),)
+
+
+def _string(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        # as YAML would write it, and as it is usually spelled in the environment
+        return "true" if value else "false"
+    return str(value)
@@ -1,29 +1,219 @@
-import yaml
-import json
+import hashlib
+import marshal
+import sys
 import os.path
 from .util import string
+from .util.common import cache_directory
+from .messenger import Messenger
+
+
+# keys of a task that are not directives
+_task_keys = ("id", "after")
 
 
 class ConfigReader(object):
-    def __init__(self, config_file_path):
+    """
+    Reads a config file, replacing each `include` task with the tasks of the
+    files it names.
+
+    If only or skip are given (the directives of --only and --except), the
+    included files none of whose directives would run are not read, if the
+    include declares their directives, or not loaded from the parse cache,
+    which knows the directives of every file it has parsed.
+    """
+
+    def __init__(self, config_file_path, only=None, skip=None):
+        self._log = Messenger()
+        self._only = only
+        self._skip = skip
+        self._files = [os.path.realpath(config_file_path)]
         self._config = self._read(config_file_path)
+        self._config = self._expand(
+            self._config, os.path.dirname(os.path.abspath(config_file_path)), tuple(self._files))
 
-    def _read(self, config_file_path):
+    def _read(self, config_file_path, wanted=None):
         try:
             _, ext = os.path.splitext(config_file_path)
-            with open(config_file_path) as fin:
-                if ext == ".json":
-                    data = json.load(fin)
-                else:
-                    data = yaml.safe_load(fin)
+            with open(config_file_path, "rb") as fin:
+                content = fin.read()
+            if ext == ".json":
+                import json
+                data = json.loads(content.decode("utf-8"))
+            else:
+                data = self._load_yaml(config_file_path, content, wanted)
             return data
         except Exception as e:
             msg = string.indent_lines(str(e))
             raise ReadingError("Could not read config file:\n%s" % msg)
 
+    def _load_yaml(self, config_file_path, content, wanted=None):
+        cache = ParseCache.for_config(config_file_path)
+        digest = hashlib.sha1(content).hexdigest()
+        hit, data = cache.get(digest, wanted)
+        if hit:
+            self._log.debug("Config cache hit for %s" % config_file_path)
+            return data
+        # yaml is only imported when a config actually has to be parsed
+        import yaml
+        # the libyaml bindings are much faster, but are not always built
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        self._log.debug("Config cache miss for %s, parsing with %s" %
+                        (config_file_path, loader.__name__))
+        data = yaml.load(content, Loader=loader)
+        cache.put(digest, data)
+        return data
+
     def get_config(self):
         return self._config
 
+    def files(self):
+        """Returns the real paths of the config file and of the files it included."""
+        return list(self._files)
+
+    def _expand(self, tasks, directory, stack):
+        """
+        Returns the tasks with each `include` replaced by the tasks of the
+        files it names, relative to directory. stack holds the files being
+        included, to catch a file that includes itself.
+        """
+        if not isinstance(tasks, list):
+            return tasks
+        if not any(isinstance(task, dict) and "include" in task for task in tasks):
+            return tasks
+        expanded = []
+        for task in tasks:
+            if not (isinstance(task, dict) and "include" in task):
+                expanded.append(task)
+                continue
+            if len(task) > 1:
+                raise ReadingError("An include must be the only key of its task")
+            for path, declared in self._included(task["include"], directory):
+                expanded.extend(self._include(path, declared, stack))
+        return expanded
+
+    def _included(self, data, directory):
+        """
+        Yields (path, directives) for the files an include names, in order,
+        with directives None unless the include declares them.
+        """
+        for item in data if isinstance(data, list) else [data]:
+            declared = None
+            if isinstance(item, dict):
+                declared = item.get("directives")
+                if isinstance(declared, str):
+                    declared = [declared]
+                item = item.get("path")
+            if not isinstance(item, str):
+                raise ReadingError("An include must name config files, not %r" % (item,))
+            pattern = os.path.join(directory, os.path.expandvars(os.path.expanduser(item)))
+            if any(character in pattern for character in "*?["):
+                import glob
+                paths = sorted(glob.glob(pattern))
+            else:
+                paths = [pattern]
+            for path in paths:
+                yield os.path.normpath(path), declared
+
+    def _include(self, path, declared, stack):
+        real = os.path.realpath(path)
+        if real in stack:
+            raise ReadingError("Config file %s includes itself" % path)
+        if declared is not None and not self._wanted(declared):
+            self._log.debug("Not reading %s, none of its directives run" % path)
+            return []
+
+        def wanted(directives):
+            if self._wanted(directives):
+                return True
+            self._log.debug("Not loading %s, none of its directives run" % path)
+            return False
+
+        tasks = self._read(path, wanted if self._only is not None or self._skip is not None else None)
+        if real not in self._files:
+            self._files.append(real)
+        if tasks is None:
+            return []
+        if not isinstance(tasks, list):
+            raise ReadingError("Included config file %s must be a list of tasks" % path)
+        return self._expand(tasks, os.path.dirname(path), stack + (real,))
+
+    def _wanted(self, directives):
+        """Returns true if any of the directives would run."""
+        for directive in directives:
+            # defaults apply to the tasks after them, and an include can
+            # bring in anything
+            if directive in ("defaults", "include"):
+                return True
+            if ((self._only is None or directive in self._only)
+                    and (self._skip is None or directive not in self._skip)):
+                return True
+        return False
+
+
+class ParseCache(object):
+    """
+    The parsed form of a config file, stored with the hash of the content it
+    was parsed from and the directives its tasks use. There is one entry per
+    config file, replaced whenever the content changes.
+
+    Entries are written with marshal, which is compact and quick to load but
+    specific to the Python version, so the version is part of the entry. The
+    header and the directives come first, so that they can be checked
+    without loading the data.
+    """
+
+    version = 2
+
+    def __init__(self, path):
+        self._path = path
+
+    @classmethod
+    def for_config(cls, config_file_path):
+        name = hashlib.sha1(os.path.abspath(config_file_path).encode("utf-8")).hexdigest()
+        return cls(os.path.join(cache_directory(), "config", name))
+
+    def _header(self, digest):
+        return (self.version, tuple(sys.version_info[:2]), digest)
+
+    def get(self, digest, wanted=None):
+        """
+        Returns a (hit, data) pair. If wanted is given, it is called with the
+        directives of the cached config, and the data is only loaded (and
+        otherwise None) if it returns true.
+        """
+        try:
+            with open(self._path, "rb") as fin:
+                header, directives = marshal.load(fin)
+                if header != self._header(digest):
+                    return False, None
+                if wanted is not None and not wanted(directives):
+                    return True, None
+                data = marshal.load(fin)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False, None
+        return True, data
+
+    def put(self, digest, data):
+        directives = set()
+        if isinstance(data, list):
+            for task in data:
+                if isinstance(task, dict):
+                    directives.update(key for key in task if key not in _task_keys)
+        try:
+            encoded = marshal.dumps((self._header(digest), tuple(sorted(directives, key=str))))
+            encoded += marshal.dumps(data)
+        except ValueError:
+            # values marshal cannot store, such as timestamps
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            temporary = "%s.%d.tmp" % (self._path, os.getpid())
+            with open(temporary, "wb") as fout:
+                fout.write(encoded)
+            os.replace(temporary, self._path)
+        except OSError:
+            pass
+
 
 class ReadingError(Exception):
     pass
@@ -1,7 +1,11 @@
-import copy
 import os
 from argparse import Namespace
 
+from .directories import Directories
+from .fs import FileSystem
+from .shells import ShellPool
+from .util.common import freeze
+
 
 class Context(object):
     """
@@ -9,25 +13,125 @@ class Context(object):
     """
 
     def __init__(self, base_directory, options=Namespace()):
-        self._base_directory = base_directory
-        self._defaults = {}
+        self.set_base_directory(base_directory)
+        self.set_defaults({})
         self._options = options
-        pass
+        self._options_view = _ReadOnlyOptions(options)
+        self._state = None
+        self._conditions = None
+        self._link_index = None
+        self._filesystem = FileSystem()
+        self._directories = Directories(self._filesystem)
+        self._shells = ShellPool(persistent=getattr(options, 'persistent_shell', False))
 
     def set_base_directory(self, base_directory):
         self._base_directory = base_directory
+        self._canonical_base_directory = os.path.realpath(base_directory)
 
     def base_directory(self, canonical_path=True):
-        base_directory = self._base_directory
         if canonical_path:
-            base_directory = os.path.realpath(base_directory)
-        return base_directory
+            return self._canonical_base_directory
+        return self._base_directory
 
     def set_defaults(self, defaults):
-        self._defaults = defaults
+        self._defaults = defaults if defaults is not None else {}
+        self._frozen_defaults = freeze(self._defaults)
 
     def defaults(self):
+        """
+        Returns the current defaults as a read-only mapping, with lists
+        turned into tuples. Use mutable_defaults() for a copy to change.
+        """
+        return self._frozen_defaults
+
+    def mutable_defaults(self):
+        """Returns a copy of the current defaults that can be changed."""
+        import copy
+
         return copy.deepcopy(self._defaults)
 
     def options(self):
+        """
+        Returns a read-only view of the command-line options, with lists
+        turned into tuples. Use mutable_options() for a copy to change.
+        """
+        return self._options_view
+
+    def mutable_options(self):
+        """Returns a copy of the command-line options that can be changed."""
+        import copy
+
         return copy.deepcopy(self._options)
+
+    def set_state(self, state):
+        self._state = state
+
+    def state(self):
+        """
+        Returns the dotbot.state.State for incremental runs, or None if every
+        entry should be applied in full.
+        """
+        return self._state
+
+    def set_link_index(self, link_index):
+        self._link_index = link_index
+
+    def link_index(self):
+        """
+        Returns the dotbot.state.LinkIndex of the links dotbot manages, or
+        None if they are not being recorded.
+        """
+        return self._link_index
+
+    def set_conditions(self, conditions):
+        self._conditions = conditions
+
+    def conditions(self):
+        """
+        Returns the dotbot.conditions.Conditions that caches the results of
+        `if:` conditions for this run.
+        """
+        return self._conditions
+
+    def filesystem(self):
+        """
+        Returns the dotbot.fs.FileSystem that plugins should look at and
+        change the filesystem through, so that lookups are shared.
+        """
+        return self._filesystem
+
+    def directories(self):
+        """
+        Returns the dotbot.directories.Directories that plugins should create
+        directories with, so that each is only checked and created once.
+        """
+        return self._directories
+
+    def shells(self):
+        """
+        Returns the dotbot.shells.ShellPool that plugins should run shell
+        commands with, so that they can share persistent shells.
+        """
+        return self._shells
+
+
+class _ReadOnlyOptions(object):
+    """A read-only view of an argparse.Namespace."""
+
+    __slots__ = ("_values",)
+
+    def __init__(self, options):
+        object.__setattr__(self, "_values", freeze(dict(vars(options))))
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The options are read-only")
+
+    def __repr__(self):
+        return "Namespace(%s)" % ", ".join(
+            "%s=%r" % (name, value) for name, value in sorted(self._values.items()))
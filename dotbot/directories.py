@@ -0,0 +1,76 @@
+import os
+
+from .util.parallel import run_grouped
+
+
+class Directories(object):
+    """
+    Creates the directories plugins need, each at most once per directive.
+
+    Whether a directory exists is looked up through the run's
+    dotbot.fs.FileSystem, which remembers the directories that were found or
+    created, so a chain of ancestors shared by many entries is only checked
+    once.
+    """
+
+    def __init__(self, filesystem):
+        self._filesystem = filesystem
+
+    def ensure(self, path, mode=0o777):
+        """
+        Creates path and any missing ancestors, like os.makedirs(): mode only
+        applies to path itself. Returns true if path was created and false
+        if it already was a directory. Raises OSError if it cannot be
+        created.
+        """
+        filesystem = self._filesystem
+        if filesystem.isdir(path):
+            return False
+        missing = [path]
+        parent = os.path.dirname(path)
+        while parent != missing[-1] and not filesystem.isdir(parent):
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+        for directory in reversed(missing):
+            try:
+                filesystem.mkdir(directory, mode if directory == path else 0o777)
+            except FileExistsError:
+                # created by another thread (or program) meanwhile
+                if not filesystem.isdir(directory):
+                    raise
+        return True
+
+    def ensure_all(self, directories, jobs=1):
+        """
+        Creates the (path, mode) directories, shallowest first, running the
+        directories that are not inside one another on up to `jobs` threads.
+        The first mode given for a path wins.
+
+        Returns a dict mapping each path to (created, error): whether it was
+        created, and the OSError that kept it from being created, if any.
+        """
+        modes = {}
+        for path, mode in directories:
+            modes.setdefault(path, 0o777 if mode is None else mode)
+        paths = sorted(modes, key=lambda path: (path.count(os.sep), path))
+        # a directory is created after the ones given that it is inside
+        groups = {}
+        for path in paths:
+            group = path
+            parent = os.path.dirname(path)
+            while parent != os.path.dirname(parent):
+                if parent in groups:
+                    group = groups[parent]
+                    break
+                parent = os.path.dirname(parent)
+            groups[path] = group
+
+        def create(path):
+            try:
+                return self.ensure(path, modes[path]), None
+            except OSError as e:
+                return False, e
+
+        results = run_grouped(
+            [(groups[path], lambda path=path: create(path)) for path in paths], jobs)
+        return dict(zip(paths, results))
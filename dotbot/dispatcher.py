@@ -1,11 +1,16 @@
 import os
+import time
 from argparse import Namespace
 # from pprint import pprint
 
 from .plugin import Plugin
-from .messenger import Messenger
+from .messenger import Level, Messenger
 from .context import Context
-import traceback
+from . import trace
+
+
+# keys of a task that say how it is ordered, rather than being directives
+_task_keys = ('id', 'after')
 
 
 class Dispatcher(object):
@@ -16,18 +21,43 @@ class Dispatcher(object):
         self._load_plugins()
         self._only = only
         self._skip = skip
+        self._timings = []
 
     def _setup_context(self, base_directory, options):
+        from .journal import Journal
+        from .state import LinkIndex
+
         path = os.path.abspath(os.path.expanduser(base_directory))
         if not os.path.exists(path):
             raise DispatchError('Nonexistent base directory')
         self._context = Context(path, options)
+        self._context.set_conditions(self._new_conditions())
+        self._journal = Journal.for_base_directory(self._context.base_directory())
+        self._context.filesystem().set_journal(self._journal)
+        self._context.set_link_index(LinkIndex.for_base_directory(self._context.base_directory()))
+        if not getattr(options, 'full', True):
+            from .state import State
+            self._context.set_state(State.for_base_directory(self._context.base_directory()))
 
-    def dispatch(self, tasks):
-        # pprint(tasks)
-        success = True
+    def _new_conditions(self, target=None):
+        from .conditions import Conditions
+
+        return Conditions(self._context.base_directory(),
+                          Conditions.default_path(None if target is None else target.name()),
+                          reuse=not getattr(self._context.options(), 'full', False),
+                          shells=self._context.shells())
+
+    def _actions(self, tasks):
+        """
+        Yields (action, data, task) for every action that should run,
+        skipping those excluded by --only/--except. Defaults are applied as
+        they are reached, so plugins see the defaults that precede their
+        action.
+        """
         for task in tasks:
             for action in task.keys():
+                if action in _task_keys:
+                    continue
                 if (
                     self._only is not None
                     and action not in self._only
@@ -36,28 +66,352 @@ class Dispatcher(object):
                 ) and action != "defaults":
                     self._log.info("Skipping action %s" % action)
                     continue
-                handled = False
                 if action == 'defaults':
                     self._context.set_defaults(task[action])  # replace, not update
-                    handled = True
                     # keep going, let other plugins handle this if they want
-                for plugin in self._plugins:
-                    if plugin.can_handle(action):
-                        try:
-                            success &= plugin.handle(action, task[action])
-                            handled = True
-                        except Exception as err:
-                            print("failure", err)
-                            traceback.print_exception(type(err), err, err.__traceback__)
-                            self._log.error('An error was encountered while executing action "%s"' % action)
-                            self._log.debug(err)
-                if not handled:
-                    success = False
-                    self._log.error('Action %s not handled' % action)
+                yield action, task[action], task
+
+    def _call(self, plugin, action, method, *args):
+        """
+        Calls a plugin method, logging instead of propagating errors.
+
+        Returns a (handled, result) pair.
+        """
+        try:
+            return True, getattr(plugin, method)(action, *args)
+        except Exception as err:
+            import traceback
+            self._log.error('An error was encountered while executing action "%s" (%s)', action, err)
+            self._log.debug(''.join(
+                traceback.format_exception(type(err), err, err.__traceback__)).rstrip())
+            return False, None
+
+    def compile(self, tasks):
+        """
+        Compiles the tasks from a config file: every action that will run is
+        handed to the plugins that handle it, which resolve its data up
+        front (see Plugin.compile).
+
+        Returns a list of Task objects that can be passed to dispatch() or
+        plan().
+        """
+        self._context.set_defaults({})
+        compiled = []
+        with trace.span("compile"):
+            for action, data, task in self._actions(tasks):
+                handlers = []
+                for plugin in self._plugins_for(action):
+                    called, result = self._call(plugin, action, 'compile', data)
+                    handlers.append((plugin, called, result))
+                name, after = self._ordering(task)
+                compiled.append(Task(action, data, handlers, name, after))
+        self._context.set_defaults({})
+        return compiled
+
+    def _ordering(self, task):
+        """Returns the `id` and `after` keys of a task from the config."""
+        name = task.get('id')
+        after = task.get('after')
+        if isinstance(after, str):
+            after = [after]
+        if after is not None and not (
+                isinstance(after, list) and all(isinstance(other, str) for other in after)):
+            self._log.error('The `after` of a task must be a task id or a list of them')
+            after = None
+        return (None if name is None else str(name),
+                None if after is None else tuple(after))
+
+    def _compiled(self, tasks):
+        """Yields the compiled tasks, setting defaults as they are reached."""
+        if not all(isinstance(task, Task) for task in tasks):
+            tasks = self.compile(tasks)
+        for task in tasks:
+            if task.action == 'defaults':
+                self._context.set_defaults(task.data)  # replace, not update
+            yield task
+        self._context.set_defaults({})
+
+    def dispatch(self, tasks, partial=False):
+        """
+        Runs the tasks. If partial, they are only some of the tasks of the
+        config (see dotbot.watch), so the state of the others is kept.
+        """
+        complete = not partial and self._only is None and self._skip is None
+        jobs = getattr(self._context.options(), 'schedule', None)
+        if jobs is not None and jobs > 1:
+            success = self._schedule(list(self._compiled(tasks)), jobs, complete)
+        else:
+            success = True
+            for index, task in enumerate(self._compiled(tasks)):
+                success &= self._run_task(index, task)
+        if getattr(self._context.options(), 'prune', False):
+            if complete:
+                with trace.span("prune"):
+                    success &= self._prune()
+            else:
+                self._log.debug("Not pruning links, as only some directives ran")
+        self._context.link_index().save()
+        state = self._context.state()
+        if state is not None:
+            # a filtered run only looks at some entries, keep the others
+            state.save(prune=complete)
+        self._finish()
+        return success
+
+    def _run_task(self, index, task):
+        """Runs a compiled task, returning whether it succeeded."""
+        start = time.perf_counter()
+        success = True
+        # the directives before may have changed anything
+        self._context.filesystem().clear()
+        handled = task.action == 'defaults'
+        if handled:
+            self._context.set_defaults(task.data)  # replace, not update
+        with trace.span("task %s" % task.action, index=index):
+            for plugin, compiled, data in task.handlers:
+                if not compiled:
+                    continue
+                with trace.span("%s.handle" % type(plugin).__name__) as span:
+                    called, result = self._call(plugin, task.action, 'handle', data)
+                    span.set(success=bool(called and result))
+                if called:
+                    success &= result
+                    handled = True
+        if not handled:
+            success = False
+            self._log.error('Action %s not handled' % task.action)
+        if task.action != 'defaults':
+            self._timings.append((task.action, time.perf_counter() - start))
+        self._journal.flush()
+        return success
+
+    def _schedule(self, tasks, jobs, complete):
+        """
+        Runs the compiled tasks on up to `jobs` threads, each once the tasks
+        it depends on are done (see dotbot.scheduler), and reports the
+        critical path.
+        """
+        from . import scheduler
+
+        try:
+            nodes = scheduler.graph(tasks, strict=complete)
+        except scheduler.SchedulingError as e:
+            self._log.error('%s', e)
+            return False
+        start = time.perf_counter()
+        with trace.span("schedule", tasks=len(nodes), jobs=jobs):
+            success = scheduler.run(nodes, self._run_task, jobs)
+        elapsed = time.perf_counter() - start
+        self._context.set_defaults({})
+        path = scheduler.critical_path(nodes)
+        if path:
+            level = Level.INFO if getattr(self._context.options(), 'timing', False) else Level.DEBUG
+            self._log.log(
+                level, 'Critical path: %s (%.1f ms of %.1f ms)',
+                ' -> '.join('%s %.1f ms' % (node.name(), node.duration * 1000) for node in path),
+                sum(node.duration for node in path) * 1000, elapsed * 1000)
         return success
 
+    def _prune(self):
+        """
+        Removes the managed links (see dotbot.state.LinkIndex) that this run
+        did not produce, or whose source is gone, unless they have been
+        changed since dotbot made them.
+        """
+        index = self._context.link_index()
+        filesystem = self._context.filesystem()
+        filesystem.clear()
+        success = True
+        for destination, target, _, produced in index.links():
+            if not filesystem.islink(destination) or filesystem.readlink(destination) != target:
+                # removed or replaced by someone else, it is theirs now
+                index.forget(destination)
+                continue
+            if produced and filesystem.exists(destination):
+                continue
+            try:
+                filesystem.unlink(destination)
+            except OSError as e:
+                self._log.warning("Failed to remove %s (%s)", destination, e)
+                self._log.count("prune", "failed")
+                success = False
+                continue
+            index.forget(destination)
+            self._log.lowinfo("Removing stale link %s -> %s", destination, target)
+            self._log.count("prune", "removed")
+        self._journal.flush()
+        return success
+
+    def retarget(self, tasks, target):
+        """
+        Returns compiled tasks (see compile()) with their destinations moved
+        to a dotbot.targets.Target, and from then on keeps the incremental
+        state, the journal and the link index of the target separately.
+        """
+        from .journal import Journal
+        from .state import LinkIndex, State
+
+        # conditions can depend on the target's $HOME
+        self._context.set_conditions(self._new_conditions(target))
+        if self._context.state() is not None:
+            self._context.set_state(State.for_base_directory(
+                self._context.base_directory(), target=target.name()))
+        self._journal = Journal.for_base_directory(
+            self._context.base_directory(), target=target.name())
+        self._context.filesystem().set_journal(self._journal)
+        self._context.set_link_index(LinkIndex.for_base_directory(
+            self._context.base_directory(), target=target.name()))
+        retargeted = []
+        for task in tasks:
+            handlers = []
+            for plugin, compiled, data in task.handlers:
+                if compiled:
+                    compiled, data = self._call(plugin, task.action, 'retarget', data, target)
+                handlers.append((plugin, compiled, data))
+            retargeted.append(Task(task.action, task.data, handlers, task.name, task.after))
+        return retargeted
+
+    def rollback(self):
+        """
+        Undoes the changes made by the last run that changed anything (see
+        dotbot.journal). Returns whether everything could be undone.
+        """
+        return self._journal.rollback()
+
+    def timings(self):
+        """
+        Returns (directive, seconds) pairs for the directives dispatched so
+        far, in order.
+        """
+        return list(self._timings)
+
+    def _finish(self):
+        conditions = self._context.conditions()
+        conditions.report()
+        conditions.save()
+        self._context.shells().close()
+        lookups, syscalls = self._context.filesystem().statistics()
+        if lookups:
+            self._log.debug("Answered %d filesystem lookups with %d system calls",
+                            lookups, syscalls)
+
+    def plan(self, tasks):
+        """
+        Works out what dispatching the tasks would do, without doing it.
+
+        Returns a (success, plan) pair.
+        """
+        from .plan import Plan
+
+        success = True
+        plan = Plan(self._context.base_directory())
+        for task in self._compiled(tasks):
+            action = task.action
+            if action == 'defaults':
+                continue  # already folded into the planned actions
+            if not task.handlers:
+                success = False
+                self._log.error('Action %s not handled' % action)
+                continue
+            plugin, compiled, data = task.handlers[0]
+            if not compiled:
+                success = False
+                continue
+            self._context.filesystem().clear()
+            try:
+                planned, actions = plugin.plan(action, data)
+            except NotImplementedError:
+                success = False
+                self._log.error('Action %s cannot be planned' % action)
+                continue
+            except Exception as err:
+                success = False
+                self._log.error('An error was encountered while planning action "%s"' % action)
+                self._log.debug(err)
+                continue
+            success &= planned
+            plan.add(action, actions)
+        self._finish()
+        return success, plan
+
+    def apply(self, plan):
+        """
+        Executes a plan produced by plan(), possibly on another machine.
+        """
+        success = True
+        for action, actions in plan.tasks:
+            if (
+                self._only is not None
+                and action not in self._only
+                or self._skip is not None
+                and action in self._skip
+            ):
+                self._log.info("Skipping action %s" % action)
+                continue
+            plugin = self._plugin_for(action)
+            if plugin is None:
+                success = False
+                self._log.error('Action %s not handled' % action)
+                continue
+            start = time.perf_counter()
+            self._context.filesystem().clear()
+            with trace.span("%s.apply" % type(plugin).__name__, actions=len(actions)):
+                called, result = self._call(plugin, action, 'apply', actions)
+            success &= called and result
+            self._timings.append((action, time.perf_counter() - start))
+            self._journal.flush()
+        self._context.link_index().save()
+        self._context.shells().close()
+        return success
+
+    def _plugin_for(self, action):
+        """Returns the plugin that plans and applies an action, if any."""
+        plugins = self._plugins_for(action)
+        return plugins[0] if plugins else None
+
+    def _plugins_for(self, action):
+        """Returns the plugins that handle an action, in load order."""
+        plugins = self._index.get(action)
+        if plugins is None:
+            plugins = [
+                plugin for plugin in self._plugins
+                if (action in plugin.directives if plugin.directives else plugin.can_handle(action))
+            ]
+            self._index[action] = plugins
+        return plugins
+
     def _load_plugins(self):
         self._plugins = [plugin(self._context) for plugin in Plugin.__subclasses__()]
+        # directive -> plugins, filled in as directives are seen
+        self._index = {}
+
+    def update_plugins(self):
+        """
+        Adds the plugins imported since the dispatcher was created, e.g. for
+        a directive that a watched config has started to use.
+        """
+        loaded = set(type(plugin) for plugin in self._plugins)
+        added = [plugin for plugin in Plugin.__subclasses__() if plugin not in loaded]
+        if added:
+            self._plugins.extend(plugin(self._context) for plugin in added)
+            self._index = {}
+
+
+class Task(object):
+    """
+    An action from the config, along with the data each plugin that handles
+    it compiled for it, as (plugin, compiled successfully, data) tuples.
+    """
+
+    __slots__ = ('action', 'data', 'handlers', 'name', 'after')
+
+    def __init__(self, action, data, handlers, name=None, after=None):
+        self.action = action
+        self.data = data
+        self.handlers = handlers
+        # the `id` and `after` keys of the task, for --schedule
+        self.name = name
+        self.after = after
 
 
 class DispatchError(Exception):
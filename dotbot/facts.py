@@ -0,0 +1,88 @@
+import os
+import sys
+import threading
+
+# names a config can use for an operating system, and what they stand for
+_systems = {
+    "linux": "linux",
+    # WSL has always counted as Linux
+    "wsl": "linux",
+    "windows": "windows",
+    "nt": "windows",
+    "macos": "macos",
+    "darwin": "macos",
+    "osx": "macos",
+    "freebsd": "freebsd",
+    "openbsd": "openbsd",
+    "netbsd": "netbsd",
+}
+
+
+class Facts(object):
+    """
+    Facts about the machine dotbot runs on, each looked up at most once and
+    shared by every directive (see host()).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hostname = None
+        self._programs = {}
+
+    def system(self):
+        """Returns the operating system: linux, windows, macos, freebsd, openbsd or netbsd."""
+        platform = sys.platform
+        if platform.startswith("linux"):
+            return "linux"
+        if platform == "win32":
+            return "windows"
+        if platform == "darwin":
+            return "macos"
+        for name in ("freebsd", "openbsd", "netbsd"):
+            if platform.startswith(name):
+                return name
+        return platform
+
+    def is_system(self, name):
+        """
+        Returns true if the operating system is the one named. Raises KeyError
+        for names it does not know.
+        """
+        system = _systems.get(name.lower())
+        if system is None:
+            raise KeyError("Unknown/ unsupported operating system constraint "
+                           "supplied: %s" % name)
+        return system == self.system()
+
+    def hostname(self):
+        """Returns the host name, in lower case."""
+        if self._hostname is None:
+            import socket
+            self._hostname = socket.gethostname().lower()
+        return self._hostname
+
+    def is_host(self, name):
+        """Returns true if name is the host name, with or without its domain."""
+        hostname = self.hostname()
+        name = name.lower()
+        return name == hostname or name == hostname.split(".", 1)[0]
+
+    def which(self, program):
+        """Returns the path of a program on $PATH, or None."""
+        key = (program, os.environ.get("PATH"))
+        with self._lock:
+            if key in self._programs:
+                return self._programs[key]
+        import shutil
+        path = shutil.which(program)
+        with self._lock:
+            self._programs[key] = path
+        return path
+
+
+_host = Facts()
+
+
+def host():
+    """Returns the Facts about this machine."""
+    return _host
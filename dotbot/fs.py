@@ -0,0 +1,414 @@
+import errno
+import os
+import stat
+import sys
+import threading
+
+# what a path is, as far as plugins are concerned
+MISSING = "missing"
+LINK = "link"
+DIRECTORY = "directory"
+OTHER = "other"
+
+
+class FileSystem(object):
+    """
+    The filesystem as plugins see it during a run.
+
+    What a path is (lstat) and what a link says (readlink) are looked up
+    once and then remembered. When dotbot changes a path through one of the
+    methods below, what it knew about the path is forgotten. Changes made any
+    other way, e.g. by a shell command, are not seen until clear() is called.
+    The dispatcher calls it before every directive.
+
+    Changes are recorded in the journal, if one is set, so that they can be
+    rolled back (see dotbot.journal). What a change removes is then moved to
+    the journal rather than deleted.
+
+    Paths are used as given, so they should be absolute and normalized.
+    Changes to a path should not race with lookups of it from another thread.
+    Plugins already run operations on the same directory one after another.
+    """
+
+    # a directory is listed rather than looking its entries up one by one
+    # once this many of them are wanted
+    _prefetch_threshold = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> MISSING, LINK, DIRECTORY or OTHER
+        self._kinds = {}
+        # link -> its text
+        self._links = {}
+        # link -> the kind of what it points at
+        self._targets = {}
+        self._lookups = 0
+        self._syscalls = 0
+        self._journal = None
+
+    def set_journal(self, journal):
+        self._journal = journal
+
+    def clear(self):
+        """Forgets everything, for when the filesystem may have changed."""
+        with self._lock:
+            self._kinds.clear()
+            self._links.clear()
+            self._targets.clear()
+
+    def statistics(self):
+        """Returns (lookups, system calls) so far."""
+        return self._lookups, self._syscalls
+
+    def kind(self, path):
+        """Returns what path is, without following a link: MISSING, LINK, DIRECTORY or OTHER."""
+        with self._lock:
+            self._lookups += 1
+            kind = self._kinds.get(path)
+        if kind is None:
+            try:
+                info = os.lstat(path)
+            except OSError:
+                kind = MISSING
+            else:
+                kind = _kind(info.st_mode)
+            with self._lock:
+                self._syscalls += 1
+                self._kinds[path] = kind
+        return kind
+
+    def exists(self, path):
+        """Returns true if path exists, false if it is missing or a broken link."""
+        return self._followed(path) != MISSING
+
+    def isdir(self, path):
+        """Returns true if path is a directory or a link to one."""
+        return self._followed(path) == DIRECTORY
+
+    def islink(self, path):
+        return self.kind(path) == LINK
+
+    def readlink(self, path):
+        """Returns the text of a link, raising OSError if path is not one."""
+        if self.kind(path) != LINK:
+            # saves asking the system for an answer already known
+            raise OSError(22, "Not a symbolic link", path)
+        with self._lock:
+            text = self._links.get(path)
+        if text is None:
+            text = os.readlink(path)
+            with self._lock:
+                self._syscalls += 1
+                self._links[path] = text
+        return text
+
+    def listdir(self, path):
+        """
+        Returns the os.DirEntry objects of a directory, sorted by name, and
+        remembers what each of them is. Raises OSError if it cannot be listed.
+        """
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        with self._lock:
+            self._lookups += 1
+            self._syscalls += 1
+            for entry in entries:
+                self._kinds.setdefault(entry.path, _entry_kind(entry))
+        return entries
+
+    def prefetch(self, paths):
+        """
+        Looks up paths ahead of their use, listing each directory that holds
+        several of them once instead of looking each one up.
+        """
+        by_directory = {}
+        with self._lock:
+            for path in paths:
+                if path not in self._kinds:
+                    by_directory.setdefault(os.path.dirname(path), set()).add(path)
+        for directory, wanted in by_directory.items():
+            if len(wanted) < self._prefetch_threshold:
+                continue
+            kinds = dict.fromkeys(wanted, MISSING)
+            # nothing is in a directory known not to be one
+            if self._kinds.get(directory) not in (MISSING, OTHER):
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.path in kinds:
+                                kinds[entry.path] = _entry_kind(entry)
+                except (FileNotFoundError, NotADirectoryError):
+                    pass
+                except OSError:
+                    # e.g. not allowed to list it, the paths may still exist
+                    continue
+                finally:
+                    with self._lock:
+                        self._syscalls += 1
+            with self._lock:
+                for path, kind in kinds.items():
+                    self._kinds.setdefault(path, kind)
+
+    def mkdir(self, path, mode=0o777):
+        """Creates a directory in one that exists."""
+        try:
+            os.mkdir(path, mode)
+        finally:
+            self._changed(path)
+        with self._lock:
+            self._kinds[path] = DIRECTORY
+        if self._journal is not None:
+            self._journal.record("mkdir", path)
+
+    def symlink(self, text, path):
+        try:
+            os.symlink(text, path)
+        finally:
+            self._changed(path)
+        if self._journal is not None:
+            self._journal.record("symlink", path, target=text)
+
+    def replace_symlink(self, text, path):
+        """
+        Makes path a link with the given text in one step, replacing the link
+        or file that is there, so that path never goes missing.
+        """
+        from .journal import replace_symlink
+
+        previous = {}
+        if self._journal is not None:
+            kind = self.kind(path)
+            if kind == LINK:
+                previous["previous"] = self.readlink(path)
+            elif kind == OTHER:
+                previous["backup"] = self._journal.backup(path, keep=True)
+        try:
+            replace_symlink(text, path)
+        finally:
+            self._changed(path)
+        if self._journal is not None:
+            operation = "replace" if previous else "symlink"
+            self._journal.record(operation, path, target=text, **previous)
+
+    def unlink(self, path):
+        """Removes a link or a file."""
+        try:
+            if self._journal is None:
+                os.unlink(path)
+            elif self.kind(path) == LINK:
+                previous = self.readlink(path)
+                os.unlink(path)
+                self._journal.record("remove", path, previous=previous)
+            else:
+                self._journal.record("remove", path, backup=self._journal.backup(path))
+        finally:
+            self._changed(path)
+
+    def remove(self, path):
+        self.unlink(path)
+
+    def copy(self, source, path):
+        """
+        Copies the file source to path in one step (see copy_file()),
+        replacing the file or link that is there. Returns how the data was
+        copied.
+        """
+        previous = {}
+        if self._journal is not None:
+            kind = self.kind(path)
+            if kind == LINK:
+                previous["previous"] = self.readlink(path)
+            elif kind == OTHER:
+                previous["backup"] = self._journal.backup(path, keep=True)
+        try:
+            method, info = copy_file(source, path)
+        finally:
+            self._changed(path)
+        if self._journal is not None:
+            self._journal.record("copy", path, size=info.st_size, mtime=info.st_mtime_ns,
+                                 **previous)
+        return method
+
+    def rmtree(self, path):
+        try:
+            if self._journal is None:
+                import shutil
+
+                shutil.rmtree(path)
+            else:
+                self._journal.record("remove", path, backup=self._journal.backup(path))
+        finally:
+            self._changed(path, descendants=True)
+
+    def _followed(self, path):
+        """Returns what path is, following a link."""
+        kind = self.kind(path)
+        if kind != LINK:
+            return kind
+        with self._lock:
+            kind = self._targets.get(path)
+        if kind is None:
+            try:
+                info = os.stat(path)
+            except OSError:
+                kind = MISSING
+            else:
+                kind = _kind(info.st_mode)
+            with self._lock:
+                self._syscalls += 1
+                self._targets[path] = kind
+        return kind
+
+    def _changed(self, path, descendants=False):
+        """Forgets what is known about a path that dotbot changed."""
+        with self._lock:
+            self._kinds.pop(path, None)
+            self._links.pop(path, None)
+            # links anywhere may point at or through the path
+            self._targets.clear()
+            if descendants:
+                below = os.path.join(path, "")
+                for cache in (self._kinds, self._links):
+                    for key in [key for key in cache if key.startswith(below)]:
+                        del cache[key]
+
+
+def _kind(mode):
+    if stat.S_ISLNK(mode):
+        return LINK
+    if stat.S_ISDIR(mode):
+        return DIRECTORY
+    return OTHER
+
+
+def _entry_kind(entry):
+    # the type comes with the listing on most filesystems
+    if entry.is_symlink():
+        return LINK
+    if entry.is_dir(follow_symlinks=False):
+        return DIRECTORY
+    return OTHER
+
+
+def copy_file(source, path):
+    """
+    Copies the file source to path in one step: the data goes into a
+    temporary file next to path, which is then renamed over it. The mode and
+    modification time are copied too.
+
+    The data is cloned where the filesystem supports it (FICLONE), and
+    otherwise copied by the kernel (copy_file_range(), then sendfile()), so
+    that it does not pass through Python. Returns (method, info): how the
+    data was copied ("clone", "copy_file_range", "sendfile" or "read") and
+    the os.stat() of source.
+    """
+    directory, name = os.path.split(path)
+    temporary = os.path.join(
+        directory, ".%s.dotbot-%d-%d.tmp" % (name, os.getpid(), threading.get_ident()))
+    with open(source, "rb") as fin:
+        info = os.fstat(fin.fileno())
+        try:
+            fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_BINARY, 0o600)
+            try:
+                method = _transfer(fin.fileno(), fd, info.st_size)
+            finally:
+                os.close(fd)
+            os.chmod(temporary, stat.S_IMODE(info.st_mode))
+            os.utime(temporary, ns=(info.st_atime_ns, info.st_mtime_ns))
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+    return method, info
+
+
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+# errors meaning that a way of copying is not supported for these files,
+# rather than that copying failed
+_unsupported = frozenset(
+    getattr(errno, name) for name in
+    ("EXDEV", "ENOSYS", "EINVAL", "EOPNOTSUPP", "ENOTSUP", "ENOTTY", "EBADF", "ENOTSOCK",
+     "EPERM")
+    if hasattr(errno, name))
+
+
+def _transfer(source, destination, size):
+    """Copies the data of the source fd to the empty destination fd, returning the method used."""
+    clone = _ficlone()
+    if clone is not None and size:
+        import fcntl
+        try:
+            fcntl.ioctl(destination, clone, source)
+            return "clone"
+        except OSError as e:
+            if e.errno not in _unsupported:
+                raise
+    # each method is given up on if its first call fails, when nothing has
+    # been copied yet
+    if hasattr(os, "copy_file_range"):
+        try:
+            if _kernel_copy(lambda offset: os.copy_file_range(
+                    source, destination, max(size - offset, 1 << 20), offset, offset)):
+                return "copy_file_range"
+        except _Unsupported:
+            pass
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        try:
+            if _kernel_copy(lambda offset: os.sendfile(
+                    destination, source, offset, max(size - offset, 1 << 20))):
+                return "sendfile"
+        except _Unsupported:
+            pass
+    while True:
+        data = os.read(source, 1 << 20)
+        if not data:
+            return "read"
+        view = memoryview(data)
+        while view:
+            view = view[os.write(destination, view):]
+
+
+def _kernel_copy(call):
+    """
+    Calls call(offset), which copies from offset and returns how much it
+    copied, until the end of the file. Returns true once done, and raises
+    _Unsupported if the first call fails because the method is unsupported.
+    """
+    offset = 0
+    while True:
+        try:
+            copied = call(offset)
+        except OSError as e:
+            if offset == 0 and e.errno in _unsupported:
+                raise _Unsupported()
+            raise
+        if copied == 0:
+            return True
+        offset += copied
+
+
+class _Unsupported(Exception):
+    pass
+
+
+_ficlone_request = False
+
+
+def _ficlone():
+    """Returns the ioctl request that clones a file on Linux, or None."""
+    global _ficlone_request
+    if _ficlone_request is False:
+        request = None
+        if sys.platform.startswith("linux"):
+            import fcntl
+            request = getattr(fcntl, "FICLONE", None)
+            # _IOW(0x94, 9, int), on the architectures where that is its value
+            if request is None and os.uname().machine in (
+                    "x86_64", "i386", "i686", "aarch64", "armv7l", "riscv64", "s390x"):
+                request = 0x40049409
+        _ficlone_request = request
+    return _ficlone_request
@@ -0,0 +1,245 @@
+import errno
+import json
+import os
+import stat
+import threading
+
+from .messenger import Messenger
+from .state import base_directory_key
+from .util.common import state_directory
+
+
+class Journal(object):
+    """
+    A record of every change a run made to the filesystem, from which the
+    run can be rolled back (see rollback()).
+
+    The journal of a base directory (and target) is replaced by the next run
+    that changes anything. Files and directories that the run removed are
+    moved next to the journal rather than deleted, so they are only deleted
+    for good when the journal is replaced.
+
+    Records are written as JSON lines. They are flushed after each
+    directive, so a run that is interrupted can still be rolled back up to
+    there.
+    """
+
+    version = 1
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._log = Messenger()
+        self._lock = threading.Lock()
+        self._file = None
+        self._backups = 0
+
+    @classmethod
+    def for_base_directory(cls, base_directory, target=None):
+        name = base_directory_key(base_directory, target)
+        return cls(os.path.join(state_directory(), "journal", name))
+
+    def _path(self):
+        return os.path.join(self._directory, "journal.jsonl")
+
+    def _open(self):
+        """Replaces the journal of the previous run with an empty one."""
+        if self._file is None:
+            import shutil
+            import time
+
+            shutil.rmtree(self._directory, ignore_errors=True)
+            os.makedirs(os.path.join(self._directory, "backup"))
+            self._file = open(self._path(), "w")
+            json.dump({"version": self.version, "time": time.time()}, self._file)
+            self._file.write("\n")
+        return self._file
+
+    def record(self, operation, path, **fields):
+        """
+        Records a change: "mkdir" (a directory was created), "symlink" (a link
+        was created where there was nothing), "replace" (a link replaced a
+        link or file in place), "copy" (a file was copied to path) or
+        "remove". fields says what is needed to undo it: the text of the link
+        created (`target`) or the `size` and `mtime` of the copy, and the
+        text of the link (`previous`) or the backup (`backup`) that was there
+        before.
+        """
+        fields.update(operation=operation, path=path)
+        line = json.dumps(fields) + "\n"
+        with self._lock:
+            self._open().write(line)
+
+    def backup(self, path, keep=False):
+        """
+        Moves path out of the way into the journal's backup directory, or
+        copies it there if keep is set. Returns the name of the backup.
+
+        Moving is a rename. If the journal is on another filesystem, path is
+        deleted instead, with a warning, rather than copied over: that could
+        take any amount of time and space for a directory. None is returned,
+        and rollback cannot restore it.
+        """
+        with self._lock:
+            self._open()
+            self._backups += 1
+            name = str(self._backups)
+        backup = os.path.join(self._directory, "backup", name)
+        if keep:
+            try:
+                os.link(path, backup)
+            except OSError:
+                import shutil
+
+                shutil.copy2(path, backup, follow_symlinks=False)
+        else:
+            try:
+                os.rename(path, backup)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                self._log.warning("Deleting %s instead of keeping it for --rollback, as the "
+                                  "journal is on another filesystem", path)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    import shutil
+
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+                return None
+        return name
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _records(self):
+        """Returns the records of the journal, or None if there is none."""
+        try:
+            with open(self._path()) as fin:
+                lines = fin.read().splitlines()
+        except OSError:
+            return None
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the run was interrupted while writing this record
+                break
+        if not records or records[0].get("version") != self.version:
+            return None
+        return records[1:]
+
+    def rollback(self):
+        """
+        Undoes the changes recorded, newest first, leaving alone anything that
+        has changed since. Returns true if everything was undone; the journal
+        is then deleted.
+        """
+        self.close()
+        records = self._records()
+        if records is None:
+            self._log.info("There is no run to roll back")
+            return True
+        success = True
+        for record in reversed(records):
+            try:
+                success &= self._undo(record)
+            except OSError as e:
+                self._log.warning("Could not restore %s (%s)", record.get("path"), e)
+                success = False
+        if success:
+            import shutil
+
+            shutil.rmtree(self._directory, ignore_errors=True)
+        return success
+
+    def _undo(self, record):
+        operation, path = record["operation"], record["path"]
+        backup = record.get("backup")
+        if backup is not None:
+            backup = os.path.join(self._directory, "backup", backup)
+        if operation == "mkdir":
+            if not os.path.isdir(path) or os.path.islink(path):
+                return True
+            if os.listdir(path):
+                self._log.warning("Directory %s is not empty, leaving it", path)
+                return False
+            os.rmdir(path)
+            self._log.lowinfo("Removing directory %s", path)
+        elif operation in ("symlink", "replace"):
+            if not (os.path.islink(path) and os.readlink(path) == record["target"]):
+                self._log.warning("%s has changed since, leaving it", path)
+                return False
+            if operation == "symlink":
+                os.unlink(path)
+                self._log.lowinfo("Removing link %s", path)
+            elif backup is not None:
+                os.replace(backup, path)
+                self._log.lowinfo("Restoring %s", path)
+            else:
+                replace_symlink(record["previous"], path)
+                self._log.lowinfo("Restoring link %s -> %s", path, record["previous"])
+        elif operation == "copy":
+            try:
+                info = os.lstat(path)
+            except FileNotFoundError:
+                info = None
+            if (info is None or not stat.S_ISREG(info.st_mode) or info.st_size != record["size"]
+                    or info.st_mtime_ns != record["mtime"]):
+                self._log.warning("%s has changed since, leaving it", path)
+                return False
+            if backup is not None:
+                os.replace(backup, path)
+                self._log.lowinfo("Restoring %s", path)
+            elif "previous" in record:
+                replace_symlink(record["previous"], path)
+                self._log.lowinfo("Restoring link %s -> %s", path, record["previous"])
+            else:
+                os.unlink(path)
+                self._log.lowinfo("Removing copy %s", path)
+        elif operation == "remove":
+            if os.path.lexists(path):
+                self._log.warning("%s has been created since, leaving it", path)
+                return False
+            if backup is not None:
+                os.rename(backup, path)
+                self._log.lowinfo("Restoring %s", path)
+            elif "previous" not in record:
+                self._log.warning("%s was deleted, it cannot be restored", path)
+                return False
+            else:
+                os.symlink(record["previous"], path)
+                self._log.lowinfo("Restoring link %s -> %s", path, record["previous"])
+        else:
+            self._log.warning("Cannot undo %s of %s", operation, path)
+            return False
+        return True
+
+
+def replace_symlink(text, path):
+    """
+    Makes path a link with the given text in one step, replacing whatever
+    link or file is there: the link is created under a temporary name, then
+    renamed over path.
+    """
+    temporary = os.path.join(
+        os.path.dirname(path), ".%s.dotbot-%d.tmp" % (os.path.basename(path), os.getpid()))
+    try:
+        os.symlink(text, temporary)
+    except FileExistsError:
+        # left over from a run that was killed
+        os.unlink(temporary)
+        os.symlink(text, temporary)
+    try:
+        os.replace(temporary, path)
+    except OSError:
+        os.unlink(temporary)
+        raise
@@ -1,2 +1,3 @@
-from .messenger import Messenger
+from .messenger import Messenger, describe_counts
 from .level import Level
+from .sink import Sink, TerminalSink, TextSink, JsonLinesSink
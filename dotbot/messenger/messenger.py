@@ -1,63 +1,258 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 from ..util.singleton import Singleton
 from ..util.compat import with_metaclass
-from .color import Color
 from .level import Level
+from .sink import TerminalSink
+
+# outcomes plugins count items under, in the order the summary lists them
+OUTCOMES = ("created", "existing", "removed", "run", "skipped", "failed")
 
 
 class Messenger(with_metaclass(Singleton, object)):
+    """
+    Sends messages to sinks (see dotbot.messenger.sink): the terminal, and
+    any log files given on the command line.
+
+    Messages are formatted lazily: log("Linking %s", path) only builds the
+    string if some sink wants a message at that level. Once start() has been
+    called, messages are handed to a background thread that writes them in
+    batches; call flush() before anything else writes to the terminal.
+    """
+
     def __init__(self, level=Level.LOWINFO):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._terminal = TerminalSink()
+        self._sinks = [self._terminal]
+        self._writer = None
+        self._fork_hook = False
+        # directive -> {outcome: count}, in the order directives were seen
+        self._counts = {}
         self.set_level(level)
-        self.use_color(True)
 
     def set_level(self, level):
         self._level = level
+        self._update_threshold()
+
+    def level(self):
+        """Returns the level below which messages are not shown on the terminal."""
+        return self._level
 
     def use_color(self, yesno):
-        self._use_color = yesno
+        self._terminal.use_color(yesno)
+
+    def add_sink(self, sink):
+        with self._lock:
+            self._sinks.append(sink)
+        self._update_threshold()
+
+    def _update_threshold(self):
+        # the lowest level any sink writes; anything below it is dropped
+        # before it is formatted
+        self._threshold = min(
+            self._level if sink.level is None else sink.level for sink in self._sinks
+        )
+
+    def log(self, level, message, *args):
+        if level < self._threshold:
+            return
+        records = getattr(self._local, "records", None)
+        if records is not None:
+            records.append((level, message, args))
+        else:
+            self._emit((time.time(), level, message % args if args else str(message), None))
+
+    def output(self, text, stream=None):
+        """
+        Writes output of a command, unchanged, to stream (sys.stdout by
+        default) in sequence with the messages around it.
+        """
+        self._emit((time.time(), None, text, stream))
+
+    @contextmanager
+    def buffered(self):
+        """
+        Collect messages logged by the current thread instead of printing them.
+
+        Yields the list of (level, message, args) records, which can later be
+        emitted in order with replay().
+        """
+        previous = getattr(self._local, "records", None)
+        records = []
+        self._local.records = records
+        try:
+            yield records
+        finally:
+            self._local.records = previous
 
-    def log(self, level, message):
-        if level >= self._level:
-            print("%s%s%s" % (self._color(level), message, self._reset()))
+    def replay(self, records):
+        for level, message, args in records:
+            self.log(level, message, *args)
 
-    def debug(self, message):
-        self.log(Level.DEBUG, message)
+    def debug(self, message, *args):
+        self.log(Level.DEBUG, message, *args)
 
-    def lowinfo(self, message):
-        self.log(Level.LOWINFO, message)
+    def lowinfo(self, message, *args):
+        self.log(Level.LOWINFO, message, *args)
 
-    def info(self, message):
-        self.log(Level.INFO, message)
+    def info(self, message, *args):
+        self.log(Level.INFO, message, *args)
 
-    def warning(self, message):
-        self.log(Level.WARNING, message)
+    def warning(self, message, *args):
+        self.log(Level.WARNING, message, *args)
 
-    def error(self, message):
-        self.log(Level.ERROR, message)
+    def error(self, message, *args):
+        self.log(Level.ERROR, message, *args)
 
-    def _color(self, level):
+    def count(self, directive, outcome, n=1):
         """
-        Get a color (terminal escape sequence) according to a level.
+        Counts n items of a directive under an outcome (see OUTCOMES), for
+        the summary printed with --summary.
         """
-        if not self._use_color:
-            return ""
-        elif level < Level.DEBUG:
-            return ""
-        elif Level.DEBUG <= level < Level.LOWINFO:
-            return Color.YELLOW
-        elif Level.LOWINFO <= level < Level.INFO:
-            return Color.BLUE
-        elif Level.INFO <= level < Level.WARNING:
-            return Color.GREEN
-        elif Level.WARNING <= level < Level.ERROR:
-            return Color.MAGENTA
-        elif Level.ERROR <= level:
-            return Color.RED
+        with self._lock:
+            counts = self._counts.setdefault(directive, {})
+            counts[outcome] = counts.get(outcome, 0) + n
+
+    def clear_counts(self):
+        with self._lock:
+            self._counts = {}
+
+    def counts(self):
+        """Returns (directive, {outcome: count}) pairs in the order directives were counted."""
+        with self._lock:
+            return [(directive, dict(counts)) for directive, counts in self._counts.items()]
+
+    def summarize(self):
+        """Logs a line per directive with the counts of its outcomes."""
+        for directive, counts in self.counts():
+            self.info("Summary: %s: %s", directive, describe_counts(counts))
+
+    def start(self):
+        """Starts writing messages on a background thread."""
+        if self._writer is None:
+            import atexit
 
-    def _reset(self):
+            self._writer = _Writer(self._deliver)
+            self._writer.start()
+            atexit.register(self.close)
+        if not self._fork_hook and hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._fork_hook = True
+
+    def _after_fork(self):
+        # the writer thread is not copied into a child process, and the log
+        # files are the parent's to write
+        self._writer = None
+        self._lock = threading.Lock()
+        self._sinks = [self._terminal]
+        self._update_threshold()
+
+    def _current_writer(self):
+        writer = self._writer
+        if writer is not None and not self._fork_hook and writer.owner != os.getpid():
+            # forked where os.register_at_fork() is missing (before Python 3.7)
+            self._after_fork()
+            return None
+        return writer
+
+    def flush(self):
+        """Waits until every message so far has been written out."""
+        writer = self._current_writer()
+        if writer is not None:
+            writer.flush()
+        else:
+            with self._lock:
+                for sink in self._sinks:
+                    sink.flush()
+
+    def close(self):
         """
-        Get a reset color (terminal escape sequence).
+        Writes out everything pending, stops the background writer and closes
+        the log files, leaving only the terminal.
         """
-        if not self._use_color:
-            return ""
+        writer, self._writer = self._current_writer(), None
+        if writer is not None:
+            writer.stop()
+        with self._lock:
+            for sink in self._sinks:
+                sink.close()
+            self._sinks = [self._terminal]
+        self._update_threshold()
+
+    def _emit(self, record):
+        writer = self._current_writer()
+        if writer is not None:
+            writer.put(record)
         else:
-            return Color.RESET
+            with self._lock:
+                self._deliver([record])
+
+    def _deliver(self, records, flush=False):
+        """Writes records to the sinks; the terminal is flushed after every batch."""
+        for sink in self._sinks:
+            threshold = self._level if sink.level is None else sink.level
+            selected = [record for record in records if record[1] is None or record[1] >= threshold]
+            if selected:
+                sink.write(selected)
+            if flush or (selected and sink is self._terminal):
+                sink.flush()
+
+
+def describe_counts(counts):
+    """Returns e.g. "2 created, 1 failed" for {outcome: count}."""
+    known = [outcome for outcome in OUTCOMES if counts.get(outcome)]
+    others = sorted(outcome for outcome in counts if outcome not in OUTCOMES and counts[outcome])
+    return ", ".join("%d %s" % (counts[outcome], outcome) for outcome in known + others)
+
+
+class _Writer(object):
+    """Writes records to the sinks on a thread of its own, in batches."""
+
+    # most records written at once, to bound the latency of a busy run
+    _batch = 1024
+
+    def __init__(self, deliver):
+        import queue
+
+        self._deliver = deliver
+        self.owner = os.getpid()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="dotbot-messenger", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, record):
+        self._queue.put(record)
+
+    def flush(self):
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch and not self._queue.empty():
+                batch.append(self._queue.get())
+            records = []
+            for item in batch:
+                if isinstance(item, tuple):
+                    records.append(item)
+                    continue
+                # a flush or stop marker: everything before it is written out
+                self._deliver(records, flush=True)
+                records = []
+                if item is None:
+                    return
+                item.set()
+            if records:
+                self._deliver(records)
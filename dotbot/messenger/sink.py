@@ -0,0 +1,162 @@
+import sys
+import time
+
+from .color import Color
+from .level import Level
+
+_level_names = {
+    Level.DEBUG: "debug",
+    Level.LOWINFO: "lowinfo",
+    Level.INFO: "info",
+    Level.WARNING: "warning",
+    Level.ERROR: "error",
+}
+
+
+def level_name(level):
+    if level is None:
+        return "output"
+    return _level_names.get(level, str(level))
+
+
+class Sink(object):
+    """
+    Somewhere Messenger writes messages to.
+
+    write() is given a batch of records, each a (time, level, text, stream)
+    tuple. Messages have stream None; output of commands has level None and
+    the stream (sys.stdout or sys.stderr) it was written to. Sinks are only
+    ever called from one thread at a time.
+    """
+
+    # the lowest level written, or None for the level of the messenger
+    level = None
+
+    def write(self, records):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class TerminalSink(Sink):
+    """Writes messages to standard output, colored by level."""
+
+    def __init__(self, color=True):
+        self.use_color(color)
+
+    def use_color(self, yesno):
+        self._color = yesno
+        # escape sequences by level, worked out once per level
+        self._prefixes = {}
+
+    def write(self, records):
+        # looked up on every write, so that redirecting sys.stdout works
+        stdout = sys.stdout
+        pending = []
+        target = stdout
+        for _, level, text, stream in records:
+            stream = stdout if stream is None else stream
+            if stream is not target:
+                target.write("".join(pending))
+                pending = []
+                target = stream
+            if level is None:
+                pending.append(text)
+            else:
+                pending.append("%s%s%s\n" % (self._prefix(level), text, self._reset()))
+        target.write("".join(pending))
+
+    def flush(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    def _prefix(self, level):
+        prefix = self._prefixes.get(level)
+        if prefix is None:
+            prefix = self._prefixes[level] = self._level_color(level)
+        return prefix
+
+    def _level_color(self, level):
+        """
+        Get a color (terminal escape sequence) according to a level.
+        """
+        if not self._color:
+            return ""
+        elif level < Level.DEBUG:
+            return ""
+        elif Level.DEBUG <= level < Level.LOWINFO:
+            return Color.YELLOW
+        elif Level.LOWINFO <= level < Level.INFO:
+            return Color.BLUE
+        elif Level.INFO <= level < Level.WARNING:
+            return Color.GREEN
+        elif Level.WARNING <= level < Level.ERROR:
+            return Color.MAGENTA
+        elif Level.ERROR <= level:
+            return Color.RED
+
+    def _reset(self):
+        """
+        Get a reset color (terminal escape sequence).
+        """
+        return Color.RESET if self._color else ""
+
+
+class TextSink(Sink):
+    """Writes plain text lines to a file, only flushing when told to."""
+
+    def __init__(self, path, level=Level.DEBUG):
+        self.level = level
+        self._file = open(path, "w")
+
+    def write(self, records):
+        lines = []
+        for created, level, text, _ in records:
+            if level is None:
+                lines.append(text if text.endswith("\n") else text + "\n")
+            else:
+                lines.append("%s %-7s %s\n" % (_timestamp(created), level_name(level), text))
+        self._file.write("".join(lines))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonLinesSink(Sink):
+    """Writes a JSON object per message to a file, for other programs to read."""
+
+    def __init__(self, path, level=Level.DEBUG):
+        import json
+
+        self._dumps = json.dumps
+        self.level = level
+        self._file = open(path, "w")
+
+    def write(self, records):
+        lines = []
+        for created, level, text, stream in records:
+            record = {"time": round(created, 6), "level": level_name(level), "message": text}
+            if stream is not None:
+                record["stream"] = "stderr" if stream is sys.stderr else "stdout"
+            lines.append(self._dumps(record) + "\n")
+        self._file.write("".join(lines))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _timestamp(created):
+    return "%s.%03d" % (
+        time.strftime("%H:%M:%S", time.localtime(created)),
+        int(created * 1000) % 1000,
+    )
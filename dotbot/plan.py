@@ -0,0 +1,238 @@
+import json
+import os
+import stat
+
+
+class Action(object):
+    """
+    A single step of an execution plan.
+
+    Actions are plain data: plugins emit them while planning a directive and
+    execute them later, possibly in another process that never saw the
+    config file. Each action type declares the fields it serializes, and
+    which of them are paths.
+    """
+
+    kind = None
+    fields = ()
+    paths = ()
+
+    def __init__(self, **kwargs):
+        for field in self.fields:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError("Unknown fields for %s action: %s" % (self.kind, ", ".join(kwargs)))
+
+    def to_dict(self, home=None):
+        """
+        Returns the action as a dict. Paths under home are written relative
+        to it (as `~/...`), so they follow whoever applies the plan.
+        """
+        data = {"type": self.kind}
+        for field in self.fields:
+            data[field] = getattr(self, field)
+            if home is not None and field in self.paths:
+                data[field] = _collapse_home(data[field], home)
+        return data
+
+    def describe(self):
+        raise NotImplementedError
+
+    def pending(self):
+        """
+        Returns true if executing the action would change something.
+
+        This only reads from the filesystem, so it can be used to check a
+        machine for drift against a plan.
+        """
+        return True
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "<%s>" % self.describe()
+
+
+class MakeDirectory(Action):
+    kind = "mkdir"
+    fields = ("path", "mode")
+    paths = ("path",)
+
+    def describe(self):
+        return "mkdir %s" % self.path
+
+    def pending(self):
+        return not os.path.isdir(self.path)
+
+
+class Remove(Action):
+    """
+    Remove whatever is at path, unless it is already a link to keep_link_to.
+
+    Symbolic links are always removed; files and directories are only
+    removed when force is set.
+    """
+
+    kind = "remove"
+    fields = ("path", "keep_link_to", "force")
+    paths = ("path", "keep_link_to")
+
+    def describe(self):
+        return "remove %s" % self.path
+
+    def pending(self):
+        if os.path.islink(self.path):
+            return os.readlink(self.path) != self.keep_link_to
+        return bool(self.force) and os.path.exists(self.path)
+
+
+class Symlink(Action):
+    """
+    Link destination to target, where target is the text of the link (which
+    may be relative) and source is the absolute path it refers to.
+    """
+
+    kind = "symlink"
+    fields = ("source", "target", "destination", "ignore_missing")
+    paths = ("source", "target", "destination")
+
+    def describe(self):
+        return "symlink %s -> %s" % (self.destination, self.target)
+
+    def pending(self):
+        return not (os.path.islink(self.destination) and
+                    os.readlink(self.destination) == self.target)
+
+
+class CopyFile(Action):
+    """
+    Copy the file source to destination, unless it is already there. For
+    pending(), a destination with the same size and modification time is
+    taken to be unchanged; applying compares the content too. Anything else
+    at destination is only replaced when force is set.
+    """
+
+    kind = "copy"
+    fields = ("source", "destination", "force")
+    paths = ("source", "destination")
+
+    def describe(self):
+        return "copy %s -> %s" % (self.source, self.destination)
+
+    def pending(self):
+        try:
+            source = os.stat(self.source)
+            destination = os.lstat(self.destination)
+        except OSError:
+            return True
+        return not (stat.S_ISREG(destination.st_mode) and
+                    destination.st_size == source.st_size and
+                    destination.st_mtime_ns == source.st_mtime_ns)
+
+
+class Clean(Action):
+    kind = "clean"
+    fields = ("path", "force", "recursive", "skip", "max_depth")
+    paths = ("path",)
+
+    def describe(self):
+        return "clean %s" % self.path
+
+
+class RunCommand(Action):
+    kind = "run"
+    fields = ("command", "description", "quiet", "stdin", "stdout", "stderr", "parallel", "jobs",
+              "output")
+
+    def describe(self):
+        return "run %s" % self.command
+
+
+ACTION_TYPES = dict(
+    (action.kind, action) for action in (MakeDirectory, Remove, Symlink, CopyFile, Clean, RunCommand))
+
+
+def action_from_dict(data):
+    data = dict(data)
+    kind = data.pop("type", None)
+    if kind not in ACTION_TYPES:
+        raise PlanError("Unknown action type %s" % kind)
+    action = ACTION_TYPES[kind]
+    for field in action.paths:
+        data[field] = _expand_home(data.get(field))
+    return action(**data)
+
+
+def _collapse_home(path, home):
+    if not isinstance(path, str) or home == os.sep:
+        return path
+    if path == home or path.startswith(home + os.sep):
+        return "~" + path[len(home):]
+    return path
+
+
+def _expand_home(path):
+    if isinstance(path, str) and (path == "~" or path.startswith("~" + os.sep)):
+        return os.path.expanduser(path)
+    return path
+
+
+class Plan(object):
+    """
+    An ordered list of (directive, actions) tasks, along with the base
+    directory they were planned against.
+
+    Written plans store paths under the home directory as `~/...` and read
+    ones expand them again, so a plan made by one user puts files in the
+    home of the user applying it rather than the one who made it.
+    """
+
+    version = 2
+
+    def __init__(self, base_directory, tasks=None):
+        self.base_directory = base_directory
+        self.tasks = tasks if tasks is not None else []
+
+    def add(self, directive, actions):
+        self.tasks.append((directive, list(actions)))
+
+    def actions(self):
+        for _, actions in self.tasks:
+            for action in actions:
+                yield action
+
+    def to_dict(self):
+        home = os.path.normpath(os.path.expanduser("~"))
+        return {
+            "version": self.version,
+            "base_directory": _collapse_home(self.base_directory, home),
+            "tasks": [
+                {"directive": directive, "actions": [action.to_dict(home) for action in actions]}
+                for directive, actions in self.tasks
+            ],
+        }
+
+    def write(self, path):
+        with open(path, "w") as fout:
+            json.dump(self.to_dict(), fout, indent=2)
+            fout.write("\n")
+
+    @classmethod
+    def read(cls, path):
+        try:
+            with open(path) as fin:
+                data = json.load(fin)
+            if data.get("version") != cls.version:
+                raise PlanError("Unsupported plan version %s" % data.get("version"))
+            tasks = [
+                (task["directive"], [action_from_dict(action) for action in task["actions"]])
+                for task in data["tasks"]
+            ]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise PlanError("Could not read plan file %s (%s)" % (path, e))
+        return cls(_expand_home(data["base_directory"]), tasks)
+
+
+class PlanError(Exception):
+    pass
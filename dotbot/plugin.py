@@ -1,5 +1,7 @@
 from .messenger import Messenger
 from .context import Context
+from .util.common import on_permitted_os
+from . import trace
 
 
 class Plugin(object):
@@ -7,6 +9,10 @@ class Plugin(object):
     Abstract base class for commands that process directives.
     """
 
+    # the directives the plugin handles, if they are known up front; plugins
+    # that leave this empty are asked with can_handle() instead
+    directives = ()
+
     def __init__(self, context):
         self._context = context
         self._log = Messenger()
@@ -15,8 +21,77 @@ class Plugin(object):
         """
         Returns true if the Plugin can handle the directive.
         """
+        if self.directives:
+            return directive in self.directives
         raise NotImplementedError
 
+    def compile(self, directive, data):
+        """
+        Prepares the data for a directive before anything is run, e.g.
+        merging in defaults (see dotbot.spec). The result is what handle()
+        and plan() are later called with.
+
+        The default implementation returns the data unchanged.
+        """
+        return data
+
+    def _compiled(self, directive, data):
+        """
+        Returns the compiled data for a directive, compiling it first unless
+        it already is. For plugins whose compile() returns a tuple of specs
+        (see dotbot.spec), which is how compiled data is told apart.
+        """
+        if isinstance(data, tuple):
+            return data
+        return self.compile(directive, data)
+
+    def _prefetch_tests(self, specs):
+        """
+        Runs the distinct `if` conditions of compiled entries concurrently, so
+        that planning each entry only has to look its condition up. The specs
+        need a test slot, and may have os_constraint and test_env ones.
+        """
+        conditions = [
+            (spec.test, getattr(spec, "test_env", None)) for spec in specs
+            if spec.test is not None
+            and on_permitted_os(getattr(spec, "os_constraint", None)) is not False
+        ]
+        if conditions:
+            self._context.conditions().prefetch(conditions)
+
+    def _test_success(self, condition, env=None):
+        """
+        Returns true if an `if` condition (see dotbot.conditions) holds.
+        """
+        success = self._context.conditions().evaluate(condition, env)
+        if not success:
+            from .conditions import describe_condition
+            self._log.debug("Test '%s' returned false", describe_condition(condition))
+        return success
+
+    def _report(self, success):
+        """
+        Logs the outcome of a directive with the plugin's _succeeded or
+        _failed message, and returns success.
+        """
+        if success:
+            self._log.info(self._succeeded)
+        else:
+            self._log.error(self._failed)
+        return success
+
+    def span(self, name, category="plugin", **args):
+        """
+        Returns a context manager that records the time spent in its block
+        in the trace written with --trace, along with any keyword arguments.
+        Spans nest, so a plugin can break the time for a directive down by
+        entry. When tracing is off this does next to nothing.
+
+        with self.span("fetch %s" % url, url=url):
+            ...
+        """
+        return trace.span(name, category, **args)
+
     def handle(self, directive, data):
         """
         Executes the directive.
@@ -24,3 +99,61 @@ class Plugin(object):
         Returns true if the Plugin successfully handled the directive.
         """
         raise NotImplementedError
+
+    def retarget(self, directive, data, target):
+        """
+        Returns the (compiled) data for a directive with the paths it writes
+        to moved to a dotbot.targets.Target, for --target-root and --home.
+        The data is compiled once, for the current user, and then retargeted
+        for each target; target.path() does the moving.
+
+        While a target is being set up, $HOME is its home directory, so the
+        default implementation returns the data unchanged for a target
+        without a root, which works for plugins that expand `~` as they run.
+        It raises NotImplementedError for a target with a root.
+        """
+        if target.root is not None:
+            raise NotImplementedError(
+                "%s cannot be applied under a target root" % type(self).__name__)
+        return data
+
+    def sources(self, directive, data):
+        """
+        Returns the paths that the (compiled) directive reads from, so that
+        --watch can run it again when something below them changes, or None
+        if it only depends on its config.
+
+        The default implementation returns None.
+        """
+        return None
+
+    def destinations(self, directive, data):
+        """
+        Returns the paths that the (compiled) directive changes, anything at
+        or below them included, so that --schedule can run it alongside
+        directives that do not touch them. Returns None if they cannot be
+        known, in which case the directive is run on its own.
+
+        The default implementation returns None.
+        """
+        return None
+
+    def plan(self, directive, data):
+        """
+        Works out the actions (see dotbot.plan) that the directive would
+        perform, without changing anything.
+
+        Returns a (success, actions) pair, where success is false if part of
+        the directive could not be planned.
+
+        Plugins that do not support planning raise NotImplementedError.
+        """
+        raise NotImplementedError
+
+    def apply(self, directive, actions):
+        """
+        Executes actions previously returned by plan().
+
+        Returns true if all of the actions were successful.
+        """
+        raise NotImplementedError
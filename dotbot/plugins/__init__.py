@@ -1,4 +1,17 @@
-from .clean import Clean
-from .create import Create
-from .link import Link
-from .shell import Shell
+from .. import _import_submodule
+
+# the built-in plugins, by the directive they handle; each is only imported
+# when a config uses its directive
+builtin = {
+    "clean": ("clean", "Clean"),
+    "copy": ("copy", "Copy"),
+    "create": ("create", "Create"),
+    "link": ("link", "Link"),
+    "shell": ("shell", "Shell"),
+}
+
+
+def load(directive):
+    """Imports the built-in plugin for a directive and returns its class."""
+    module, name = builtin[directive]
+    return getattr(_import_submodule(__name__, module), name)
@@ -1,5 +1,10 @@
 import os
+import fnmatch
+import functools
 import dotbot
+from dotbot import plan
+from dotbot.spec import CleanSpec
+from dotbot.util.parallel import run_grouped
 
 
 class Clean(dotbot.Plugin):
@@ -8,61 +13,217 @@ class Clean(dotbot.Plugin):
     """
 
     _directive = "clean"
+    directives = (_directive,)
+    _succeeded = "All targets have been cleaned"
+    _failed = "Some targets were not successfully cleaned"
+
+    # targets are scanned concurrently unless told otherwise
+    _default_jobs = 8
 
     def can_handle(self, directive):
         return directive == self._directive
 
+    def compile(self, directive, data):
+        if directive != self._directive:
+            raise ValueError("Clean cannot compile directive %s" % directive)
+        specs = []
+        defaults = self._context.defaults().get(self._directive, {})
+        for target in data:
+            force = defaults.get("force", False)
+            recursive = defaults.get("recursive", False)
+            skip = defaults.get("skip", [])
+            max_depth = defaults.get("max-depth", None)
+            if isinstance(data, dict) and isinstance(data[target], dict):
+                force = data[target].get("force", force)
+                recursive = data[target].get("recursive", recursive)
+                skip = data[target].get("skip", skip)
+                max_depth = data[target].get("max-depth", max_depth)
+            path = os.path.normpath(os.path.expandvars(os.path.expanduser(target)))
+            specs.append(CleanSpec(
+                path=os.path.abspath(path), force=force, recursive=recursive,
+                skip=tuple(sorted(skip)), max_depth=max_depth))
+        return tuple(specs)
+
     def handle(self, directive, data):
         if directive != self._directive:
             raise ValueError("Clean cannot handle directive %s" % directive)
-        return self._process_clean(data)
+        return self._process_clean(self._compiled(directive, data))
+
+    def retarget(self, directive, data, target):
+        if directive != self._directive:
+            raise ValueError("Clean cannot retarget directive %s" % directive)
+        return tuple(spec.replace(path=target.path(spec.path)) for spec in self._compiled(directive, data))
+
+    def sources(self, directive, data):
+        if directive != self._directive:
+            raise ValueError("Clean cannot find sources for directive %s" % directive)
+        # removing anything from the base directory can leave a broken link
+        return [self._context.base_directory()]
+
+    def destinations(self, directive, data):
+        if directive != self._directive:
+            raise ValueError("Clean cannot find destinations for directive %s" % directive)
+        return [spec.path for spec in self._compiled(directive, data)]
+
+    def plan(self, directive, data):
+        if directive != self._directive:
+            raise ValueError("Clean cannot plan directive %s" % directive)
+        return True, self._plan_clean(self._compiled(directive, data))
+
+    def apply(self, directive, actions):
+        if directive != self._directive:
+            raise ValueError("Clean cannot apply directive %s" % directive)
+        return self._process_actions(actions)
 
     def _process_clean(self, targets):
-        success = True
-        defaults = self._context.defaults().get(self._directive, {})
-        for target in targets:
-            force = defaults.get("force", False)
-            recursive = defaults.get("recursive", False)
-            if isinstance(targets, dict) and isinstance(targets[target], dict):
-                force = targets[target].get("force", force)
-                recursive = targets[target].get("recursive", recursive)
-            success &= self._clean(target, force, recursive)
-        if success:
-            self._log.info("All targets have been cleaned")
+        return self._process_actions(self._plan_clean(targets))
+
+    def _process_actions(self, actions):
+        base_directory = self._context.base_directory()
+        operations = [
+            (group, functools.partial(self._execute, action, base_directory))
+            for group, action in zip(self._groups(actions), actions)
+        ]
+        jobs = min(self._get_jobs(), len(operations))
+        success = all(run_grouped(operations, jobs))
+        return self._report(success)
+
+    def _get_jobs(self):
+        jobs = self._context.defaults().get(self._directive, {}).get(
+            "jobs", self._default_jobs)
+        return max(int(jobs), 1)
+
+    def _plan_clean(self, specs):
+        return self._merge([
+            plan.Clean(path=spec.path, force=spec.force, recursive=spec.recursive,
+                       skip=list(spec.skip), max_depth=spec.max_depth)
+            for spec in specs
+        ])
+
+    def _merge(self, actions):
+        """
+        Drops targets that another target already covers, so that a shared
+        subtree is only walked once.
+        """
+        merged = []
+        for action in actions:
+            if not any(self._covers(other, action) for other in merged):
+                merged = [other for other in merged if not self._covers(action, other)]
+                merged.append(action)
+        # keep the order targets were given in
+        return [action for action in actions if any(action is other for other in merged)]
+
+    def _covers(self, outer, inner):
+        """
+        Returns true if cleaning outer also cleans everything inner would.
+        """
+        if outer.force != inner.force or outer.skip != inner.skip:
+            return False
+        if outer.path == inner.path:
+            depth = 0
+        elif inner.path.startswith(os.path.join(outer.path, "")):
+            if not outer.recursive:
+                return False
+            relative = os.path.relpath(inner.path, outer.path).split(os.sep)
+            if any(self._skipped(name, outer.skip) for name in relative):
+                return False
+            # the walk does not descend into symbolic links to directories
+            parent = outer.path
+            for name in relative:
+                parent = os.path.join(parent, name)
+                if self._context.filesystem().islink(parent):
+                    return False
+            depth = len(relative)
         else:
-            self._log.error("Some targets were not successfully cleaned")
-        return success
+            return False
+        if not outer.recursive:
+            return not inner.recursive
+        if outer.max_depth is None:
+            return True
+        if inner.recursive:
+            return inner.max_depth is not None and depth + inner.max_depth <= outer.max_depth
+        return depth <= outer.max_depth
 
-    def _clean(self, target, force, recursive):
+    def _groups(self, actions):
+        """
+        Targets that overlap (but could not be merged) are cleaned in order,
+        everything else concurrently.
+        """
+        groups = []
+        for index, action in enumerate(actions):
+            group = index
+            for other in range(index):
+                if self._overlaps(actions[other], action):
+                    group = groups[other]
+                    break
+            groups.append(group)
+        return groups
+
+    def _overlaps(self, first, second):
+        a, b = os.path.join(first.path, ""), os.path.join(second.path, "")
+        return a.startswith(b) or b.startswith(a)
+
+    def _execute(self, action, base_directory):
+        if isinstance(action, plan.Clean):
+            with self.span(action.describe(), category="fs"):
+                return self._clean(action.path, action.force, action.recursive,
+                                   action.skip or [], action.max_depth, base_directory)
+        raise ValueError("Clean cannot execute %s" % action.describe())
+
+    def _clean(self, target, force, recursive, skip, max_depth, base_directory):
         """
         Cleans all the broken symbolic links in target if they point to
         a subdirectory of the base directory or if forced to clean.
         """
-        target_normalised = os.path.normpath(os.path.expandvars(os.path.expanduser(target)))
-        isdir = os.path.isdir(target_normalised)
-        if isdir is False:
-            self._log.debug("Ignoring nonexistent directory %s" % target)
+        filesystem = self._context.filesystem()
+        if not filesystem.isdir(target):
+            self._log.debug("Ignoring nonexistent directory %s", target)
             return True
-        for item in os.listdir(target_normalised):
-            path = os.path.join(target_normalised, item)
-            if recursive and os.path.isdir(path):
-                # isdir implies not islink -- we don't want to descend into
-                # symlinked directories. okay to do a recursive call here
-                # because depth should be fairly limited
-                self._clean(path, force, recursive)
-            if not os.path.exists(path) and os.path.islink(path):
-                points_at = os.path.join(os.path.dirname(path), os.readlink(path))
-                if self._in_directory(path, self._context.base_directory()) or force:
-                    self._log.lowinfo("Removing invalid link %s -> %s" % (path, points_at))
-                    os.remove(path)
-                else:
-                    self._log.lowinfo("Link %s -> %s not removed." % (path, points_at))
+        base_directory = os.path.join(base_directory, "")
+        pending = [(target, 0)]
+        while pending:
+            directory, depth = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    entries = list(entries)
+            except OSError as e:
+                self._log.debug("Could not scan %s (%s)", directory, e)
+                continue
+            subdirectories = []
+            for entry in entries:
+                if skip and self._skipped(entry.name, skip):
+                    continue
+                if entry.is_symlink():
+                    # entry type comes from the directory listing, only links
+                    # need another syscall to see whether they are broken
+                    try:
+                        os.stat(entry.path)
+                    except OSError:
+                        self._remove_broken(filesystem, entry.path, force, base_directory)
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    if max_depth is None or depth < max_depth:
+                        subdirectories.append((entry.path, depth + 1))
+            # depth first, in listing order
+            pending.extend(reversed(subdirectories))
         return True
 
+    def _remove_broken(self, filesystem, path, force, base_directory):
+        points_at = os.path.join(os.path.dirname(path), os.readlink(path))
+        if force or self._in_directory(path, base_directory):
+            self._log.lowinfo("Removing invalid link %s -> %s", path, points_at)
+            filesystem.remove(path)
+            self._log.count(self._directive, "removed")
+        else:
+            self._log.lowinfo("Link %s -> %s not removed.", path, points_at)
+            self._log.count(self._directive, "skipped")
+
+    def _skipped(self, name, skip):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in skip)
+
     def _in_directory(self, path, directory):
         """
-        Returns true if the path is in the directory.
+        Returns true if the path is in the directory, which must be a
+        canonical path ending in a separator.
         """
-        directory = os.path.join(os.path.realpath(directory), "")
         path = os.path.realpath(path)
         return os.path.commonprefix([path, directory]) == directory
@@ -0,0 +1,343 @@
+import os
+import functools
+import stat
+
+import dotbot
+
+from dotbot import fs, plan
+from dotbot.conditions import compile_condition
+from dotbot.spec import CopySpec
+from dotbot.util.common import on_permitted_os
+from dotbot.util import globbing
+from dotbot.util.globbing import Globber
+from dotbot.util.parallel import run_grouped
+
+
+class Copy(dotbot.Plugin):
+    '''
+    Copies dotfiles, for programs that do not follow symbolic links.
+    '''
+
+    _directive = 'copy'
+    directives = (_directive,)
+    _succeeded = 'All files have been copied'
+    _failed = 'Some files were not successfully copied'
+
+    # worker threads to copy with unless the defaults say otherwise
+    _default_jobs = 4
+    # fewer files than this are copied one after another
+    _parallel_threshold = 16
+
+    def can_handle(self, directive):
+        return directive == self._directive
+
+    def compile(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Copy cannot compile directive %s' % directive)
+        defaults = self._context.defaults().get(self._directive, {})
+        return tuple(
+            self._compile_entry(destination, source_dict, defaults)
+            for destination, source_dict in data.items()
+        )
+
+    def handle(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Copy cannot handle directive %s' % directive)
+        success, actions = self.plan(directive, data)
+        return self._report(self._run(actions) and success)
+
+    def retarget(self, directive, data, target):
+        if directive != self._directive:
+            raise ValueError('Copy cannot retarget directive %s' % directive)
+        return tuple(
+            spec.replace(destination_path=target.path(spec.destination_path))
+            for spec in self._compiled(directive, data)
+        )
+
+    def sources(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Copy cannot find sources for directive %s' % directive)
+        base_directory = self._context.base_directory()
+        return [
+            os.path.normpath(os.path.join(
+                base_directory, globbing.root(spec.source) if spec.glob else spec.source))
+            for spec in self._compiled(directive, data)
+        ]
+
+    def destinations(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Copy cannot find destinations for directive %s' % directive)
+        return [spec.destination_path for spec in self._compiled(directive, data)]
+
+    def plan(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Copy cannot plan directive %s' % directive)
+        success = True
+        actions = []
+        specs = self._compiled(directive, data)
+        self._prefetch_tests(specs)
+        self._context.filesystem().prefetch([
+            spec.absolute_source for spec in specs if not spec.glob])
+        globber = Globber()
+        for spec in specs:
+            planned, entry_actions = self._plan_entry(spec, globber)
+            success &= planned
+            actions.extend(entry_actions)
+        return success, actions
+
+    def apply(self, directive, actions):
+        if directive != self._directive:
+            raise ValueError('Copy cannot apply directive %s' % directive)
+        return self._report(self._run(actions))
+
+    def _compile_entry(self, destination, source_dict, defaults):
+        """Merge defaults into one config entry and resolve its paths."""
+        if not isinstance(source_dict, dict):
+            # only a path; as with link, the os-constraint default does not apply
+            source_dict = {"path": source_dict, "os-constraint": None}
+        destination = os.path.expandvars(destination)
+        path = source_dict.get("path")
+        if path is None:
+            # like link, ~/.vimrc comes from vimrc
+            path = os.path.basename(destination)
+            if path.startswith('.'):
+                path = path[1:]
+        path = os.path.expandvars(os.path.expanduser(path))
+        use_glob = source_dict.get("glob", defaults.get("glob", False))
+        test_env = source_dict.get("if-cache", defaults.get("if-cache"))
+        return CopySpec(
+            destination=destination,
+            destination_path=os.path.normpath(os.path.expanduser(destination)),
+            source=path,
+            absolute_source=(
+                None if use_glob else os.path.join(self._context.base_directory(), path)),
+            force=source_dict.get("force", defaults.get("force", False)),
+            create=source_dict.get("create", defaults.get("create", False)),
+            glob=use_glob,
+            test=compile_condition(source_dict.get("if", defaults.get("if"))),
+            test_env=None if test_env is None else tuple(test_env),
+            exclude=tuple(
+                os.path.expandvars(os.path.expanduser(exclude))
+                for exclude in source_dict.get("exclude", defaults.get("exclude", []))),
+            os_constraint=source_dict.get("os-constraint", defaults.get("os-constraint")),
+        )
+
+    def _get_jobs(self):
+        """Number of worker threads to copy with."""
+        jobs = self._context.defaults().get(self._directive, {}).get(
+            "jobs", self._default_jobs)
+        return max(int(jobs), 1)
+
+    def _plan_entry(self, spec, globber):
+        """Works out the actions for one config entry, returning (success, actions)."""
+        if spec.os_constraint is not None and on_permitted_os(spec.os_constraint) is False:
+            self._log.lowinfo("Skipping copy %s (%s only)", spec.destination_path,
+                              spec.os_constraint)
+            self._log.count(self._directive, "skipped")
+            return True, []
+        if spec.test is not None and not self._test_success(spec.test, spec.test_env):
+            self._log.lowinfo("Skipping %s", spec.destination)
+            self._log.count(self._directive, "skipped")
+            return True, []
+        if not spec.glob:
+            if not self._context.filesystem().exists(spec.absolute_source):
+                self._log.warning('Nonexistent source %s -> %s', spec.destination, spec.source)
+                self._log.count(self._directive, "failed")
+                return False, []
+            return self._plan_copy(spec, spec.absolute_source, spec.destination_path)
+        path = spec.source
+        self._log.debug("Globbing with path: %s", path)
+        with self.span('glob %s' % path, category='fs') as span:
+            results = sorted(globber.iglob(path, spec.exclude))
+            span.set(matches=len(results))
+        if not results:
+            self._log.warning("Globbing couldn't find anything matching %s", path)
+            self._log.count(self._directive, "failed")
+            return False, []
+        if len(results) == 1 and spec.destination[-1] == '/':
+            self._log.error("Ambiguous action requested.")
+            self._log.error("No wildcard in glob, directory use undefined: %s -> %s",
+                            spec.destination, results)
+            self._log.warning("Did you want to copy the directory or into it?")
+            self._log.count(self._directive, "failed")
+            return False, []
+        base_directory = self._context.base_directory()
+        if len(results) == 1:
+            return self._plan_copy(
+                spec, os.path.join(base_directory, results[0]), spec.destination_path)
+        self._log.lowinfo("Globs from '%s': %s", path, results)
+        success = True
+        actions = []
+        for result in results:
+            # the part of the match after the directory the pattern starts in
+            prefix = os.path.dirname(os.path.commonprefix([path, result]))
+            item = result if not prefix else result[len(prefix) + 1:]
+            planned, result_actions = self._plan_copy(
+                spec, os.path.join(base_directory, result),
+                os.path.join(spec.destination_path, item))
+            success &= planned
+            actions.extend(result_actions)
+        return success, actions
+
+    def _plan_copy(self, spec, source, destination):
+        """
+        Plans copying source to destination: creating its parent directory,
+        then copying the file, or every file of the directory. Returns
+        (success, actions); a directory that cannot be read fails the entry,
+        but the rest of it is still copied.
+        """
+        filesystem = self._context.filesystem()
+        destination = os.path.abspath(destination)
+        success = True
+        actions = []
+        if spec.create:
+            actions.append(plan.MakeDirectory(path=os.path.dirname(destination), mode=None))
+        if not filesystem.isdir(source):
+            actions.append(plan.CopyFile(source=source, destination=destination, force=spec.force))
+            return success, actions
+        actions.append(plan.MakeDirectory(path=destination, mode=None))
+        pending = [(source, destination)]
+        while pending:
+            directory, target = pending.pop(0)
+            try:
+                entries = filesystem.listdir(directory)
+            except OSError as e:
+                self._log.warning('Failed to read directory %s (%s)', directory, e)
+                self._log.count(self._directive, "failed")
+                success = False
+                continue
+            for entry in entries:
+                path = os.path.join(target, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    actions.append(plan.MakeDirectory(path=path, mode=None))
+                    pending.append((entry.path, path))
+                elif entry.is_file():
+                    # links to files are copied as the files
+                    actions.append(plan.CopyFile(
+                        source=entry.path, destination=path, force=spec.force))
+                else:
+                    self._log.debug("Not copying %s, it is not a file or directory", entry.path)
+        return success, actions
+
+    def _run(self, actions):
+        """
+        Creates the directories of the actions, then copies the files on a
+        worker pool. Returns true if everything succeeded.
+        """
+        directories = []
+        copies = []
+        for action in actions:
+            if isinstance(action, plan.MakeDirectory):
+                directories.append(action)
+            elif isinstance(action, plan.CopyFile):
+                copies.append(action)
+            else:
+                raise ValueError('Copy cannot execute %s' % action.describe())
+        success = True
+        jobs = self._get_jobs()
+        filesystem = self._context.filesystem()
+        if directories:
+            filesystem.prefetch([action.path for action in directories])
+            results = self._context.directories().ensure_all(
+                [(action.path, action.mode) for action in directories], jobs)
+            for action in directories:
+                created, error = results.pop(action.path, (False, None))
+                if error is not None:
+                    self._log.warning('Failed to create directory %s (%s)', action.path, error)
+                    success = False
+                elif created:
+                    self._log.lowinfo('Creating directory %s', action.path)
+        if len(copies) < self._parallel_threshold:
+            jobs = 1
+        if jobs > 1:
+            self._log.debug("Copying %d files with %d jobs", len(copies), jobs)
+        filesystem.prefetch([action.destination for action in copies])
+        methods = {}
+        for copied, method in run_grouped(
+                [(None, functools.partial(self._copy, action)) for action in copies], jobs):
+            success &= copied
+            if method is not None:
+                methods[method] = methods.get(method, 0) + 1
+        if methods:
+            self._log.debug("Copied files by %s", ", ".join(
+                "%s (%d)" % (method, count) for method, count in sorted(methods.items())))
+        return success
+
+    def _copy(self, action):
+        """
+        Copies one file unless it is up to date. Returns (success, how the
+        data was copied, or None if it was not).
+        """
+        source, destination = action.source, action.destination
+        try:
+            info = os.stat(source)
+        except OSError:
+            self._log.warning('Nonexistent source %s -> %s', destination, source)
+            self._log.count(self._directive, "failed")
+            return False, None
+        filesystem = self._context.filesystem()
+        kind = filesystem.kind(destination)
+        if kind == fs.OTHER:
+            if self._unchanged(source, info, destination):
+                self._log.lowinfo('Copy is up to date %s', destination)
+                self._log.count(self._directive, "existing")
+                return True, None
+            if not action.force:
+                self._log.warning('%s already exists but differs from %s', destination, source)
+                self._log.count(self._directive, "failed")
+                return False, None
+        elif kind in (fs.LINK, fs.DIRECTORY) and not action.force:
+            self._log.warning('%s already exists but is a %s', destination,
+                              'link' if kind == fs.LINK else 'directory')
+            self._log.count(self._directive, "failed")
+            return False, None
+        with self.span('copy %s -> %s' % (source, destination), category='fs'):
+            try:
+                if kind == fs.DIRECTORY:
+                    filesystem.rmtree(destination)
+                method = filesystem.copy(source, destination)
+            except OSError as e:
+                self._log.warning('Failed to copy %s -> %s (%s)', source, destination, e)
+                self._log.count(self._directive, "failed")
+                return False, None
+        self._log.lowinfo('Copying %s -> %s', source, destination)
+        self._log.count(self._directive, "created")
+        return True, method
+
+    def _unchanged(self, source, info, destination):
+        """
+        Returns true if the file at destination already is a copy of source,
+        whose os.stat() is info: it is a regular file with the same size and
+        content hash. A copy whose mode or modification time differs, e.g.
+        after a fresh clone of the dotfiles, gets those of source.
+        """
+        try:
+            current = os.stat(destination)
+        except OSError:
+            return False
+        if not stat.S_ISREG(current.st_mode) or current.st_size != info.st_size:
+            return False
+        with self.span('compare %s' % destination, category='fs'):
+            try:
+                if _digest(source) != _digest(destination):
+                    return False
+                if stat.S_IMODE(current.st_mode) != stat.S_IMODE(info.st_mode):
+                    os.chmod(destination, stat.S_IMODE(info.st_mode))
+                if current.st_mtime_ns != info.st_mtime_ns:
+                    os.utime(destination, ns=(current.st_atime_ns, info.st_mtime_ns))
+                    self._log.debug(
+                        "Copy %s only differed in its modification time", destination)
+            except OSError:
+                return False
+        return True
+
+
+def _digest(path):
+    """Returns the hash of a file's content."""
+    import hashlib
+
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
@@ -1,7 +1,10 @@
 import os
 import dotbot
+from ..conditions import compile_condition, describe_condition
+from ..plan import MakeDirectory
+from ..spec import CreateSpec
+from ..state import State
 from ..util.common import expand_path, on_permitted_os
-from typing import Union
 
 
 class Create(dotbot.Plugin):
@@ -10,66 +13,155 @@ class Create(dotbot.Plugin):
     '''
 
     _directive = 'create'
+    directives = (_directive,)
+    _succeeded = 'All paths have been set up'
+    _failed = 'Some paths were not successfully set up'
 
     def can_handle(self, directive):
         return directive == self._directive
 
+    def compile(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Create cannot compile directive %s' % directive)
+        return tuple(
+            CreateSpec(path=expand_path(key), mode=mode, os_constraint=os_constraint,
+                       test=compile_condition(test))
+            for key, mode, os_constraint, test in self._entries(data)
+        )
+
     def handle(self, directive, data):
         if directive != self._directive:
             raise ValueError('Create cannot handle directive %s' % directive)
-        return self._process_paths(data)
+        return self._process_paths(self._compiled(directive, data))
+
+    def retarget(self, directive, data, target):
+        if directive != self._directive:
+            raise ValueError('Create cannot retarget directive %s' % directive)
+        return tuple(spec.replace(path=target.path(spec.path)) for spec in self._compiled(directive, data))
+
+    def destinations(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Create cannot find destinations for directive %s' % directive)
+        return [spec.path for spec in self._compiled(directive, data)]
+
+    def plan(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Create cannot plan directive %s' % directive)
+        actions = []
+        specs = self._compiled(directive, data)
+        self._prefetch_tests(specs)
+        for spec in specs:
+            action = self._plan_path(spec)
+            if action is not None:
+                actions.append(action)
+        return True, actions
+
+    def apply(self, directive, actions):
+        if directive != self._directive:
+            raise ValueError('Create cannot apply directive %s' % directive)
+        return self._report(all(self._create_all(actions)))
+
+    def _process_paths(self, specs):
+        success = True
+        state = self._context.state()
+        pending = []
+        self._prefetch_tests(specs)
+        for spec in specs:
+            state_key = None
+            # a shell condition can change without anything on disk changing,
+            # and a native one is checked first
+            if state is not None and not isinstance(spec.test, str) and (
+                    spec.test is None or self._test_success(spec.test)):
+                state_key = State.key(self._directive, spec.fields())
+                entry = state.lookup(state_key)
+                if entry is not None:
+                    for path, _ in entry['directories']:
+                        self._log.lowinfo('Path exists %s', path)
+                    self._log.count(self._directive, 'existing', len(entry['directories']))
+                    continue
+            action = self._plan_path(spec)
+            if action is not None:
+                pending.append((action, state_key))
+        results = self._create_all([action for action, _ in pending])
+        for (action, state_key), created in zip(pending, results):
+            if created and state_key is not None:
+                state.record(state_key, directories=[action.path])
+            success &= created
+        return self._report(success)
 
-    def _process_paths(self, paths:Union[dict, list]):
+    def _entries(self, paths):
         """Paths can be a list or a dict depending on yaml format.
         Tread list format as soft deprecated and use original logic without os-constraint.
+
+        Yields (path, mode, os_constraint, test) for each entry.
         """
         if isinstance(paths, list):
             self._log.warning("Create from list syntax is soft deprecated, should use dict "
             "syntax with keys & null values instead for up to date behaviour.")
             # basically logic is confusing, don't need to have two ways to do the same thing,
-        success = True
         defaults = self._context.defaults().get('create', {})
         for key in paths:  # keys or indexes in list
             if isinstance(key, dict):
                 raise TypeError("Create Mode options not supported unless dict based constructor "
                     "is used (same as default dotbot).\nSwap to yaml dict syntax (with ':' line "
                     "ends and no '-' prefix).")
-            path_expanded = expand_path(key)
             mode = defaults.get('mode', 0o777)  # same as the default for os.makedirs
-            os_constraint = defaults.get('os-constraint', None)
+            os_constraint = None
+            test = defaults.get('if', None)
             if isinstance(paths, dict):
                 options = paths[key]
                 if options is not None:
                     mode = options.get('mode', mode)
-                    os_constraint = options.get('os-constraint', os_constraint)
-                    if on_permitted_os(os_constraint) is False:
-                        self._log.lowinfo(f"Path skipped {path_expanded} ({os_constraint} "
-                                          f"only)")
-                        continue  # skip illegal os
-            success &= self._create(path_expanded, mode)
-        if success:
-            self._log.info('All paths have been set up')
-        else:
-            self._log.error('Some paths were not successfully set up')
-        return success
+                    os_constraint = options.get('os-constraint',
+                                                defaults.get('os-constraint', None))
+                    test = options.get('if', test)
+            yield key, mode, os_constraint, test
+
+    def _plan_path(self, spec):
+        if on_permitted_os(spec.os_constraint) is False:
+            self._log.lowinfo("Path skipped %s (%s only)", spec.path, spec.os_constraint)
+            self._log.count(self._directive, 'skipped')
+            return None  # skip illegal os
+        if spec.test is not None and not self._test_success(spec.test):
+            self._log.lowinfo("Path skipped %s (%s is false)", spec.path,
+                              describe_condition(spec.test))
+            self._log.count(self._directive, 'skipped')
+            return None
+        return MakeDirectory(path=spec.path, mode=spec.mode)
 
     def _exists(self, path):
         '''
         Returns true if the path exists.
         '''
         path = os.path.expanduser(path)
-        return os.path.exists(path)
+        return self._context.filesystem().exists(path)
 
-    def _create(self, path, mode):
-        success = True
-        if not self._exists(path):
-            self._log.debug('Trying to create path %s with mode %o' % (path, mode))
-            try:
-                self._log.lowinfo('Creating path %s' % path)
-                os.makedirs(path, mode)
-            except OSError as e:
-                self._log.warning(f'Failed to create path {path} ({e})')
-                success = False
-        else:
-            self._log.lowinfo('Path exists %s' % path)
-        return success
+    def _create_all(self, actions):
+        """
+        Creates the paths of MakeDirectory actions, shallowest first and each
+        only once. Returns whether each action succeeded.
+        """
+        for action in actions:
+            if not isinstance(action, MakeDirectory):
+                raise ValueError('Create cannot execute %s' % action.describe())
+        self._context.filesystem().prefetch([action.path for action in actions])
+        missing = [action for action in actions if not self._exists(action.path)]
+        for action in missing:
+            self._log.debug('Trying to create path %s with mode %o', action.path, action.mode)
+        with self.span('create %d paths' % len(missing)):
+            results = self._context.directories().ensure_all(
+                [(action.path, action.mode) for action in missing])
+        outcomes = []
+        for action in actions:
+            created, error = results.pop(action.path, (False, None))
+            if error is not None:
+                self._log.warning('Failed to create path %s (%s)', action.path, error)
+                self._log.count(self._directive, 'failed')
+            elif created:
+                self._log.lowinfo('Creating path %s', action.path)
+                self._log.count(self._directive, 'created')
+            else:
+                self._log.lowinfo('Path exists %s', action.path)
+                self._log.count(self._directive, 'existing')
+            outcomes.append(error is None)
+        return outcomes
@@ -1,12 +1,17 @@
 import os
-import glob
-import shutil
+import functools
 
 import dotbot
 import dotbot.util
-import textwrap
 
+from dotbot import fs, plan
+from dotbot.conditions import compile_condition
+from dotbot.spec import LinkSpec
+from dotbot.state import State
 from dotbot.util.common import on_permitted_os
+from dotbot.util import globbing
+from dotbot.util.globbing import Globber
+from dotbot.util.parallel import run_grouped
 
 
 class Link(dotbot.Plugin):
@@ -15,14 +20,57 @@ class Link(dotbot.Plugin):
     '''
 
     _directive = 'link'
+    directives = (_directive,)
+    _succeeded = 'All links have been set up'
+    _failed = 'Some links were not successfully set up'
 
     def can_handle(self, directive):
         return directive == self._directive
 
+    def compile(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Link cannot compile directive %s' % directive)
+        defaults = self._get_default_flags()
+        return tuple(
+            self._compile_entry(destination, source_dict, defaults)
+            for destination, source_dict in data.items()
+        )
+
     def handle(self, directive, data):
         if directive != self._directive:
             raise ValueError('Link cannot handle directive %s' % directive)
-        return self._process_links(data)
+        return self._process_links(self._compiled(directive, data))
+
+    def retarget(self, directive, data, target):
+        if directive != self._directive:
+            raise ValueError('Link cannot retarget directive %s' % directive)
+        specs = []
+        for spec in self._compiled(directive, data):
+            destination_path = target.path(spec.destination_path)
+            link_target = spec.target
+            if spec.relative and not spec.glob:
+                link_target = os.path.normpath(
+                    self._relative_path(spec.absolute_source, destination_path))
+            specs.append(spec.replace(destination_path=destination_path, target=link_target))
+        return tuple(specs)
+
+    def sources(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Link cannot find sources for directive %s' % directive)
+        base_directory = self._context.base_directory()
+        sources = []
+        for spec in self._compiled(directive, data):
+            # globs are matched against the base directory, like the links'
+            # sources
+            source = globbing.root(spec.source) if spec.glob else spec.source
+            sources.append(os.path.normpath(os.path.join(base_directory, source)))
+        return sources
+
+    def destinations(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Link cannot find destinations for directive %s' % directive)
+        # a glob links into its destination directory
+        return [spec.destination_path for spec in self._compiled(directive, data)]
 
     def _get_default_flags(self):
         """Get flags for process links from default file."""
@@ -34,120 +82,398 @@ class Link(dotbot.Plugin):
         create = defaults.get("create", False)
         use_glob = defaults.get("glob", False)
         test = defaults.get("if", None)
+        test_env = defaults.get("if-cache", None)
         ignore_missing = defaults.get("ignore-missing", False)
         exclude_paths = defaults.get('exclude', [])
         os_constraint = defaults.get("os-constraint", None)
-        return relative, canonical_path, force, relink, create, use_glob, test, ignore_missing, \
-               exclude_paths, os_constraint
+        return relative, canonical_path, force, relink, create, use_glob, test, test_env, \
+               ignore_missing, exclude_paths, os_constraint
+
+    def _compile_entry(self, destination, source_dict, defaults):
+        """Merge defaults into one config entry and resolve its paths."""
+        (relative, canonical_path, force_flag, relink_flag, create_dir_flag, use_glob,
+         shell_command, test_env, ignore_missing, exclude_paths, os_constraint) = defaults
+        destination = os.path.expandvars(destination)
+        if isinstance(source_dict, dict):  # user supplied a "dict" of keys in addition to path
+            path = self._default_source(destination, source_dict.get("path"))
+            # extended config
+            shell_command = source_dict.get("if", shell_command)
+            test_env = source_dict.get("if-cache", test_env)
+            relative = source_dict.get("relative", relative)
+            # support old "canonicalize-path" key for compatibility
+            canonical_path = source_dict.get("canonicalize", source_dict.get(
+                "canonicalize-path", canonical_path))
+            force_flag = source_dict.get("force", force_flag)
+            relink_flag = source_dict.get("relink", relink_flag)
+            create_dir_flag = source_dict.get("create", create_dir_flag)
+            use_glob = source_dict.get("glob", use_glob)
+            ignore_missing = source_dict.get("ignore-missing", ignore_missing)
+            exclude_paths = source_dict.get("exclude", exclude_paths)
+            os_constraint = source_dict.get("os-constraint", os_constraint)
+        else:  # user only supplied a path
+            path = self._default_source(destination, source_dict)
+            os_constraint = None
+        path = os.path.expandvars(os.path.expanduser(path))
+        destination_path = os.path.normpath(os.path.expanduser(destination))
+        absolute_source = target = None
+        if not use_glob:
+            absolute_source, target = self._resolve_source(
+                path, destination_path, relative, canonical_path)
+        return LinkSpec(
+            destination=destination,
+            destination_path=destination_path,
+            source=path,
+            absolute_source=absolute_source,
+            target=target,
+            relative=relative,
+            canonicalize=canonical_path,
+            force=force_flag,
+            relink=relink_flag,
+            create=create_dir_flag,
+            glob=use_glob,
+            test=compile_condition(shell_command),
+            test_env=None if test_env is None else tuple(test_env),
+            ignore_missing=ignore_missing,
+            exclude=tuple(
+                os.path.expandvars(os.path.expanduser(exclude)) for exclude in exclude_paths),
+            os_constraint=os_constraint,
+        )
+
+    def _resolve_source(self, source, destination_path, relative, canonical_path):
+        """
+        Returns the absolute path of a source and the text of a link to it
+        from destination_path.
+        """
+        base_directory = self._context.base_directory(canonical_path=canonical_path)
+        absolute_source = os.path.join(base_directory, source)
+        if relative:
+            target = self._relative_path(absolute_source, destination_path)
+        else:
+            target = absolute_source
+        return absolute_source, os.path.normpath(target)
 
+    def _get_jobs(self):
+        """Number of worker threads to link with; the command line wins over defaults."""
+        jobs = getattr(self._context.options(), "jobs", None)
+        if jobs is None:
+            jobs = self._context.defaults().get("link", {}).get("jobs", 1)
+        return max(int(jobs), 1)
 
-    def _process_links(self, links_dict):
+    def _process_links(self, specs):
         # print("symlinking\n\t", links)
-        success = True
-        (relative_default, canonical_path_default, force_flag_default, relink_flag_default,
-         create_dir_flag_default, use_glob_default, shell_command_default,
-         ignore_missing_default, exclude_paths_default, os_constraint_default) = \
-            self._get_default_flags()
-
-        for destination, source_dict in links_dict.items():
-            destination = os.path.expandvars(destination)
-
-            if isinstance(source_dict, dict):  # user supplied a "dict" of keys in addition to path
-                path = self._default_source(destination, source_dict.get("path"))
-                # extended config
-                shell_command = source_dict.get("if", shell_command_default)
-                relative = source_dict.get("relative", relative_default)
-                # support old "canonicalize-path" key for compatibility
-                canonical_path = source_dict.get("canonicalize", source_dict.get(
-                    "canonicalize-path", canonical_path_default))
-                force_flag = source_dict.get("force", force_flag_default)
-                relink_flag = source_dict.get("relink", relink_flag_default)
-                create_dir_flag = source_dict.get("create", create_dir_flag_default)
-                use_glob = source_dict.get("glob", use_glob_default)
-                ignore_missing = source_dict.get("ignore-missing", ignore_missing_default)
-                exclude_paths = source_dict.get("exclude", exclude_paths_default)
-                os_constraint = source_dict.get("os-constraint", os_constraint_default)
-                if on_permitted_os(os_constraint, log=None) is False:
-                    expanded_dest = os.path.normpath(os.path.expanduser(destination))
-                    self._log.lowinfo(f"Skipping link {expanded_dest} ({os_constraint} only)")
-                    continue
-
-            else:  # user only supplied a path
-                path = self._default_source(destination, source_dict)
-
-                (shell_command, relative, canonical_path, force_flag, relink_flag,
-                create_dir_flag, use_glob, ignore_missing, exclude_paths) = (shell_command_default,
-                                                               relative_default, canonical_path_default, force_flag_default, relink_flag_default,
-                create_dir_flag_default, use_glob_default, ignore_missing_default, exclude_paths_default)
-            if shell_command is not None and not self._test_success(shell_command):
-                self._log.lowinfo("Skipping %s" % destination)
+        state = self._context.state()
+        operations = []
+        applied = []
+        self._prefetch_tests(specs)
+        keyed = []
+        for spec in specs:
+            key = self._state_key(spec) if state else None
+            if key is not None and spec.test is not None and not self._test_success(spec.test):
+                # planned again, to be skipped
+                keyed.append((spec, key, None))
                 continue
-            path = os.path.expandvars(os.path.expanduser(path))
-            if use_glob:
-                glob_results = self._create_glob_results(path, exclude_paths)
-                if len(glob_results) == 0:
-                    self._log.warning("Globbing couldn't find anything matching " + str(path))
-                    success = False
-                    continue
-                if len(glob_results) == 1 and destination[-1] == '/':
-                    self._log.error("Ambiguous action requested.")
-                    self._log.error("No wildcard in glob, directory use undefined: " +
-                        destination + " -> " + str(glob_results))
-                    self._log.warning("Did you want to link the directory or into it?")
-                    success = False
-                    continue
-                elif len(glob_results) == 1 and destination[-1] != '/':
-                    # perform a normal link operation
-                    if create_dir_flag:
-                        success &= self._create_dir(destination)
-                    if force_flag or relink_flag:
-                        success &= self._delete(path, destination, relative, canonical_path, force_flag)
-                    success &= self._link(path, destination, relative, canonical_path, ignore_missing)
-                else:
-                    self._log.lowinfo("Globs from '" + path + "': " + str(glob_results))
-                    for glob_full_item in glob_results:
-                        # Find common dirname between pattern and the item:
-                        glob_dirname = os.path.dirname(os.path.commonprefix([path, glob_full_item]))
-                        glob_item = (glob_full_item if len(glob_dirname) == 0 else glob_full_item[len(glob_dirname) + 1:])
-                        # where is it going
-                        glob_link_destination = os.path.join(destination, glob_item)
-                        if create_dir_flag:
-                            success &= self._create_dir(glob_link_destination)
-                        if force_flag or relink_flag:
-                            success &= self._delete(
-                                glob_full_item, glob_link_destination, relative, canonical_path, force_flag
-                            )
-                        success &= self._link(
-                            glob_full_item, glob_link_destination, relative, canonical_path, ignore_missing
-                        )
-            else:  # not using glob:
-                if create_dir_flag:
-                    success &= self._create_dir(destination)
-                if ignore_missing is False and self._exists(
-                    os.path.join(self._context.base_directory(), path)
-                ) is False:
-                    # we seemingly check this twice (here and in _link) because
-                    # if the file doesn't exist and force is True, we don't
-                    # want to remove the original (this is tested by
-                    # link-force-leaves-when-nonexistent.bash)
-                    success = False
-                    self._log.warning('Nonexistent source %s -> %s' %
-                        (destination, path))
-                    continue
-                if force_flag or relink_flag:
-                    success &= self._delete(path, destination, relative, canonical_path, force_flag)
-                success &= self._link(path, destination, relative, canonical_path, ignore_missing)
-        if success:
-            self._log.info('All links have been set up')
-        else:
-            self._log.error('Some links were not successfully set up')
-        return success
-
-    def _test_success(self, command):
-        ret = dotbot.util.shell_command(command, cwd=self._context.base_directory())
-        if ret != 0:
-            self._log.debug("Test '%s' returned false" % command)
-        return ret == 0
+            keyed.append((spec, key, state.lookup(key) if key is not None else None))
+        self._prefetch_sources([spec for spec, _, entry in keyed if entry is None])
+        # directory listings are shared by the entries of this directive
+        globber = Globber()
+        for spec, key, entry in keyed:
+            if entry is not None:
+                operations.append((None, functools.partial(self._unchanged, entry)))
+                continue
+            # anything logged while planning an entry is emitted in sequence
+            # with the operations of the entries around it
+            watched = []
+            with self._log.buffered() as records:
+                planned, actions = self._plan_entry(spec, watched, globber)
+            operations.append((None, functools.partial(self._replay, records, planned)))
+            start = len(operations)
+            operations.extend(self._operations(actions))
+            if key is not None and planned:
+                applied.append((key, start, len(operations), actions, watched))
+        results = self._run(operations)
+        for key, start, end, actions, watched in applied:
+            links = [(action.destination, action.target)
+                     for action in actions if isinstance(action, plan.Symlink)]
+            if links and all(results[start:end]):
+                state.record(key, links, watched)
+        return self._report(all(results))
+
+    def _state_key(self, spec):
+        """
+        Returns the key identifying an entry in the incremental run state, or
+        None if the entry has to be re-evaluated on every run.
+        """
+        if isinstance(spec.test, str):
+            # the outcome of the test can change without anything on disk
+            # changing (native conditions are checked before the lookup)
+            return None
+        return State.key(self._directive, spec.fields(), self._context.base_directory())
+
+    def _unchanged(self, entry):
+        for destination, target, _ in entry["links"]:
+            self._log.lowinfo("Link exists %s -> %s", destination, target)
+            self._managed(destination, target)
+        self._log.count(self._directive, "existing", len(entry["links"]))
+        return True
+
+    def plan(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Link cannot plan directive %s' % directive)
+        success = True
+        actions = []
+        specs = self._compiled(directive, data)
+        self._prefetch_tests(specs)
+        self._prefetch_sources(specs)
+        globber = Globber()
+        for spec in specs:
+            planned, entry_actions = self._plan_entry(spec, globber=globber)
+            success &= planned
+            actions.extend(entry_actions)
+        return success, actions
+
+    def apply(self, directive, actions):
+        if directive != self._directive:
+            raise ValueError('Link cannot apply directive %s' % directive)
+        return self._report(all(self._run(self._operations(actions))))
+
+    def _run(self, operations):
+        """Runs (action, callable) operations, returning their results in order."""
+        jobs = self._get_jobs()
+        if jobs > 1:
+            self._log.debug("Linking with %d jobs", jobs)
+        self._prefetch_paths(operations)
+        return run_grouped(self._order_operations(operations), jobs)
+
+    def _replay(self, records, result):
+        self._log.replay(records)
+        return result
+
+    def _operations(self, actions):
+        operations = []
+        index = 0
+        while index < len(actions):
+            action = actions[index]
+            following = actions[index + 1] if index + 1 < len(actions) else None
+            if (isinstance(action, plan.Remove) and isinstance(following, plan.Symlink)
+                    and following.destination == action.path):
+                # replaced in one step where possible, see _relink()
+                operations.append((following, functools.partial(self._relink, action, following)))
+                index += 2
+            else:
+                operations.append((action, functools.partial(self._execute, action)))
+                index += 1
+        return operations
+
+    def _execute(self, action):
+        with self.span(action.describe()):
+            if isinstance(action, plan.MakeDirectory):
+                return self._create_dir(action.path)
+            elif isinstance(action, plan.Remove):
+                return self._delete(action.path, action.keep_link_to, action.force)
+            elif isinstance(action, plan.Symlink):
+                return self._link(action.source, action.target, action.destination,
+                                  action.ignore_missing)
+        raise ValueError('Link cannot execute %s' % action.describe())
+
+    def _relink(self, remove, symlink):
+        """
+        Executes a Remove followed by a Symlink to the same path. A link, or
+        a file if forced, is replaced by renaming the new link over it, so
+        that the path never goes missing. Anything else is removed and then
+        linked.
+        """
+        path = symlink.destination
+        filesystem = self._context.filesystem()
+        kind = filesystem.kind(path)
+        if not (kind == fs.LINK and filesystem.readlink(path) != remove.keep_link_to
+                or kind == fs.OTHER and remove.force):
+            return self._execute(remove) and self._execute(symlink)
+        with self.span('replace %s -> %s' % (path, symlink.target)):
+            if symlink.ignore_missing is False and self._exists(symlink.source) is False:
+                # leave what is there alone
+                self._log.warning("Nonexistent source %s <-> %s", path, symlink.source)
+                self._log.count(self._directive, "failed")
+                return False
+            try:
+                filesystem.replace_symlink(symlink.target, path)
+            except OSError as e:
+                self._log.warning("Failed to replace %s (%s)", path, e)
+                self._log.count(self._directive, "failed")
+                return False
+            self._log.lowinfo("Replacing %s -> %s", path, os.path.expanduser(symlink.target))
+            self._log.count(self._directive, "created")
+            self._managed(path, symlink.target, symlink.source)
+            return True
+
+    def _managed(self, destination, target, source=None):
+        """Records a link the config produced in the index of managed links."""
+        index = self._context.link_index()
+        if index is not None:
+            index.record(destination, target, source)
+
+    def _plan_entry(self, spec, watched=None, globber=None):
+        """
+        Work out the actions for one config entry, without running them.
+
+        Returns a (success, actions) pair. If watched is given, the paths the
+        actions were resolved from (the source, or the directories a glob
+        listed) are appended to it.
+        """
+        actions = []
+        destination = spec.destination
+        path = spec.source
+        if spec.os_constraint is not None and on_permitted_os(spec.os_constraint) is False:
+            self._log.lowinfo("Skipping link %s (%s only)", spec.destination_path, spec.os_constraint)
+            self._log.count(self._directive, "skipped")
+            return True, actions
+        if spec.test is not None and not self._test_success(spec.test, spec.test_env):
+            self._log.lowinfo("Skipping %s", destination)
+            self._log.count(self._directive, "skipped")
+            return True, actions
+        if spec.glob:
+            listed = []
+            glob_results = self._create_glob_results(
+                path, spec.exclude, globber if globber is not None else Globber(), listed)
+            if watched is not None:
+                # a pattern without wildcards does not list anything
+                watched.extend(sorted(set(listed)) or [os.path.abspath(path)])
+            if len(glob_results) == 0:
+                self._log.warning("Globbing couldn't find anything matching %s", path)
+                self._log.count(self._directive, "failed")
+                return False, actions
+            if len(glob_results) == 1 and destination[-1] == '/':
+                self._log.error("Ambiguous action requested.")
+                self._log.error("No wildcard in glob, directory use undefined: " +
+                    destination + " -> " + str(glob_results))
+                self._log.warning("Did you want to link the directory or into it?")
+                self._log.count(self._directive, "failed")
+                return False, actions
+            elif len(glob_results) == 1 and destination[-1] != '/':
+                # perform a normal link operation
+                actions.extend(self._plan_link(spec, path, spec.destination_path))
+            else:
+                self._log.lowinfo("Globs from '%s': %s", path, glob_results)
+                for glob_full_item in glob_results:
+                    # Find common dirname between pattern and the item:
+                    glob_dirname = os.path.dirname(os.path.commonprefix([path, glob_full_item]))
+                    glob_item = (glob_full_item if len(glob_dirname) == 0 else glob_full_item[len(glob_dirname) + 1:])
+                    # where is it going
+                    glob_link_destination = os.path.join(spec.destination_path, glob_item)
+                    actions.extend(self._plan_link(spec, glob_full_item, glob_link_destination))
+        else:  # not using glob:
+            if spec.ignore_missing is False and self._exists(
+                os.path.join(self._context.base_directory(), path)
+            ) is False:
+                # we seemingly check this twice (here and in _link) because
+                # if the file doesn't exist and force is True, we don't
+                # want to remove the original (this is tested by
+                # link-force-leaves-when-nonexistent.bash)
+                if spec.create:
+                    actions.append(self._plan_parent(spec.destination_path))
+                self._log.warning('Nonexistent source %s -> %s', destination, path)
+                self._log.count(self._directive, "failed")
+                return False, actions
+            actions.extend(self._plan_link(
+                spec, path, spec.destination_path, spec.absolute_source, spec.target))
+            if watched is not None:
+                watched.append(os.path.abspath(path))
+        return True, actions
+
+    def _plan_parent(self, path):
+        return plan.MakeDirectory(path=os.path.dirname(os.path.abspath(path)), mode=None)
+
+    def _plan_link(self, spec, source, destination_path, absolute_source=None, target=None):
+        """
+        Plans linking destination_path to source: creating its parent
+        directory, removing whatever is in the way, then the link itself.
+        """
+        actions = []
+        destination_path = os.path.normpath(destination_path)
+        if absolute_source is None:
+            absolute_source, target = self._resolve_source(
+                source, destination_path, spec.relative, spec.canonicalize)
+        if spec.create:
+            actions.append(self._plan_parent(destination_path))
+        if spec.force or spec.relink:
+            actions.append(plan.Remove(
+                path=destination_path, keep_link_to=target, force=spec.force))
+        actions.append(plan.Symlink(
+            source=absolute_source, target=target, destination=destination_path,
+            ignore_missing=spec.ignore_missing))
+        return actions
+
+    def _order_operations(self, operations):
+        """
+        Assign ordering groups to (action, callable) operations.
+
+        Operations on the same directory (links into it, or creating it) stay
+        in order relative to each other. An operation inside another
+        operation's link destination (e.g. a link into a directory that an
+        earlier entry links) is kept in the same group as that operation.
+        """
+        directories = {}
+        owners = {}
+        for index, (action, _) in enumerate(operations):
+            if isinstance(action, plan.MakeDirectory):
+                directories[index] = action.path
+            elif isinstance(action, plan.Remove):
+                directories[index] = os.path.dirname(action.path)
+            elif isinstance(action, plan.Symlink):
+                directories[index] = os.path.dirname(action.destination)
+                owners.setdefault(action.destination, index)
+
+        groups = list(range(len(operations)))
+
+        def find(index):
+            while groups[index] != index:
+                groups[index] = groups[groups[index]]
+                index = groups[index]
+            return index
+
+        by_directory = {}
+        for index, directory in directories.items():
+            if directory in by_directory:
+                groups[find(index)] = find(by_directory[directory])
+            else:
+                by_directory[directory] = index
+            ancestor = directory
+            while True:
+                owner = owners.get(ancestor)
+                if owner is not None and owner != index:
+                    groups[find(index)] = find(owner)
+                next_ancestor = os.path.dirname(ancestor)
+                if next_ancestor == ancestor:
+                    break
+                ancestor = next_ancestor
+
+        return [
+            (None if index not in directories else find(index), function)
+            for index, (_, function) in enumerate(operations)
+        ]
+
+    def _prefetch_sources(self, specs):
+        """Looks up the sources of the entries, which planning checks exist."""
+        base_directory = self._context.base_directory()
+        self._context.filesystem().prefetch([
+            os.path.join(base_directory, spec.source) for spec in specs
+            if not spec.glob and not spec.ignore_missing
+        ])
+
+    def _prefetch_paths(self, operations):
+        """
+        Looks up every path the operations look at before they run, so that
+        the paths that share a directory are found with one listing of it.
+        """
+        paths = []
+        for action, _ in operations:
+            if isinstance(action, plan.MakeDirectory):
+                paths.append(action.path)
+            elif isinstance(action, plan.Remove):
+                paths.append(action.path)
+            elif isinstance(action, plan.Symlink):
+                paths.append(action.destination)
+                paths.append(action.source)
+        self._context.filesystem().prefetch(paths)
 
     def _default_source(self, destination, source):
         if source is None:
@@ -159,22 +485,20 @@ class Link(dotbot.Plugin):
         else:
             return source
 
-    def _create_glob_results(self, path, exclude_paths):
-        self._log.debug("Globbing with path: " + str(path))
-        base_include = glob.glob(path)
-        to_exclude = []
-        for expath in exclude_paths:
-            self._log.debug("Excluding globs with path: " + str(expath))
-            to_exclude.extend(glob.glob(expath))
-        self._log.debug("Excluded globs from '" + path + "': " + str(to_exclude))
-        ret = set(base_include) - set(to_exclude)
-        return list(ret)
+    def _create_glob_results(self, path, exclude_paths, globber, listed=None):
+        self._log.debug("Globbing with path: %s", path)
+        if exclude_paths:
+            self._log.debug("Excluding globs with paths: %s", list(exclude_paths))
+        with self.span('glob %s' % path, category='fs') as span:
+            results = sorted(globber.iglob(path, exclude_paths, listed))
+            span.set(matches=len(results))
+        return results
 
     def _is_link(self, path):
         '''
         Returns true if the path is a symbolic link.
         '''
-        return os.path.islink(os.path.expanduser(path))
+        return self._context.filesystem().islink(os.path.expanduser(path))
 
     def _get_link_destination(self, path):
         '''
@@ -184,16 +508,17 @@ class Link(dotbot.Plugin):
         '''
         # path = os.path.normpath(path)
         path = os.path.expanduser(path)
+        filesystem = self._context.filesystem()
         try:
-            read_link = os.readlink(path)
+            read_link = filesystem.readlink(path)
             # Read link can return paths starting with \\?\ - this allows over the 255 file name
             # limit
         except OSError as e:
-            if "[WinError 4390] The file or directory is not a reparse point" in str(e) and os.path.isdir(path):
+            if "[WinError 4390] The file or directory is not a reparse point" in str(e) and filesystem.isdir(path):
                 return "UNLINKED_DIR"
             return "OSERROR_READING_LINK"
         except Exception as e:
-            print(e)
+            self._log.debug("Could not read link %s (%s)", path, e)
             return "GENERAL_EXCEPTION_READING_LINK"
         else:
             if read_link.startswith("\\\\?\\"):
@@ -205,50 +530,50 @@ class Link(dotbot.Plugin):
         Returns true if the path exists. Returns false if contains dangling symbolic links.
         '''
         path = os.path.expanduser(path)
-        return os.path.exists(path)
+        return self._context.filesystem().exists(path)
 
-    def _create_dir(self, path):
-        """Create all directories in path if they do not already exist."""
+    def _create_dir(self, parent):
+        """Create all directories in parent if they do not already exist."""
         success = True
-        parent = os.path.abspath(os.path.join(os.path.expanduser(path), os.pardir))
-        if not self._exists(parent):
-            self._log.debug("Try to create parent: " + str(parent))
-            try:
-                os.makedirs(parent)
-            except OSError:
-                self._log.warning('Failed to create directory %s' % parent)
-                success = False
-            else:
-                self._log.lowinfo('Creating directory %s' % parent)
+        try:
+            created = self._context.directories().ensure(parent)
+        except OSError:
+            self._log.warning('Failed to create directory %s', parent)
+            success = False
+        else:
+            if created:
+                self._log.lowinfo('Creating directory %s', parent)
         return success
 
-    def _delete(self, source, path, relative, canonical_path, force):
+    def _delete(self, path, keep_link_to, force):
+        """
+        Removes path unless it is a link to keep_link_to. Regular files and
+        directories are only removed if force is set.
+        """
         success = True
-        source = os.path.join(self._context.base_directory(canonical_path=canonical_path), source)
-        fullpath = os.path.expanduser(path)
-        if relative:
-            source = self._relative_path(source, fullpath)
-        if (self._is_link(path) and self._get_link_destination(path) != source) or (
+        filesystem = self._context.filesystem()
+        if (self._is_link(path) and self._get_link_destination(path) != keep_link_to) or (
             self._exists(path) and not self._is_link(path)
         ):
             removed = False
             try:
-                if os.path.islink(fullpath):
-                    os.unlink(fullpath)
+                if filesystem.islink(path):
+                    filesystem.unlink(path)
                     removed = True
                 elif force:
-                    if os.path.isdir(fullpath):
-                        shutil.rmtree(fullpath)
+                    if filesystem.isdir(path):
+                        with self.span('rmtree %s' % path, category='fs'):
+                            filesystem.rmtree(path)
                         removed = True
                     else:
-                        os.remove(fullpath)
+                        filesystem.remove(path)
                         removed = True
             except OSError:
-                self._log.warning('Failed to remove %s' % path)
+                self._log.warning('Failed to remove %s', path)
                 success = False
             else:
                 if removed:
-                    self._log.lowinfo('Removing %s' % path)
+                    self._log.lowinfo('Removing %s', path)
         return success
 
     def _relative_path(self, source, destination):
@@ -259,39 +584,32 @@ class Link(dotbot.Plugin):
         destination_dir = os.path.dirname(destination)
         return os.path.relpath(source, destination_dir)
 
-    def _link(self, dotfile_source, target_path_to_link_at, relative_path, canonical_path, ignore_missing):
+    def _link(self, absolute_source, dotfile_source, destination, ignore_missing):
         '''
-        Links link_name to source.
-        :param target_path_to_link_at is the file path where we are putting a symlink
+        Links destination to source.
+        :param absolute_source - source file in dotfiles directory
+        :param dotfile_source - what the symlink should contain, which may be a relative path to
+            absolute_source
+        :param destination is the file path where we are putting a symlink
             (where the file originally lived)
-        :param dotfile_source - source file in dotfiles directory, which file should symlink to
 
         Returns true if successfully linked files.
         '''
         success_flag = False
-        destination = os.path.normpath(os.path.expanduser(target_path_to_link_at))
-        base_directory = self._context.base_directory(canonical_path=canonical_path)
-        absolute_source = os.path.join(base_directory, dotfile_source)
         # Check source directory exists unless we ignore missing
         if ignore_missing is False and self._exists(absolute_source) is False:
-            self._log.warning("Nonexistent source %s <-> %s" % (
-                target_path_to_link_at, dotfile_source))
+            self._log.warning("Nonexistent source %s <-> %s", destination, absolute_source)
+            self._log.count(self._directive, "failed")
             return success_flag
 
-        if relative_path:
-            dotfile_source = self._relative_path(absolute_source, destination)
-        else:
-            dotfile_source = absolute_source
-        dotfile_source = os.path.normpath(dotfile_source)
-
-        target_path_exists: bool = self._exists(target_path_to_link_at)
-        target_file_is_link: bool = self._is_link(target_path_to_link_at)
+        target_path_exists: bool = self._exists(destination)
+        target_file_is_link: bool = self._is_link(destination)
 
         # get the file/ folder the symlink (located at the target path) is pointed to
-        symlink_dest_at_target_path: str = self._get_link_destination(target_path_to_link_at)
+        symlink_dest_at_target_path: str = self._get_link_destination(destination)
 
         # Expanded, os style paths for reporting/ error checking
-        symlink_loc_clean = os.path.normpath(os.path.expanduser(target_path_to_link_at))
+        symlink_loc_clean = destination
         dotfile_source_expanded = os.path.expanduser(dotfile_source)
 
         # Check case of links are present but incorrect
@@ -303,42 +621,50 @@ class Link(dotbot.Plugin):
                                   f"Expected {symlink_dest_clean}, found "
                                   f"{dotfile_source_expanded}"
                                  )
-                print("Link found:", symlink_dest_at_target_path, "expected", dotfile_source)
+                self._log.debug("Link found: %s expected %s",
+                    symlink_dest_at_target_path, dotfile_source)
             else:
                 # Symlink is broken or dangling
-                self._log.warning(f"Symlink Invalid:\n\t {symlink_loc_clean}"
-                                  f"\n\t -> {symlink_dest_clean}")
+                self._log.warning("Symlink Invalid:\n\t %s\n\t -> %s",
+                                  symlink_loc_clean, symlink_dest_clean)
+            self._log.count(self._directive, "failed")
             return success_flag
 
         if target_path_exists:  # file/ folder we want to put symlink in already exists
             if target_file_is_link:  # already checked if link pointed to wrong location,
                 # so if it's a link we know it's correct
-                self._log.lowinfo("Link exists %s -> %s" % (symlink_loc_clean, dotfile_source_expanded))
+                self._log.lowinfo("Link exists %s -> %s", symlink_loc_clean, dotfile_source_expanded)
+                self._log.count(self._directive, "existing")
+                self._managed(destination, dotfile_source, absolute_source)
                 success_flag = True
                 return success_flag
             else:  # Not a link
                 self._log.warning(
-                    "%s already exists but is a regular file or directory" % symlink_loc_clean)
+                    "%s already exists but is a regular file or directory", symlink_loc_clean)
+                self._log.count(self._directive, "failed")
                 return success_flag
         else:
             # target path doesn't exist already, so we try to create the symlink
             try:
-                print(f"running symlink with args '{dotfile_source}', '{destination}'")
-                os.symlink(dotfile_source, destination)
+                self._log.debug("running symlink with args '%s', '%s'", dotfile_source, destination)
+                self._context.filesystem().symlink(dotfile_source, destination)
             except OSError as e:
+                import textwrap
                 msg = textwrap.fill(
                     f"Linking failed {symlink_loc_clean} -> {dotfile_source_expanded}\n ({e})",
                     width=80, subsequent_indent="    ")
 
                 self._log.warning(msg)
+                self._log.count(self._directive, "failed")
             except Exception as e:
-                print(
+                self._log.error(
                     f"SYMLINK FAILED with arguments os.symlink({dotfile_source}, {destination})",
                 )
                 raise e
             else:
-                self._log.lowinfo("Creating link %s -> %s" % (symlink_loc_clean, dotfile_source_expanded))
+                self._log.lowinfo("Creating link %s -> %s", symlink_loc_clean, dotfile_source_expanded)
+                self._log.count(self._directive, "created")
+                self._managed(destination, dotfile_source, absolute_source)
                 success_flag = True
 
             return success_flag
-
@@ -1,7 +1,8 @@
 import os
-import subprocess
 import dotbot
-import dotbot.util
+from dotbot.conditions import compile_condition, describe_condition
+from dotbot.plan import RunCommand
+from dotbot.spec import ShellSpec
 
 
 class Shell(dotbot.Plugin):
@@ -10,26 +11,33 @@ class Shell(dotbot.Plugin):
     '''
 
     _directive = 'shell'
+    directives = (_directive,)
+    _succeeded = 'All commands have been executed'
+    _failed = 'Some commands were not successfully executed'
     _has_shown_override_message = False
+    _output_modes = ('block', 'prefix')
+
+    # parallel commands mostly wait on other programs, so this is not tied
+    # to the number of processors
+    _default_jobs = 8
 
     def can_handle(self, directive):
         return directive == self._directive
 
-    def handle(self, directive, data):
+    def compile(self, directive, data):
         if directive != self._directive:
-            raise ValueError('Shell cannot handle directive %s' %
-                directive)
-        return self._process_commands(data)
-
-    def _process_commands(self, data):
-        success = True
+            raise ValueError('Shell cannot compile directive %s' % directive)
+        specs = []
         defaults = self._context.defaults().get('shell', {})
-        options = self._get_option_overrides()
         for item in data:
             stdin = defaults.get('stdin', False)
             stdout = defaults.get('stdout', False)
             stderr = defaults.get('stderr', False)
             quiet = defaults.get('quiet', False)
+            parallel = defaults.get('parallel', False)
+            jobs = defaults.get('jobs', None)
+            output = defaults.get('output', 'block')
+            test = defaults.get('if', None)
             if isinstance(item, dict):
                 cmd = item['command']
                 msg = item.get('description', None)
@@ -37,35 +45,176 @@ class Shell(dotbot.Plugin):
                 stdout = item.get('stdout', stdout)
                 stderr = item.get('stderr', stderr)
                 quiet = item.get('quiet', quiet)
+                parallel = item.get('parallel', parallel)
+                jobs = item.get('jobs', jobs)
+                output = item.get('output', output)
+                test = item.get('if', test)
             elif isinstance(item, list):
                 cmd = item[0]
                 msg = item[1] if len(item) > 1 else None
             else:
                 cmd = item
                 msg = None
-            if msg is None:
-                self._log.lowinfo(cmd)
-            elif quiet:
-                self._log.lowinfo('%s' % msg)
+            if output not in self._output_modes:
+                raise ValueError('Unknown shell output mode %s (expected one of %s)' %
+                    (output, ', '.join(self._output_modes)))
+            specs.append(ShellSpec(
+                command=cmd, description=msg, quiet=quiet, stdin=stdin, stdout=stdout,
+                stderr=stderr, parallel=parallel, jobs=jobs, output=output,
+                test=compile_condition(test)))
+        return tuple(specs)
+
+    def handle(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Shell cannot handle directive %s' %
+                directive)
+        return self._process_commands(self._compiled(directive, data))
+
+    def retarget(self, directive, data, target):
+        if directive != self._directive:
+            raise ValueError('Shell cannot retarget directive %s' % directive)
+        # commands run once per target, which they can tell from $HOME and
+        # $DOTBOT_TARGET_ROOT
+        return self._compiled(directive, data)
+
+    def plan(self, directive, data):
+        if directive != self._directive:
+            raise ValueError('Shell cannot plan directive %s' % directive)
+        return True, self._plan_commands(self._compiled(directive, data))
+
+    def apply(self, directive, actions):
+        if directive != self._directive:
+            raise ValueError('Shell cannot apply directive %s' % directive)
+        return self._run_commands(actions)
+
+    def _process_commands(self, specs):
+        return self._run_commands(self._plan_commands(specs))
+
+    def _plan_commands(self, specs):
+        self._prefetch_tests(specs)
+        actions = []
+        for spec in specs:
+            if spec.test is not None and not self._test_success(spec.test):
+                self._log.lowinfo('Skipping command [%s] (%s is false)', spec.command,
+                                  describe_condition(spec.test))
+                self._log.count(self._directive, 'skipped')
+                continue
+            actions.append(RunCommand(
+                command=spec.command, description=spec.description, quiet=spec.quiet,
+                stdin=spec.stdin, stdout=spec.stdout, stderr=spec.stderr,
+                parallel=spec.parallel, jobs=spec.jobs, output=spec.output))
+        return actions
+
+    def _run_commands(self, actions):
+        success = True
+        options = self._get_option_overrides()
+        for batch in self._batches(actions):
+            if len(batch) == 1:
+                success &= self._run(batch[0], options)
             else:
-                self._log.lowinfo('%s [%s]' % (msg, cmd))
-            stdout = options.get('stdout', stdout)
-            stderr = options.get('stderr', stderr)
-            ret = dotbot.util.shell_command(
-                cmd,
+                success &= self._run_concurrently(batch, options)
+        return self._report(success)
+
+    def _batches(self, actions):
+        """
+        Splits actions into batches that can run together: consecutive
+        parallel commands share a batch, every other command is on its own.
+        """
+        batch = []
+        for action in actions:
+            if self._is_parallel(action):
+                batch.append(action)
+                continue
+            if batch:
+                yield batch
+                batch = []
+            yield [action]
+        if batch:
+            yield batch
+
+    def _is_parallel(self, action):
+        # a command reading from stdin needs the terminal to itself
+        return bool(action.parallel) and not action.stdin
+
+    def _get_jobs(self, batch):
+        limits = [action.jobs for action in batch if action.jobs is not None]
+        jobs = min(limits) if limits else self._default_jobs
+        return max(int(jobs), 1)
+
+    def _run_concurrently(self, batch, options):
+        """
+        Runs a batch of commands on a pool of threads. Output is captured and
+        printed as a block under each command's log line, in config order, or
+        streamed as it arrives with each line prefixed by the command.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        success = True
+        with ThreadPoolExecutor(max_workers=self._get_jobs(batch)) as executor:
+            futures = [
+                executor.submit(self._run_captured, action, options)
+                for action in batch
+            ]
+            for future in futures:
+                ok, records, lines, dropped = future.result()
+                self._log.replay(records)
+                if dropped:
+                    self._log.lowinfo('(%d lines of output omitted)', dropped)
+                for stream, line in lines:
+                    self._log.output(line, stream)
+                success &= ok
+        return success
+
+    def _run_captured(self, action, options):
+        label = action.command if action.description is None else action.description
+
+        def prefixed(stream, line):
+            self._log.output('%s | %s' % (label, line), stream)
+
+        streaming = action.output == 'prefix'
+        with self._log.buffered() as records, self.span(action.describe()):
+            self._announce(action)
+            ret, lines, dropped = self._context.shells().run_captured(
+                action.command,
                 cwd=self._context.base_directory(),
-                enable_stdin=stdin,
-                enable_stdout=stdout,
-                enable_stderr=stderr
+                enable_stdout=options.get('stdout', action.stdout),
+                enable_stderr=options.get('stderr', action.stderr),
+                on_line=prefixed if streaming else None
             )
             if ret != 0:
-                success = False
-                self._log.warning('Command [%s] failed' % cmd)
-        if success:
-            self._log.info('All commands have been executed')
+                self._log.warning('Command [%s] failed', action.command)
+        self._log.count(self._directive, 'run' if ret == 0 else 'failed')
+        if streaming:
+            lines, dropped = [], 0
+        return ret == 0, records, lines, dropped
+
+    def _announce(self, action):
+        cmd, msg = action.command, action.description
+        if msg is None:
+            self._log.lowinfo(cmd)
+        elif action.quiet:
+            self._log.lowinfo('%s', msg)
         else:
-            self._log.error('Some commands were not successfully executed')
-        return success
+            self._log.lowinfo('%s [%s]', msg, cmd)
+
+    def _run(self, action, options):
+        with self.span(action.describe()):
+            return self._run_command(action, options)
+
+    def _run_command(self, action, options):
+        self._announce(action)
+        stdout = options.get('stdout', action.stdout)
+        stderr = options.get('stderr', action.stderr)
+        ret = self._context.shells().run(
+            action.command,
+            cwd=self._context.base_directory(),
+            enable_stdin=action.stdin,
+            enable_stdout=stdout,
+            enable_stderr=stderr
+        )
+        if ret != 0:
+            self._log.warning('Command [%s] failed', action.command)
+        self._log.count(self._directive, 'run' if ret == 0 else 'failed')
+        return ret == 0
 
     def _get_option_overrides(self):
         ret = {}
@@ -0,0 +1,116 @@
+import os
+import re
+
+from .messenger import Messenger
+from .util import module
+
+# entry point group that installed packages register plugins under, with
+# the directive as the name, e.g. `test = dotbot_test.plugin:Test`
+ENTRY_POINT_GROUP = "dotbot.plugins"
+
+# a comment near the top of a plugin file naming the directives it handles,
+# e.g. `# dotbot-directives: test, other`
+_header = re.compile(r"^#\s*dotbot-directives:\s*(.*)$", re.MULTILINE)
+_header_bytes = 4096
+
+
+class Registry(object):
+    """
+    Knows where the plugin for each directive lives, so that only the
+    plugins a config uses are imported.
+
+    Plugins are indexed by the directives they declare: built-in plugins by
+    name, plugin files by a `# dotbot-directives:` header, and installed
+    packages by entry points. A plugin file without a header has to be
+    imported to find out what it handles, so it is loaded straight away.
+    """
+
+    def __init__(self):
+        self._log = Messenger()
+        self._index = {}
+        # sources in the order they were registered, which is the order
+        # they are loaded in
+        self._sources = []
+        self._loaded = set()
+        self._entry_points_scanned = False
+
+    def add_builtins(self):
+        from . import plugins
+
+        for directive in plugins.builtin:
+            self._add(directive, ("builtin", directive))
+
+    def add_file(self, path):
+        """Registers a plugin file, importing it only if it has no header."""
+        path = os.path.abspath(path)
+        directives = read_header(path)
+        if directives is None:
+            self._log.debug("Loading plugin %s (no dotbot-directives header)" % path)
+            module.load(path)
+            return
+        for directive in directives:
+            self._add(directive, ("file", path))
+
+    def load(self, directives):
+        """Imports the plugins for the directives, unless they already are."""
+        directives = [directive for directive in directives if directive != "defaults"]
+        if any(directive not in self._index for directive in directives):
+            self._scan_entry_points()
+        needed = set()
+        for directive in directives:
+            needed.update(self._index.get(directive, ()))
+        for source in self._sources:
+            if source in needed and source not in self._loaded:
+                self._loaded.add(source)
+                self._load(source)
+
+    def _add(self, directive, source):
+        sources = self._index.setdefault(directive, [])
+        if source not in sources:
+            sources.append(source)
+        if source not in self._sources:
+            self._sources.append(source)
+
+    def _load(self, source):
+        kind, value = source
+        if kind == "builtin":
+            from . import plugins
+
+            plugins.load(value)
+        elif kind == "file":
+            self._log.debug("Loading plugin %s" % value)
+            module.load(value)
+        else:
+            value.load()
+
+    def _scan_entry_points(self):
+        if self._entry_points_scanned:
+            return
+        self._entry_points_scanned = True
+        try:
+            from importlib import metadata
+        except ImportError:
+            return
+        entry_points = metadata.entry_points()
+        if hasattr(entry_points, "select"):
+            entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+        else:
+            entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+        for entry_point in entry_points:
+            self._add(entry_point.name, ("entry point", entry_point))
+
+
+def read_header(path):
+    """
+    Returns the directives named in a plugin file's header, or None if it
+    does not have one.
+    """
+    try:
+        with open(path) as fin:
+            head = fin.read(_header_bytes)
+    except (OSError, UnicodeDecodeError):
+        return None
+    match = _header.search(head)
+    if match is None:
+        return None
+    return [name for name in re.split(r"[\s,]+", match.group(1)) if name]
@@ -0,0 +1,230 @@
+import bisect
+import os
+import time
+
+from .messenger import Messenger
+
+
+class Node(object):
+    """A compiled task in the graph built by graph()."""
+
+    __slots__ = ('index', 'task', 'reads', 'writes', 'dependencies', 'duration')
+
+    def __init__(self, index, task, reads, writes):
+        self.index = index
+        self.task = task
+        self.reads = reads
+        # None if the task could change anything
+        self.writes = writes
+        self.dependencies = set()
+        self.duration = 0.0
+
+    def name(self):
+        if self.task.name is not None:
+            return self.task.name
+        return '%s #%d' % (self.task.action, self.index + 1)
+
+
+def graph(tasks, strict=True):
+    """
+    Returns a Node for each compiled task, with the nodes it has to wait for
+    as its dependencies:
+
+    - `defaults` act as barriers: a task runs after every task before the
+      defaults it sees, and before every task after the next ones;
+    - a task that reads or writes a path that an earlier task writes, or
+      writes a path that an earlier task reads, runs after it (paths clash
+      if one is at or below the other);
+    - a task whose plugins cannot say what it writes (see
+      Plugin.destinations()) is a barrier too, unless it names the tasks it
+      runs after itself;
+    - a task runs after every task with an `id` listed in its `after`.
+
+    Raises SchedulingError if the dependencies form a cycle, or if strict and
+    an `after` names an unknown task (which is fine when only some of the
+    tasks of a config are run).
+    """
+    nodes = []
+    named = {}
+    for index, task in enumerate(tasks):
+        reads, writes = _paths(task)
+        node = Node(index, task, reads, writes)
+        nodes.append(node)
+        if task.name is not None:
+            named.setdefault(task.name, []).append(node)
+    barrier = None
+    since = []
+    for node in nodes:
+        task = node.task
+        if task.after is not None:
+            for name in task.after:
+                if name not in named:
+                    if not strict:
+                        continue
+                    raise SchedulingError('Task %s runs after unknown task %s' % (node.name(), name))
+                node.dependencies.update(other for other in named[name] if other is not node)
+        if task.action == 'defaults' or (node.writes is None and task.after is None):
+            node.dependencies.update(since)
+            if barrier is not None:
+                node.dependencies.add(barrier)
+            barrier, since = node, []
+            continue
+        if barrier is not None:
+            node.dependencies.add(barrier)
+        if node.writes is not None:
+            node.dependencies.update(other for other in since if _clash(other, node))
+        since.append(node)
+    _check_acyclic(nodes)
+    return nodes
+
+
+def run(nodes, function, jobs):
+    """
+    Calls function(index, task) for each node once its dependencies are
+    done, on up to `jobs` threads. Messages logged by a task are emitted
+    in the order of the tasks, as in a serial run.
+
+    Returns whether every call returned true, and records how long each
+    took in the nodes.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    log = Messenger()
+    waiting = dict((node, set(node.dependencies)) for node in nodes)
+    dependents = dict((node, []) for node in nodes)
+    for node in nodes:
+        for dependency in node.dependencies:
+            dependents[dependency].append(node)
+    outputs = [None] * len(nodes)
+    emitted = 0
+    success = True
+
+    def call(node):
+        start = time.perf_counter()
+        with log.buffered() as records:
+            try:
+                result = function(node.index, node.task)
+            except Exception as e:
+                log.error('An error was encountered while running task %s (%s)', node.name(), e)
+                result = False
+        return result, records, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {}
+        for node in nodes:
+            if not waiting[node]:
+                running[executor.submit(call, node)] = node
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                result, records, node.duration = future.result()
+                success &= bool(result)
+                outputs[node.index] = records
+                for dependent in dependents[node]:
+                    waiting[dependent].discard(node)
+                    if not waiting[dependent]:
+                        running[executor.submit(call, dependent)] = dependent
+            while emitted < len(outputs) and outputs[emitted] is not None:
+                log.replay(outputs[emitted])
+                outputs[emitted] = ()
+                emitted += 1
+    return success
+
+
+def critical_path(nodes):
+    """
+    Returns the chain of dependent nodes that took longest in total, which
+    is what bounds the time a scheduled run can take.
+    """
+    finish = {}
+    previous = {}
+    # dependencies always come before their dependents once sorted
+    for node in _sorted(nodes):
+        before = max(node.dependencies, key=lambda other: finish[other], default=None)
+        finish[node] = node.duration + (finish[before] if before is not None else 0.0)
+        previous[node] = before
+    if not finish:
+        return []
+    node = max(nodes, key=lambda other: finish[other])
+    path = []
+    while node is not None:
+        path.append(node)
+        node = previous[node]
+    return list(reversed(path))
+
+
+def _paths(task):
+    """
+    Returns the (reads, writes) paths of a compiled task, with writes None if
+    they are unknown.
+    """
+    reads, writes = set(), set()
+    for plugin, compiled, data in task.handlers:
+        if not compiled:
+            continue
+        try:
+            sources = plugin.sources(task.action, data)
+            destinations = plugin.destinations(task.action, data)
+        except Exception:
+            return reads, None
+        if destinations is None:
+            return reads, None
+        reads.update(sources or ())
+        writes.update(destinations)
+    return reads, writes
+
+
+def _clash(earlier, later):
+    return (_overlap(earlier.writes, later.writes) or _overlap(earlier.writes, later.reads)
+            or _overlap(earlier.reads, later.writes))
+
+
+def _overlap(first, second):
+    """Returns true if a path in first is at, above or below one in second."""
+    if not first or not second:
+        return False
+    paths = set(first)
+    below = sorted(os.path.join(path, '') for path in first)
+    for path in second:
+        parent = path
+        while True:
+            if parent in paths:
+                return True
+            next_parent = os.path.dirname(parent)
+            if next_parent == parent:
+                break
+            parent = next_parent
+        prefix = os.path.join(path, '')
+        index = bisect.bisect_left(below, prefix)
+        if index < len(below) and below[index].startswith(prefix):
+            return True
+    return False
+
+
+def _sorted(nodes):
+    """Returns the nodes in an order where dependencies come first, or None if there is a cycle."""
+    waiting = dict((node, len(node.dependencies)) for node in nodes)
+    dependents = dict((node, []) for node in nodes)
+    for node in nodes:
+        for dependency in node.dependencies:
+            dependents[dependency].append(node)
+    ready = [node for node in nodes if not waiting[node]]
+    ordered = []
+    while ready:
+        node = ready.pop()
+        ordered.append(node)
+        for dependent in dependents[node]:
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                ready.append(dependent)
+    return ordered if len(ordered) == len(nodes) else None
+
+
+def _check_acyclic(nodes):
+    if _sorted(nodes) is None:
+        raise SchedulingError('The `after` keys of the tasks form a cycle')
+
+
+class SchedulingError(Exception):
+    pass
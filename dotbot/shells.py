@@ -0,0 +1,311 @@
+import os
+import sys
+import threading
+
+from . import trace
+from .messenger import Messenger
+from .util.common import CapturedOutput, _shell_executable, shell_command, shell_command_captured
+
+# shells that can run the POSIX sh the commands are wrapped in
+_compatible = ("sh", "ash", "dash", "bash", "ksh", "mksh", "oksh", "yash", "zsh")
+
+
+class ShellPool(object):
+    """
+    Runs shell commands for the directives of a run.
+
+    By default every command is run by a shell of its own, as
+    dotbot.util.shell_command() does. When persistent, commands are instead
+    sent to long-lived shells over a pipe, which saves starting a shell for
+    each one: a shell that is not running a command is reused for the next,
+    and one is started for each command that runs at the same time as
+    others. Each command still runs in a subshell of its own, so whatever it
+    changes (the directory, variables, options, traps) is gone by the next
+    command.
+
+    Commands that read from stdin, and every command where $SHELL is not a
+    POSIX shell or Python is older than 3.8, are run by a shell of their own
+    either way.
+    """
+
+    def __init__(self, persistent=False):
+        self._log = Messenger()
+        self._persistent = persistent
+        if persistent and not hasattr(os, "posix_spawnp"):
+            # the shells are started with os.posix_spawnp(), new in Python 3.8
+            self._log.debug("Persistent shells need Python 3.8 or later, running each "
+                            "command in a shell of its own")
+            self._persistent = False
+        self._lock = threading.Lock()
+        self._idle = []
+        self._started = 0
+        self._commands = 0
+        self._executable = None
+
+    def run(self, command, cwd=None, enable_stdin=False, enable_stdout=False,
+            enable_stderr=False):
+        """Runs a command like dotbot.util.shell_command(), returning its exit status."""
+        shell = None if enable_stdin else self._acquire()
+        if shell is None:
+            return shell_command(command, cwd=cwd, enable_stdin=enable_stdin,
+                                 enable_stdout=enable_stdout, enable_stderr=enable_stderr)
+        # the command may use the terminal, after what was logged before it
+        self._log.flush()
+        with trace.span("run", "subprocess", command=command, persistent=True) as span:
+            returncode = self._run(shell, command, cwd, enable_stdout, enable_stderr, None)
+            span.set(returncode=returncode)
+        return returncode
+
+    def run_captured(self, command, cwd=None, enable_stdout=False, enable_stderr=False,
+                     limit=65536, on_line=None):
+        """
+        Runs a command like dotbot.util.shell_command_captured(), returning
+        (returncode, lines, dropped).
+        """
+        shell = self._acquire()
+        if shell is None:
+            return shell_command_captured(command, cwd=cwd, enable_stdout=enable_stdout,
+                                          enable_stderr=enable_stderr, limit=limit,
+                                          on_line=on_line)
+        output = CapturedOutput(limit, on_line)
+        with trace.span("run", "subprocess", command=command, persistent=True) as span:
+            returncode = self._run(shell, command, cwd, enable_stdout, enable_stderr, output)
+            span.set(returncode=returncode)
+        lines, dropped = output.result()
+        return returncode, lines, dropped
+
+    def close(self):
+        """Stops the shells. Later commands start new ones."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for shell in idle:
+            shell.close()
+        if self._commands:
+            self._log.debug("Ran %d commands on %d persistent shells",
+                            self._commands, self._started)
+        self._commands = self._started = 0
+
+    def _run(self, shell, command, cwd, enable_stdout, enable_stderr, output):
+        try:
+            returncode = shell.run(command, cwd, enable_stdout, enable_stderr, output)
+        except BaseException:
+            shell.close(kill=True)
+            raise
+        with self._lock:
+            self._commands += 1
+            if shell.alive():
+                self._idle.append(shell)
+        return returncode
+
+    def _acquire(self):
+        """Returns an idle shell, starting one if needed, or None to run the command on its own."""
+        if not self._persistent:
+            return None
+        with self._lock:
+            while self._idle:
+                shell = self._idle.pop()
+                # a shell started before the environment changed (see
+                # dotbot.targets) would run commands with the old one
+                if shell.current():
+                    return shell
+                shell.close()
+            executable = self._shell()
+        if executable is None:
+            return None
+        try:
+            shell = _Shell(executable)
+        except OSError as e:
+            self._log.warning("Could not start %s, running each command in a shell of its own "
+                              "(%s)", executable, e)
+            self._persistent = False
+            return None
+        with self._lock:
+            self._started += 1
+        return shell
+
+    def _shell(self):
+        if self._executable is None:
+            executable = _shell_executable() or "/bin/sh"
+            if os.path.basename(executable) not in _compatible:
+                self._log.debug("%s is not a POSIX shell, running each command in a shell "
+                                "of its own", executable)
+                self._persistent = False
+                return None
+            self._executable = executable
+        return self._executable
+
+
+class _Shell(object):
+    """
+    A shell reading the commands of a ShellPool from a pipe.
+
+    Each command is wrapped so that it runs in a subshell, with stdin from
+    /dev/null, after which the shell writes its exit status to fd 3.
+    Commands write to the terminal or to /dev/null, or to fds 4 and 5 when
+    their output is captured.
+    """
+
+    def __init__(self, executable):
+        fds = []
+        try:
+            for _ in range(4):
+                for fd in os.pipe():
+                    fds.append(_moved(fd))
+        except OSError:
+            for fd in fds:
+                os.close(fd)
+            raise
+        script, self._script, self._status, status, self._stdout, stdout, self._stderr, stderr = fds
+        try:
+            self._pid = os.posix_spawnp(executable, [executable, "-s"], os.environ, file_actions=[
+                (os.POSIX_SPAWN_DUP2, script, 0),
+                (os.POSIX_SPAWN_DUP2, status, 3),
+                (os.POSIX_SPAWN_DUP2, stdout, 4),
+                (os.POSIX_SPAWN_DUP2, stderr, 5),
+            ])
+        except OSError:
+            for fd in (self._script, self._status, self._stdout, self._stderr):
+                os.close(fd)
+            raise
+        finally:
+            for fd in (script, status, stdout, stderr):
+                os.close(fd)
+        self._owner = os.getpid()
+        self._environment = dict(os.environ)
+        self._buffer = b""
+
+    def run(self, command, cwd, enable_stdout, enable_stderr, output):
+        """
+        Runs a command, capturing its output into a
+        dotbot.util.common.CapturedOutput if output is given. Returns its
+        exit status, or 1 if the shell exited while running it.
+        """
+        captured = output is not None
+        redirects = ["</dev/null"]
+        if not enable_stdout:
+            redirects.append(">/dev/null")
+        elif captured:
+            redirects.append(">&4")
+        if not enable_stderr:
+            redirects.append("2>/dev/null")
+        elif captured:
+            redirects.append("2>&5")
+        script = "(cd -- %s && eval %s) %s 3>&- 4>&- 5>&-\necho $? >&3\n" % (
+            _quote(cwd if cwd is not None else os.getcwd()), _quote(command), " ".join(redirects))
+        data = os.fsencode(script)
+        while data:
+            data = data[os.write(self._script, data):]
+        if captured:
+            returncode = self._read_captured(output)
+        else:
+            returncode = self._read_status()
+        if returncode is None:
+            self.close()
+            return 1
+        return returncode
+
+    def _read_status(self):
+        while b"\n" not in self._buffer:
+            data = os.read(self._status, 64)
+            if not data:
+                return None
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return int(line)
+
+    def _read_captured(self, output):
+        import select
+        readers = {
+            self._stdout: _Lines(sys.stdout, output),
+            self._stderr: _Lines(sys.stderr, output),
+        }
+        fds = [self._status] + list(readers)
+        returncode = False
+        while returncode is False:
+            ready, _, _ = select.select(fds, [], [])
+            for fd in ready:
+                if fd == self._status:
+                    returncode = self._read_status()
+                else:
+                    readers[fd].feed(os.read(fd, 65536))
+        # the command has exited, so whatever it wrote is in the pipes
+        ready = list(readers)
+        while ready:
+            ready, _, _ = select.select(ready, [], [], 0)
+            for fd in ready:
+                readers[fd].feed(os.read(fd, 65536))
+        for reader in readers.values():
+            reader.finish()
+        return returncode
+
+    def current(self):
+        """Returns true if the shell is running, in this process, with the current environment."""
+        if self._pid is None or os.getpid() != self._owner:
+            return False
+        if os.waitpid(self._pid, os.WNOHANG)[0] != 0:
+            self._pid = None
+            return False
+        return self._environment == os.environ
+
+    def alive(self):
+        return self._pid is not None
+
+    def close(self, kill=False):
+        for fd in (self._script, self._status, self._stdout, self._stderr):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if self._pid is None or os.getpid() != self._owner:
+            return
+        if kill:
+            import signal
+            try:
+                os.kill(self._pid, signal.SIGTERM)
+            except OSError:
+                pass
+        # at the end of its input, the shell exits
+        os.waitpid(self._pid, 0)
+        self._pid = None
+
+
+class _Lines(object):
+    """Splits what a command writes to a stream into lines, as text."""
+
+    def __init__(self, stream, output):
+        import codecs
+        import locale
+        self._stream = stream
+        self._output = output
+        self._decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))("replace")
+        self._partial = ""
+
+    def feed(self, data, final=False):
+        text = self._partial + self._decoder.decode(data, final)
+        held = ""
+        if text.endswith("\r") and not final:
+            # the start of a \r\n
+            text, held = text[:-1], "\r"
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        self._partial = lines.pop() + held
+        for line in lines:
+            self._output.add(self._stream, line + "\n")
+
+    def finish(self):
+        self.feed(b"", final=True)
+        if self._partial:
+            self._output.add(self._stream, self._partial)
+            self._partial = ""
+
+
+def _moved(fd):
+    """Returns a copy of fd numbered 10 or above, closing fd."""
+    import fcntl
+    try:
+        return fcntl.fcntl(fd, fcntl.F_DUPFD_CLOEXEC, 10)
+    finally:
+        os.close(fd)
+
+
+def _quote(text):
+    return "'%s'" % text.replace("'", "'\\''")
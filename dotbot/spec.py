@@ -0,0 +1,118 @@
+class Spec(object):
+    """
+    An immutable, compiled config entry.
+
+    Specs are built once per run by the plugin that handles a directive, with
+    defaults merged in and paths resolved, so that planning and applying an
+    entry do not need to look at the raw config again.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            object.__setattr__(self, name, kwargs.pop(name))
+        if kwargs:
+            raise TypeError("Unknown fields for %s: %s" % (type(self).__name__, ", ".join(kwargs)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def replace(self, **changes):
+        """Returns a copy of the spec with some fields changed."""
+        fields = dict(zip(self.__slots__, self.fields()))
+        fields.update(changes)
+        return type(self)(**fields)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.fields() == other.fields()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + self.fields())
+
+    def __repr__(self):
+        return "%s(%s)" % (
+            type(self).__name__,
+            ", ".join("%s=%r" % (name, getattr(self, name)) for name in self.__slots__),
+        )
+
+
+class LinkSpec(Spec):
+    """
+    A link entry. destination is the destination as written (with variables
+    expanded), destination_path the resolved path. For entries that are not
+    globs, absolute_source and target (the text of the link) are resolved too.
+    """
+
+    __slots__ = (
+        "destination",
+        "destination_path",
+        "source",
+        "absolute_source",
+        "target",
+        "relative",
+        "canonicalize",
+        "force",
+        "relink",
+        "create",
+        "glob",
+        "test",
+        "test_env",
+        "ignore_missing",
+        "exclude",
+        "os_constraint",
+    )
+
+
+class CopySpec(Spec):
+    """
+    A copy entry, resolved like a LinkSpec: destination_path is the
+    resolved destination and, for entries that are not globs,
+    absolute_source the resolved source.
+    """
+
+    __slots__ = (
+        "destination",
+        "destination_path",
+        "source",
+        "absolute_source",
+        "force",
+        "create",
+        "glob",
+        "test",
+        "test_env",
+        "exclude",
+        "os_constraint",
+    )
+
+
+class CreateSpec(Spec):
+    __slots__ = ("path", "mode", "os_constraint", "test")
+
+
+class CleanSpec(Spec):
+    __slots__ = ("path", "force", "recursive", "skip", "max_depth")
+
+
+class ShellSpec(Spec):
+    __slots__ = (
+        "command",
+        "description",
+        "quiet",
+        "stdin",
+        "stdout",
+        "stderr",
+        "parallel",
+        "jobs",
+        "output",
+        "test",
+    )
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import stat
+import threading
+
+from .messenger import Messenger
+from .util.common import state_directory
+
+
+class State(object):
+    """
+    Fingerprints of config entries that were fully applied by a previous run.
+
+    An entry is identified by a hash of its config, so editing the entry (or
+    the defaults it uses) invalidates it. Its fingerprint records the links it
+    created, by destination inode, and the sources it was resolved from, by
+    mtime. If those are all unchanged, applying the entry again would not do
+    anything, so plugins can skip it.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self._path = path
+        self._log = Messenger()
+        self._entries = self._load()
+        self._seen = set()
+        self._dirty = False
+
+    @classmethod
+    def for_base_directory(cls, base_directory, target=None):
+        """
+        Returns the state for a base directory, kept separately for each
+        target the config is applied to (see dotbot.targets).
+        """
+        name = base_directory_key(base_directory, target)
+        return cls(os.path.join(state_directory(), "state", "%s.json" % name))
+
+    @staticmethod
+    def key(*parts):
+        """Returns a key for an entry from its (JSON-compatible) config."""
+        encoded = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        """
+        Returns the recorded entry for key if it is still up to date, or None.
+        """
+        self._seen.add(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        for path, _, signature in entry["links"]:
+            if _signature(path, follow_symlinks=False) != signature:
+                return None
+        for path, signature in entry["watched"]:
+            if _signature(path) != signature:
+                return None
+        for path, inode in entry["directories"]:
+            if _inode(path) != inode:
+                return None
+        return entry
+
+    def record(self, key, links=(), watched=(), directories=()):
+        """
+        Records an entry as applied.
+
+        links is a list of (destination, target) pairs for the symbolic links
+        the entry manages, watched a list of paths the entry was resolved
+        from, and directories a list of directories the entry creates.
+        """
+        self._seen.add(key)
+        self._entries[key] = {
+            "links": [
+                [path, target, _signature(path, follow_symlinks=False)]
+                for path, target in links
+            ],
+            "watched": [[path, _signature(path)] for path in watched],
+            "directories": [[path, _inode(path)] for path in directories],
+        }
+        self._dirty = True
+
+    def save(self, prune=True):
+        """
+        Writes the state file. With prune, entries that were not looked up in
+        this run are dropped.
+        """
+        if prune:
+            for key in set(self._entries) - self._seen:
+                del self._entries[key]
+                self._dirty = True
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            temporary = "%s.%d.tmp" % (self._path, os.getpid())
+            with open(temporary, "w") as fout:
+                # dumps() encodes in C, dump() does not
+                fout.write(json.dumps({"version": self.version, "entries": self._entries}))
+            os.replace(temporary, self._path)
+            self._dirty = False
+        except OSError as e:
+            self._log.warning("Could not save state to %s (%s)" % (self._path, e))
+
+    def _load(self):
+        try:
+            with open(self._path) as fin:
+                data = json.load(fin)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != self.version:
+            return {}
+        return data.get("entries", {})
+
+
+class LinkIndex(object):
+    """
+    The symbolic links dotbot manages: every link it created or found in
+    place, with its text and the source it points at. Pruning (see
+    Dispatcher.dispatch()) removes the managed links the config no longer
+    produces by going through the index, without walking any directory.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self._path = path
+        self._log = Messenger()
+        self._lock = threading.Lock()
+        # loaded when first needed, which a run that changes nothing avoids
+        self._links = None
+        # links known to be unchanged, which only need to be recorded if
+        # they are not already
+        self._unchanged = {}
+        self._seen = set()
+        self._dirty = False
+
+    @classmethod
+    def for_base_directory(cls, base_directory, target=None):
+        name = base_directory_key(base_directory, target)
+        return cls(os.path.join(state_directory(), "links", "%s.json" % name))
+
+    def record(self, destination, target, source=None):
+        """
+        Records that the config produced the link at destination. The source
+        may be left out if the link is known to be unchanged.
+        """
+        with self._lock:
+            self._seen.add(destination)
+            if source is None:
+                self._unchanged[destination] = target
+                return
+            links = self._loaded()
+            if links.get(destination) != [target, source]:
+                links[destination] = [target, source]
+                self._dirty = True
+
+    def links(self):
+        """Returns (destination, target, source, produced by this run) for the managed links."""
+        with self._lock:
+            links = self._loaded()
+            for destination, target in self._unchanged.items():
+                if links.get(destination, [None])[0] != target:
+                    links[destination] = [target, None]
+                    self._dirty = True
+            self._unchanged.clear()
+            return [
+                (destination, target, source, destination in self._seen)
+                for destination, (target, source) in sorted(links.items())
+            ]
+
+    def forget(self, destination):
+        with self._lock:
+            if self._loaded().pop(destination, None) is not None:
+                self._dirty = True
+
+    def _loaded(self):
+        if self._links is None:
+            self._links = self._load()
+        return self._links
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self._path), exist_ok=True)
+                temporary = "%s.%d.tmp" % (self._path, os.getpid())
+                with open(temporary, "w") as fout:
+                    fout.write(json.dumps({"version": self.version, "links": self._links}))
+                os.replace(temporary, self._path)
+                self._dirty = False
+            except OSError as e:
+                self._log.warning("Could not save link index to %s (%s)" % (self._path, e))
+
+    def _load(self):
+        try:
+            with open(self._path) as fin:
+                data = json.load(fin)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != self.version:
+            return {}
+        return data.get("links", {})
+
+
+def base_directory_key(base_directory, target=None):
+    """
+    Returns a name for what dotbot keeps about a base directory (and target)
+    between runs.
+    """
+    if target is not None:
+        base_directory = "%s\0%s" % (base_directory, target)
+    return hashlib.sha1(base_directory.encode("utf-8")).hexdigest()
+
+
+def _signature(path, follow_symlinks=True):
+    try:
+        info = os.stat(path, follow_symlinks=follow_symlinks)
+    except OSError:
+        return None
+    if follow_symlinks:
+        return [info.st_ino, info.st_mtime_ns]
+    return [info.st_ino, info.st_ctime_ns]
+
+
+def _inode(path):
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return None
+    return info.st_ino if stat.S_ISDIR(info.st_mode) else None
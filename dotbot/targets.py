@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+
+from .dispatcher import DispatchError
+from .messenger import Level, Messenger, describe_counts
+from .util.common import cache_directory, state_directory
+
+
+class Target(object):
+    """
+    Somewhere other than the current user's home to apply a config to: a
+    home directory, a root directory (such as a container's filesystem) that
+    destinations are placed under, or both.
+
+    Destinations are resolved for the current user when the config is
+    compiled; path() moves them to the target.
+    """
+
+    def __init__(self, root=None, home=None):
+        self.root = None if root is None else os.path.abspath(root)
+        self.home = None if home is None else os.path.normpath(home)
+        self._own_home = os.path.expanduser("~")
+
+    def name(self):
+        if self.root is None:
+            return self.home
+        if self.home is None:
+            return self.root
+        return "%s:%s" % (self.root, self.home)
+
+    def path(self, path):
+        """
+        Moves a path resolved for the current user to the target: a path in
+        the current user's home moves to the target's home, and then under
+        the target's root.
+        """
+        path = os.path.abspath(path)
+        if self.home is not None:
+            if path == self._own_home or path.startswith(os.path.join(self._own_home, "")):
+                path = self.home + path[len(self._own_home):]
+        if self.root is not None:
+            path = os.path.join(self.root, path.lstrip(os.sep))
+        return path
+
+    def environment(self):
+        """Environment variables to set while the target is set up."""
+        environment = {"HOME": self.path(self._own_home)}
+        if self.root is not None:
+            environment["DOTBOT_TARGET_ROOT"] = self.root
+        return environment
+
+
+# what worker processes apply, set before they are forked
+_job = None
+
+
+def apply_to_targets(dispatcher, tasks, targets, processes=None):
+    """
+    Compiles the tasks once and applies them to each target, on a pool of
+    up to `processes` worker processes (by default, one per processor).
+
+    The output of each target is printed as a block once it is done, in the
+    order the targets were given, followed by a line per target. Returns
+    true if every target was set up successfully.
+    """
+    global _job
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    log = Messenger()
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise DispatchError("Applying to targets is not supported on this platform")
+    compiled = dispatcher.compile(tasks)
+    # resolved before the workers set $HOME to the targets', so that what
+    # dotbot keeps for each target stays with the user running it
+    state_directory()
+    cache_directory()
+    _job = (dispatcher, compiled, targets)
+    processes = max(1, min(processes or os.cpu_count() or 1, len(targets)))
+    # nothing logged so far may be copied into the workers' buffers
+    log.flush()
+    results = []
+    # before Python 3.7 the pool always uses the default start method, which
+    # is fork on the platforms that have it
+    pool = {} if sys.version_info < (3, 7) else {"mp_context": multiprocessing.get_context("fork")}
+    try:
+        with ProcessPoolExecutor(max_workers=processes, **pool) as executor:
+            futures = [executor.submit(_apply, index) for index in range(len(targets))]
+            for target, future in zip(targets, futures):
+                try:
+                    success, messages, counts, seconds = future.result()
+                except Exception as e:
+                    success, messages, counts, seconds = False, [(Level.ERROR, str(e))], [], 0.0
+                log.info("\n==> Target %s", target.name())
+                for level, text in messages:
+                    log.log(level, text)
+                totals = {}
+                for directive, outcomes in counts:
+                    for outcome, count in outcomes.items():
+                        log.count(directive, outcome, count)
+                        totals[outcome] = totals.get(outcome, 0) + count
+                results.append((target, success, totals, seconds))
+    finally:
+        _job = None
+    log.info("")
+    for target, success, totals, seconds in results:
+        described = describe_counts(totals)
+        if success:
+            log.info("Target %s: succeeded in %.1f ms%s", target.name(), seconds * 1000,
+                     " (%s)" % described if described else "")
+        else:
+            log.error("Target %s: failed%s", target.name(),
+                      " (%s)" % described if described else "")
+    succeeded = sum(1 for _, success, _, _ in results if success)
+    log.info("%d of %d targets set up successfully", succeeded, len(results))
+    return succeeded == len(results)
+
+
+def _apply(index):
+    """Sets up one target, in a worker process."""
+    dispatcher, compiled, targets = _job
+    target = targets[index]
+    log = Messenger()
+    # a worker sets up several targets in turn
+    log.clear_counts()
+    start = time.perf_counter()
+    os.environ.update(target.environment())
+    with log.buffered() as records:
+        success = dispatcher.dispatch(dispatcher.retarget(compiled, target))
+    # formatted here, as the arguments may not survive being sent back
+    messages = [
+        (level, message % args if args else str(message)) for level, message, args in records
+    ]
+    return success, messages, log.counts(), time.perf_counter() - start
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+
+class Tracer(object):
+    """
+    Records spans as Chrome trace events, which can be viewed in
+    chrome://tracing or Perfetto.
+
+    Spans nest by time on each thread, so work done on a pool of threads
+    shows up as one track per worker.
+    """
+
+    def __init__(self):
+        self._events = []
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    def span(self, name, category, args):
+        return _Span(self, name, category, args)
+
+    def record(self, name, category, start, end, args):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self._origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = dict((key, _jsonable(value)) for key, value in args.items())
+        # list.append is atomic, so threads can record without a lock
+        self._events.append(event)
+
+    def write(self, path):
+        import json
+
+        with open(path, "w") as fout:
+            json.dump({"traceEvents": self._events, "displayTimeUnit": "ms"}, fout)
+            fout.write("\n")
+
+
+class _Span(object):
+    __slots__ = ("_tracer", "_name", "_category", "_args", "_start")
+
+    def __init__(self, tracer, name, category, args):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def set(self, **args):
+        """Adds arguments to the span, e.g. a result only known at the end."""
+        self._args.update(args)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is not None:
+            self._args["error"] = repr(value)
+        self._tracer.record(self._name, self._category, self._start, time.perf_counter(), self._args)
+        return False
+
+
+class _NullSpan(object):
+    """What span() returns when tracing is off: does nothing, as cheaply as possible."""
+
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+
+_null_span = _NullSpan()
+_tracer = None
+
+
+def enable():
+    """Starts recording spans for the rest of the run and returns the Tracer."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, category="dotbot", **args):
+    """
+    Returns a context manager that records the time spent in its block.
+
+    Categories group spans in the viewer; dotbot uses "subprocess" for
+    commands it spawns and "fs" for operations that make many system calls.
+    """
+    if _tracer is None:
+        return _null_span
+    return _tracer.span(name, category, args)
+
+
+def write(path):
+    if _tracer is not None:
+        _tracer.write(path)
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
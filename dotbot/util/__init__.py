@@ -1 +1 @@
-from .common import shell_command
+from .common import shell_command, shell_command_captured
@@ -1,35 +1,132 @@
 import os
-import subprocess
-import platform
-from typing import Optional
+import sys
+import threading
+from types import MappingProxyType
 
+from dotbot import trace
+from dotbot.facts import host
 from dotbot.messenger import Messenger
 
 
 def shell_command(command, cwd=None, enable_stdin=False, enable_stdout=False, enable_stderr=False):
+    import subprocess
     with open(os.devnull, "w") as devnull_w, open(os.devnull, "r") as devnull_r:
         stdin = None if enable_stdin else devnull_r
         stdout = None if enable_stdout else devnull_w
         stderr = None if enable_stderr else devnull_w
-        executable = os.environ.get("SHELL")
-        if platform.system() == "Windows":
-            # We avoid setting the executable kwarg on Windows because it does
-            # not have the desired effect when combined with shell=True. It
-            # will result in the correct program being run (e.g. bash), but it
-            # will be invoked with a '/c' argument instead of a '-c' argument,
-            # which it won't understand.
-            #
-            # See https://github.com/anishathalye/dotbot/issues/219 and
-            # https://bugs.python.org/issue40467.
-            #
-            # This means that complex commands that require Bash's parsing
-            # won't work; a workaround for this is to write the command as
-            # `bash -c "..."`.
-            executable = None
-        return subprocess.call(
-            command, shell=True, executable=executable, stdin=stdin, stdout=stdout, stderr=stderr,
-            cwd=cwd
+        # the command may use the terminal, after what was logged before it
+        Messenger().flush()
+        with trace.span("spawn", "subprocess", command=command) as span:
+            ret = subprocess.call(
+                command, shell=True, executable=_shell_executable(), stdin=stdin, stdout=stdout,
+                stderr=stderr, cwd=cwd
+            )
+            span.set(returncode=ret)
+        return ret
+
+
+def shell_command_captured(command, cwd=None, enable_stdout=False, enable_stderr=False,
+                           limit=65536, on_line=None):
+    """
+    Run a command without a terminal, capturing its output.
+
+    Returns (returncode, lines, dropped) where lines is a list of
+    (stream, line) pairs in the order they were read, stream being
+    sys.stdout or sys.stderr. Only the last `limit` characters of output are
+    kept; dropped counts the lines that had to be discarded. If on_line is
+    given, it is called with each (stream, line) as soon as it is read.
+    """
+    import subprocess
+    output = CapturedOutput(limit, on_line)
+
+    def read(pipe, stream):
+        for line in iter(pipe.readline, ""):
+            output.add(stream, line)
+        pipe.close()
+
+    with open(os.devnull, "r") as devnull_r, open(os.devnull, "w") as devnull_w, \
+            trace.span("spawn", "subprocess", command=command) as span:
+        process = subprocess.Popen(
+            command, shell=True, executable=_shell_executable(), stdin=devnull_r,
+            stdout=subprocess.PIPE if enable_stdout else devnull_w,
+            stderr=subprocess.PIPE if enable_stderr else devnull_w,
+            cwd=cwd, universal_newlines=True, errors="replace"
         )
+        readers = [
+            threading.Thread(target=read, args=(pipe, stream))
+            for pipe, stream in ((process.stdout, sys.stdout), (process.stderr, sys.stderr))
+            if pipe is not None
+        ]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        returncode = process.wait()
+        span.set(returncode=returncode)
+    lines, dropped = output.result()
+    return returncode, lines, dropped
+
+
+class CapturedOutput(object):
+    """
+    The output of a command, as (stream, line) pairs in the order the lines
+    were read. Only the last `limit` characters are kept.
+    """
+
+    def __init__(self, limit=65536, on_line=None):
+        import collections
+        self._lines = collections.deque()
+        self._size = 0
+        self._dropped = 0
+        self._limit = limit
+        self._on_line = on_line
+        self._lock = threading.Lock()
+
+    def add(self, stream, line):
+        if self._on_line is not None:
+            self._on_line(stream, line)
+        with self._lock:
+            self._lines.append((stream, line))
+            self._size += len(line)
+            while self._size > self._limit and len(self._lines) > 1:
+                self._size -= len(self._lines.popleft()[1])
+                self._dropped += 1
+
+    def result(self):
+        """Returns (lines, dropped), dropped counting the lines that had to be discarded."""
+        with self._lock:
+            return list(self._lines), self._dropped
+
+
+def _shell_executable():
+    import platform
+    if platform.system() == "Windows":
+        # We avoid setting the executable kwarg on Windows because it does
+        # not have the desired effect when combined with shell=True. It
+        # will result in the correct program being run (e.g. bash), but it
+        # will be invoked with a '/c' argument instead of a '-c' argument,
+        # which it won't understand.
+        #
+        # See https://github.com/anishathalye/dotbot/issues/219 and
+        # https://bugs.python.org/issue40467.
+        #
+        # This means that complex commands that require Bash's parsing
+        # won't work; a workaround for this is to write the command as
+        # `bash -c "..."`.
+        return None
+    return os.environ.get("SHELL")
+
+
+def freeze(data):
+    """
+    Returns a read-only copy of config data: dicts become read-only
+    mappings and lists become tuples.
+    """
+    if isinstance(data, (dict, MappingProxyType)):
+        return MappingProxyType(dict((key, freeze(value)) for key, value in data.items()))
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze(value) for value in data)
+    return data
 
 
 def expand_path(path, abs=False):
@@ -44,19 +141,48 @@ def expand_path(path, abs=False):
         return path
 
 
-def on_permitted_os(os_constraint:Optional[str], log: Messenger = None) -> bool:
+def on_permitted_os(os_constraint, log: Messenger = None) -> bool:
+    """
+    Returns true if dotbot is running on the operating system os_constraint
+    names, or on one of a list of them. None and "all" permit any. Raises
+    KeyError for names it does not know.
+    """
     if os_constraint is None:
         return True # any os is fine
-    current_os = platform.system().lower()
-    if isinstance(os_constraint, str) and os_constraint.lower() == "all":
-        os_constraint = None
-    if os_constraint is not None:
-        os_constraint = os_constraint.lower().replace(
-            "nt", "windows").replace("wsl", "linux")
-        if log is not None:
-            log.info(f"OS is {current_os}, got constraint {os_constraint}")
-        if os_constraint not in ["windows", "linux"]:
-            raise KeyError("Unknown/ unsupported operating system constraint "
-                           f"supplied: {os_constraint}")
-        # Return false if we are on the constrained os
-        return current_os == os_constraint
+    names = [os_constraint] if isinstance(os_constraint, str) else list(os_constraint)
+    if any(name.lower() == "all" for name in names):
+        return True
+    facts = host()
+    if log is not None:
+        log.info(f"OS is {facts.system()}, got constraint {', '.join(names)}")
+    # every name is checked, so that a misspelt one is reported on any system
+    return any([facts.is_system(name) for name in names])
+
+
+def state_directory():
+    """
+    Directory for data dotbot keeps between runs, following the XDG base
+    directory specification.
+    """
+    return _user_directory("XDG_STATE_HOME", "~/.local/state")
+
+
+def cache_directory():
+    """
+    Directory for data dotbot can recreate at any time, following the XDG
+    base directory specification.
+    """
+    return _user_directory("XDG_CACHE_HOME", "~/.cache")
+
+
+# variable -> directory, resolved once so that they stay those of the user
+# running dotbot after $HOME is switched to a target's (see dotbot.targets)
+_user_directories = {}
+
+
+def _user_directory(variable, default):
+    directory = _user_directories.get(variable)
+    if directory is None:
+        base = os.environ.get(variable) or os.path.expanduser(default)
+        directory = _user_directories[variable] = os.path.join(base, "dotbot")
+    return directory
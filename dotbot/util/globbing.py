@@ -0,0 +1,204 @@
+import fnmatch
+import os
+import re
+
+# a component that matches any number of directories
+RECURSIVE = "**"
+
+_magic = re.compile(r"[*?[]")
+
+
+class Globber(object):
+    """
+    Expands glob patterns in a single walk of the filesystem.
+
+    Patterns follow the rules of the glob module, except that a `**`
+    component matches any number of directories, as with recursive globs.
+    Exclude patterns are checked as the walk goes: a directory excluded with
+    a trailing `**` is never listed, and other matches are dropped as they
+    are found.
+
+    Directory listings are kept for the lifetime of the Globber, so patterns
+    that share a prefix only list it once. Use a new Globber when the
+    filesystem may have changed.
+    """
+
+    def __init__(self):
+        self._listings = {}
+
+    def iglob(self, pattern, exclude=(), listed=None):
+        """
+        Yields the paths that match pattern but none of the exclude patterns.
+
+        If listed is given, the absolute path of every directory that was
+        listed to expand the pattern is appended to it.
+        """
+        trailing_separator = pattern.endswith(os.sep) and len(pattern) > 1
+        parts = _compile(pattern.rstrip(os.sep).split(os.sep))
+        excludes = [
+            _compile(os.path.abspath(path).split(os.sep)) for path in exclude
+        ]
+        if parts[0] == "":
+            # absolute pattern
+            start, absolute, parts = os.sep, [""], parts[1:]
+        else:
+            start, absolute = "", os.path.abspath(os.curdir).split(os.sep)
+        prunes = [exclusion[:-1] for exclusion in excludes if exclusion[-1:] == [RECURSIVE]]
+        seen = set()
+        for path, names in self._walk(start, absolute, parts, prunes, listed):
+            if trailing_separator:
+                if not os.path.isdir(path):
+                    continue
+                path = os.path.join(path, "")
+            if path in seen or any(_match(exclusion, names) for exclusion in excludes):
+                continue
+            seen.add(path)
+            yield path
+
+    def _walk(self, path, names, parts, prunes, listed):
+        """
+        Yields (path, absolute components) for the matches of parts under path.
+        """
+        if not parts:
+            yield path, names
+            return
+        part, rest = parts[0], parts[1:]
+        if part == RECURSIVE:
+            if rest:
+                for match in self._walk(path, names, rest, prunes, listed):
+                    yield match
+            for name, is_dir in self._list(path, names, listed):
+                if _hidden(name):
+                    continue
+                child, child_names = _join(path, name), names + [name]
+                if not rest:
+                    yield child, child_names
+                if is_dir and not _pruned(prunes, child_names):
+                    for match in self._walk(child, child_names, parts, prunes, listed):
+                        yield match
+            return
+        if isinstance(part, str):
+            # no wildcards, so there is nothing to list
+            child, child_names = _join(path, part), _descend(names, part)
+            if not rest:
+                if os.path.lexists(child or os.curdir):
+                    yield child, child_names
+            elif os.path.isdir(child) and not _pruned(prunes, child_names):
+                for match in self._walk(child, child_names, rest, prunes, listed):
+                    yield match
+            return
+        for name, is_dir in self._list(path, names, listed):
+            if not part(name):
+                continue
+            child, child_names = _join(path, name), names + [name]
+            if not rest:
+                yield child, child_names
+            elif is_dir and not _pruned(prunes, child_names):
+                for match in self._walk(child, child_names, rest, prunes, listed):
+                    yield match
+
+    def _list(self, path, names, listed):
+        """Returns the sorted (name, is directory) entries of a directory."""
+        directory = os.sep.join(names) or os.sep
+        entries = self._listings.get(directory)
+        if entries is None:
+            try:
+                with os.scandir(path or os.curdir) as scan:
+                    entries = sorted((entry.name, _is_dir(entry)) for entry in scan)
+            except OSError:
+                entries = []
+            self._listings[directory] = entries
+        if listed is not None:
+            listed.append(directory)
+        return entries
+
+
+def root(pattern):
+    """
+    Returns the directory that every match of pattern lies in: the part of
+    the pattern before its first wildcard.
+    """
+    components = pattern.split(os.sep)
+    for index, component in enumerate(components):
+        if component == RECURSIVE or _magic.search(component) is not None:
+            if index == 0:
+                return os.curdir
+            return os.sep.join(components[:index]) or os.sep
+    return pattern
+
+
+def _compile(components):
+    """
+    Turns pattern components into literal strings, RECURSIVE, or callables
+    that match a name.
+    """
+    compiled = []
+    for component in components:
+        if component == RECURSIVE:
+            if compiled[-1:] != [RECURSIVE]:
+                compiled.append(RECURSIVE)
+        elif _magic.search(component) is None:
+            compiled.append(component)
+        else:
+            compiled.append(_matcher(component))
+    return compiled
+
+
+def _matcher(component):
+    regex = re.compile(fnmatch.translate(os.path.normcase(component)))
+    # like the glob module, wildcards do not match hidden files
+    hidden = _hidden(component)
+
+    def match(name):
+        return (hidden or not _hidden(name)) and regex.match(os.path.normcase(name)) is not None
+
+    return match
+
+
+def _match(parts, names):
+    """Returns true if the compiled parts match all of names."""
+    if not parts:
+        return not names
+    part, rest = parts[0], parts[1:]
+    if part == RECURSIVE:
+        for index in range(len(names) + 1):
+            if _match(rest, names[index:]):
+                return True
+            if index < len(names) and _hidden(names[index]):
+                return False
+        return False
+    if not names:
+        return False
+    if isinstance(part, str):
+        matched = os.path.normcase(part) == os.path.normcase(names[0])
+    else:
+        matched = part(names[0])
+    return matched and _match(rest, names[1:])
+
+
+def _pruned(prunes, names):
+    """Returns true if everything below the directory names is excluded."""
+    return any(_match(prune, names) for prune in prunes)
+
+
+def _descend(names, part):
+    if part == os.curdir:
+        return names
+    if part == os.pardir:
+        return names[:-1] if len(names) > 1 else names
+    return names + [part]
+
+
+def _join(path, name):
+    return os.path.join(path, name) if path else name
+
+
+def _hidden(name):
+    return name.startswith(".")
+
+
+def _is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+from dotbot.messenger import Messenger
+
+
+def run_grouped(operations, jobs=1):
+    """
+    Run (group, callable) operations and return their results in order.
+
+    Operations that share a group run one after another in the order given;
+    distinct groups run concurrently on up to `jobs` worker threads. A group
+    of None means the operation has no ordering constraint. Messages logged
+    by an operation are held back and emitted in the original order, so the
+    output matches a serial run.
+    """
+    log = Messenger()
+    if jobs is None or jobs <= 1 or len(operations) <= 1:
+        return [function() for _, function in operations]
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    futures = [Future() for _ in operations]
+    groups = OrderedDict()
+    for index, (group, _) in enumerate(operations):
+        key = ("ungrouped", index) if group is None else ("group", group)
+        groups.setdefault(key, []).append(index)
+
+    def run_group(indices):
+        for index in indices:
+            future = futures[index]
+            try:
+                with log.buffered() as records:
+                    result = operations[index][1]()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result((result, records))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for indices in groups.values():
+            executor.submit(run_group, indices)
+        for future in futures:
+            result, records = future.result()
+            log.replay(records)
+            results.append(result)
+    return results
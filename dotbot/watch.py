@@ -0,0 +1,451 @@
+import bisect
+import os
+import select
+import stat
+import struct
+import time
+
+from . import trace
+from .cli import directives
+from .config import ConfigReader, ReadingError
+from .dispatcher import DispatchError
+from .messenger import Messenger
+from .state import State
+
+# directories that never hold sources of dotfiles, but change a lot
+_ignored = frozenset([".git", ".hg", ".svn"])
+
+# inotify(7)
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_mask = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+    | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+)
+_event = struct.Struct("iIII")
+
+
+def watch(dispatcher, tasks, base_directory, config_file, method="auto", debounce=0.2,
+          included=(), registry=None):
+    """
+    Runs the tasks, then keeps running the ones affected by changes to the
+    config file (or the files it included) or the base directory until
+    interrupted. The plugins for directives the config starts to use are
+    loaded with the registry (see dotbot.registry).
+
+    Changes are collected until none have arrived for `debounce` seconds,
+    so that an editor saving a file or a `git pull` only causes one update.
+    Returns whether the last update succeeded.
+    """
+    log = Messenger()
+    session = Session(dispatcher, config_file, included, registry)
+    session.load(tasks)
+    success = session.run()
+    watcher = open_watcher(
+        [os.path.realpath(base_directory)], session.config_files(), method)
+    log.info("Watching %s for changes (%s)", base_directory, watcher.name)
+    previous = _stop_on_sigterm()
+    try:
+        while True:
+            changes = set(watcher.wait(None))
+            detected = time.perf_counter()
+            while True:
+                more = watcher.wait(debounce)
+                if not more:
+                    break
+                changes.update(more)
+            with trace.span("watch update", changes=len(changes)):
+                result = session.update(changes)
+            # the config can include files it did not before
+            watcher.add_files(session.config_files())
+            if result is None:
+                log.debug("Nothing depends on %d changed paths", len(changes))
+                continue
+            success, directives = result
+            log.info(
+                "Applied changes to %s in %.1f ms",
+                ", ".join(directives) or "nothing",
+                (time.perf_counter() - detected) * 1000,
+            )
+    except KeyboardInterrupt:
+        log.info("Stopped watching")
+    finally:
+        watcher.close()
+        _restore_sigterm(previous)
+    return success
+
+
+class Session(object):
+    """
+    A config compiled in memory, from which the tasks affected by a change
+    can be run again.
+
+    Each task of the config is kept with its compiled form under a key made
+    from the task and the defaults it sees, so when the config changes only
+    the tasks whose key changed are compiled (and run) again.
+    """
+
+    def __init__(self, dispatcher, config_file, included=(), registry=None):
+        self._dispatcher = dispatcher
+        self._config_file = os.path.realpath(config_file)
+        self._included = set(included)
+        self._registry = registry
+        self._log = Messenger()
+        # (key, compiled tasks, sources) for each task of the config
+        self._entries = []
+
+    def config_file(self):
+        return self._config_file
+
+    def config_files(self):
+        """Returns the config file and the files it included when it was last read."""
+        return [self._config_file] + sorted(self._included)
+
+    def load(self, tasks):
+        """
+        Compiles the tasks of a config, reusing what is unchanged since the
+        last load. Returns the indexes of the tasks that are new.
+        """
+        previous = dict((entry[0], entry) for entry in self._entries)
+        entries = []
+        new = []
+        defaults = None
+        for task in tasks:
+            key = State.key(defaults, task)
+            entry = previous.get(key)
+            if entry is None:
+                compiled = self._compile(defaults, task)
+                entry = (key, compiled, self._sources(compiled))
+                new.append(len(entries))
+            entries.append(entry)
+            if isinstance(task, dict) and "defaults" in task:
+                defaults = task["defaults"]
+        self._entries = entries
+        return new
+
+    def run(self, indexes=None):
+        """
+        Runs the tasks with the given indexes, or all of them. Returns
+        whether they all succeeded.
+        """
+        tasks = []
+        for index, (_, compiled, _) in enumerate(self._entries):
+            for task in compiled:
+                # defaults are cheap, and later tasks need them
+                if task.action == "defaults" or indexes is None or index in indexes:
+                    tasks.append(task)
+        partial = indexes is not None and len(indexes) < len(self._entries)
+        return self._dispatcher.dispatch(tasks, partial=partial)
+
+    def update(self, changes):
+        """
+        Runs the tasks affected by changes to the paths. Returns a (success,
+        directives run) pair, or None if nothing was affected.
+        """
+        changes = set(changes)
+        indexes = set()
+        config_files = set(self.config_files())
+        if changes & config_files:
+            changes -= config_files
+            tasks = self._read_config()
+            if tasks is not None:
+                indexes.update(self.load(tasks))
+        if changes:
+            indexes.update(self._affected(changes))
+        if not indexes:
+            return None
+        success = self.run(indexes)
+        directives = []
+        for index in sorted(indexes):
+            for task in self._entries[index][1]:
+                if task.action != "defaults" and task.action not in directives:
+                    directives.append(task.action)
+        return success, directives
+
+    def _read_config(self):
+        try:
+            reader = ConfigReader(self._config_file)
+            tasks = reader.get_config()
+            self._included = set(reader.files()[1:])
+        except ReadingError as e:
+            self._log.error("%s", e)
+            return None
+        if tasks is None:
+            tasks = []
+        if not isinstance(tasks, list):
+            self._log.error("Configuration file must be a list of tasks")
+            return None
+        if self._registry is not None:
+            self._registry.load(directives(tasks))
+            self._dispatcher.update_plugins()
+        return tasks
+
+    def _compile(self, defaults, task):
+        prefix = [] if defaults is None else [{"defaults": defaults}]
+        return self._dispatcher.compile(prefix + [task])[len(prefix):]
+
+    def _sources(self, compiled):
+        """Returns the sorted sources of compiled tasks."""
+        sources = set()
+        for task in compiled:
+            for plugin, ok, data in task.handlers:
+                if not ok:
+                    continue
+                try:
+                    paths = plugin.sources(task.action, data)
+                except Exception as e:
+                    self._log.debug("Could not find sources of %s (%s)", task.action, e)
+                    continue
+                if paths is not None:
+                    sources.update(paths)
+        return sorted(sources)
+
+    def _affected(self, changes):
+        """Returns the indexes of the tasks with a source at, above or below a changed path."""
+        affected = []
+        for index, (_, _, sources) in enumerate(self._entries):
+            if sources and any(_related(path, sources) for path in changes):
+                affected.append(index)
+        return affected
+
+
+def _related(path, sources):
+    """
+    Returns true if path is one of the sorted sources, is in a directory
+    that is, or is a directory that holds one.
+    """
+    parent = path
+    while True:
+        index = bisect.bisect_left(sources, parent)
+        if index < len(sources) and sources[index] == parent:
+            return True
+        next_parent = os.path.dirname(parent)
+        if next_parent == parent:
+            break
+        parent = next_parent
+    below = os.path.join(path, "")
+    index = bisect.bisect_left(sources, below)
+    return index < len(sources) and sources[index].startswith(below)
+
+
+def open_watcher(roots, files, method="auto"):
+    """
+    Returns a watcher for everything below the roots and for the files:
+    inotify where it is available, or polling.
+    """
+    if method in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(roots, files)
+        except OSError as e:
+            if method == "inotify":
+                raise DispatchError("Cannot watch with inotify (%s)" % e)
+            Messenger().debug("Not using inotify (%s), polling instead", e)
+    return PollingWatcher(roots, files)
+
+
+class InotifyWatcher(object):
+    """Watches directories with Linux's inotify."""
+
+    name = "inotify"
+
+    def __init__(self, roots, files):
+        import ctypes
+
+        self._ctypes = ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._roots = list(roots)
+        self._files = set(files)
+        # watch descriptor -> (directory, whether it is below a root)
+        self._directories = {}
+        try:
+            for root in self._roots:
+                self._add_tree(root, strict=True)
+            for path in self._files:
+                if not any(_below(path, root) for root in self._roots):
+                    self._add(os.path.dirname(path), recursive=False, strict=True)
+        except OSError:
+            self.close()
+            raise
+
+    def add_files(self, files):
+        """Also watches the files, if they are not watched already."""
+        for path in files:
+            if path in self._files:
+                continue
+            self._files.add(path)
+            if not any(_below(path, root) for root in self._roots):
+                self._add(os.path.dirname(path), recursive=False)
+
+    def wait(self, timeout):
+        """Returns the paths that changed, waiting up to timeout seconds (or forever)."""
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        changes = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            changes.extend(self._parse(data))
+        return changes
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _parse(self, data):
+        changes = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _event.unpack_from(data, offset)
+            start = offset + _event.size
+            name = os.fsdecode(data[start:start + length].rstrip(b"\0"))
+            offset = start + length
+            if mask & _IN_Q_OVERFLOW:
+                # events were lost, so anything could have changed
+                changes.extend(self._roots)
+                changes.extend(self._files)
+                continue
+            watched = self._directories.get(wd)
+            if watched is None:
+                continue
+            directory, recursive = watched
+            if mask & _IN_IGNORED:
+                del self._directories[wd]
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if not recursive:
+                if path in self._files:
+                    changes.append(path)
+                continue
+            if name in _ignored:
+                continue
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._add_tree(path)
+            changes.append(path)
+        return changes
+
+    def _add_tree(self, root, strict=False):
+        for directory, subdirectories, _ in os.walk(root):
+            subdirectories[:] = [name for name in subdirectories if name not in _ignored]
+            self._add(directory, recursive=True, strict=strict)
+
+    def _add(self, path, recursive, strict=False):
+        wd = self._add_watch(self._fd, os.fsencode(path), _mask)
+        if wd < 0:
+            error = self._ctypes.get_errno()
+            if strict:
+                raise OSError(error, "cannot watch %s: %s" % (path, os.strerror(error)))
+            Messenger().warning("Cannot watch %s (%s)", path, os.strerror(error))
+            return
+        self._directories[wd] = (path, recursive)
+
+
+class PollingWatcher(object):
+    """Watches by comparing snapshots of the files' metadata."""
+
+    name = "polling"
+
+    def __init__(self, roots, files, interval=1.0):
+        self._roots = list(roots)
+        self._files = list(files)
+        self._interval = interval
+        self._snapshot = self._scan()
+
+    def add_files(self, files):
+        """Also watches the files, if they are not watched already."""
+        for path in files:
+            if path not in self._files:
+                self._files.append(path)
+                self._snapshot[path] = _signature(path)
+
+    def wait(self, timeout):
+        """Returns the paths that changed, waiting up to timeout seconds (or forever)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._scan()
+            changes = [
+                path for path in set(current) | set(self._snapshot)
+                if current.get(path) != self._snapshot.get(path)
+            ]
+            self._snapshot = current
+            if changes:
+                return changes
+            delay = self._interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+                if delay <= 0:
+                    return []
+            time.sleep(delay)
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        snapshot = {}
+        for root in self._roots:
+            for directory, subdirectories, names in os.walk(root):
+                subdirectories[:] = [name for name in subdirectories if name not in _ignored]
+                for name in subdirectories + names:
+                    path = os.path.join(directory, name)
+                    snapshot[path] = _signature(path)
+        for path in self._files:
+            snapshot[path] = _signature(path)
+        return snapshot
+
+
+def _signature(path):
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return None
+    if stat.S_ISDIR(info.st_mode):
+        # a directory's mtime changes with its entries, which are compared
+        # themselves
+        return (info.st_ino, info.st_mode)
+    return (info.st_ino, info.st_mode, info.st_size, info.st_mtime_ns)
+
+
+def _below(path, directory):
+    return path.startswith(os.path.join(directory, ""))
+
+
+def _stop_on_sigterm():
+    """Makes SIGTERM stop watching like ^C does; returns the previous handler."""
+    import signal
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    try:
+        return signal.signal(signal.SIGTERM, stop)
+    except ValueError:
+        # not the main thread
+        return None
+
+
+def _restore_sigterm(previous):
+    if previous is not None:
+        import signal
+
+        signal.signal(signal.SIGTERM, previous)
@@ -0,0 +1,37 @@
+test_description='clean can skip directories and limit its depth'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+mkdir -p ~/a/b/c ~/node_modules/x ~/d &&
+ln -s /nowhere ~/a/l1 &&
+ln -s /nowhere ~/a/b/l2 &&
+ln -s /nowhere ~/a/b/c/l3 &&
+ln -s /nowhere ~/node_modules/x/l4 &&
+ln -s ~/a ~/d/alias &&
+ln -s /nowhere ~/d/l5
+'
+
+test_expect_success 'run' '
+run_dotbot <<EOF
+- clean:
+    ~/:
+      force: true
+      recursive: true
+      skip: [node_modules, ".cache"]
+      max-depth: 2
+    ~/a:
+      force: true
+    ~/d:
+      force: true
+      recursive: true
+EOF
+'
+
+test_expect_success 'test' '
+! test -h ~/a/l1 &&
+! test -h ~/a/b/l2 &&
+test -h ~/a/b/c/l3 &&
+test -h ~/node_modules/x/l4 &&
+test -h ~/d/alias &&
+! test -h ~/d/l5
+'
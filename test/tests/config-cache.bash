@@ -0,0 +1,55 @@
+test_description='parsed configs are cached by content'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+cat > ${DOTFILES}/${INSTALL_CONF} <<EOF
+- shell:
+  - echo apple
+EOF
+'
+
+test_expect_success 'run' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} -v > ~/output &&
+grep "Config cache miss" ~/output &&
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} -v > ~/output &&
+grep "Config cache hit" ~/output &&
+grep "echo apple" ~/output
+'
+
+test_expect_success 'run changed' '
+cat > ${DOTFILES}/${INSTALL_CONF} <<EOF &&
+- defaults:
+    shell:
+      since: 2001-01-01
+- shell:
+  - echo banana
+EOF
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} -v > ~/output &&
+grep "Config cache miss" ~/output &&
+grep "echo banana" ~/output &&
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} -v > ~/output &&
+grep "echo banana" ~/output
+'
+
+test_expect_failure 'run invalid' '
+run_dotbot <<EOF
+- shell: [
+EOF
+'
+
+test_expect_success 'detect libyaml bindings' '
+suffix=$(python -c "import importlib.machinery as m; print(m.EXTENSION_SUFFIXES[0])") &&
+mkdir -p ~/site5/yaml ~/site6/yaml ~/site6/_yaml ~/shim/yaml ~/shim/_yaml &&
+touch ~/site5/yaml/__init__.py ~/site5/_yaml${suffix} &&
+touch ~/site6/yaml/__init__.py ~/site6/yaml/_yaml${suffix} ~/site6/_yaml/__init__.py &&
+touch ~/shim/yaml/__init__.py ~/shim/_yaml/__init__.py &&
+for site in site5 site6 shim; do
+    PYTHONPATH=~/${site} python -c "
+import runpy, sys
+print(runpy.run_path(sys.argv[1], run_name=\"has_libyaml\")[\"has_libyaml\"]())
+" ${DOTBOT_EXEC} > ~/output-${site} || return 1
+done &&
+grep True ~/output-site5 &&
+grep True ~/output-site6 &&
+grep False ~/output-shim
+'
@@ -0,0 +1,133 @@
+test_description='copy puts copies in place and skips the ones that are up to date'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/a &&
+mkdir -p ${DOTFILES}/tree/sub &&
+for i in $(seq 1 20); do echo "file ${i}" > ${DOTFILES}/tree/sub/${i}; done &&
+echo "top" > ${DOTFILES}/tree/top &&
+mkdir ${DOTFILES}/conf &&
+echo "one" > ${DOTFILES}/conf/one &&
+echo "two" > ${DOTFILES}/conf/two &&
+echo "three" > ${DOTFILES}/conf/three &&
+ln -s ${DOTFILES}/a ~/.linked &&
+cat > ${DOTFILES}/copy.yaml <<EOF
+- defaults:
+    copy:
+      create: true
+- copy:
+    ~/.a: a
+    ~/.config/tree: tree
+    ~/.conf/:
+      glob: true
+      path: conf/*
+      exclude: [ conf/two ]
+EOF
+'
+
+test_expect_success 'run' '
+${DOTBOT_EXEC} -c ${DOTFILES}/copy.yaml
+'
+
+test_expect_success 'test' '
+grep "apple" ~/.a &&
+! test -L ~/.a &&
+grep "file 20" ~/.config/tree/sub/20 &&
+grep "top" ~/.config/tree/top &&
+grep "one" ~/.conf/one &&
+grep "three" ~/.conf/three &&
+! test -e ~/.conf/two
+'
+
+test_expect_failure 'run again' '
+touch ${DOTFILES}/tree/top &&
+echo "banana" > ${DOTFILES}/a &&
+touch -d "2001-01-01" ${DOTFILES}/a &&
+${DOTBOT_EXEC} -c ${DOTFILES}/copy.yaml -v > ~/output
+'
+
+test_expect_success 'test again' '
+grep "apple" ~/.a &&
+grep "$HOME/.a already exists but differs from ${DOTFILES}/a" ~/output &&
+grep "Copy is up to date $HOME/.config/tree/sub/1" ~/output &&
+grep "Copy $HOME/.config/tree/top only differed in its modification time" ~/output &&
+test "$(stat -c %Y ~/.config/tree/top)" = "$(stat -c %Y ${DOTFILES}/tree/top)"
+'
+
+test_expect_success 'run again with force' '
+run_dotbot -v > ~/output <<EOF
+- copy:
+    ~/.a:
+      path: a
+      force: true
+EOF
+'
+
+test_expect_success 'test again with force' '
+grep "banana" ~/.a &&
+grep "Copying ${DOTFILES}/a -> $HOME/.a" ~/output &&
+test "$(stat -c %Y ~/.a)" = "$(stat -c %Y ${DOTFILES}/a)"
+'
+
+test_expect_failure 'run with the same size and time' '
+echo "cherry" > ${DOTFILES}/a &&
+touch -r ~/.a ${DOTFILES}/a &&
+run_dotbot <<EOF
+- copy:
+    ~/.a: a
+EOF
+'
+
+test_expect_success 'test with the same size and time' '
+grep "banana" ~/.a &&
+echo "banana" > ${DOTFILES}/a
+'
+
+test_expect_failure 'run over link' '
+run_dotbot <<EOF
+- copy:
+    ~/.linked: a
+EOF
+'
+
+test_expect_success 'run over link with force' '
+run_dotbot <<EOF
+- copy:
+    ~/.linked:
+      path: a
+      force: true
+EOF
+'
+
+test_expect_success 'test over link with force' '
+! test -L ~/.linked &&
+grep "banana" ~/.linked &&
+grep "banana" ${DOTFILES}/a
+'
+
+test_expect_success 'rollback' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --rollback &&
+test "$(readlink ~/.linked)" = ${DOTFILES}/a
+'
+
+# root reads directories whatever their mode
+if test "$(id -u)" != 0; then
+test_expect_failure 'run with unreadable directory' '
+mkdir -p ${DOTFILES}/locked/closed &&
+echo "open" > ${DOTFILES}/locked/open &&
+echo "shut" > ${DOTFILES}/locked/closed/shut &&
+chmod 000 ${DOTFILES}/locked/closed &&
+run_dotbot -v <<EOF > ~/output
+- copy:
+    ~/.locked: locked
+EOF
+'
+
+test_expect_success 'test with unreadable directory' '
+chmod 755 ${DOTFILES}/locked/closed &&
+grep "Failed to read directory ${DOTFILES}/locked/closed" ~/output &&
+grep "open" ~/.locked/open &&
+test -d ~/.locked/closed &&
+! test -e ~/.locked/closed/shut
+'
+fi
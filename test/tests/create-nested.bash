@@ -0,0 +1,37 @@
+test_description='nested directories are created once, parents first'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/a &&
+echo "grape" > ${DOTFILES}/b
+'
+
+test_expect_success 'run' '
+run_dotbot -j 4 > ~/output <<EOF
+- create:
+    ~/work/a/b/c:
+    ~/work/a/d:
+    ~/work:
+      mode: 0700
+    ~/work/a/d/e:
+      mode: 0750
+- link:
+    ~/.config/deep/er/a:
+      path: a
+      create: true
+    ~/.config/deep/er/b:
+      path: b
+      create: true
+EOF
+'
+
+test_expect_success 'test' '
+[ -d ~/work/a/b/c ] &&
+[ "$(stat -c %a ~/work)" = "700" ] &&
+[ "$(stat -c %a ~/work/a/d/e)" = "750" ] &&
+grep "Creating path $HOME/work$" ~/output &&
+grep "Creating path $HOME/work/a/d$" ~/output &&
+grep "apple" ~/.config/deep/er/a &&
+grep "grape" ~/.config/deep/er/b &&
+test "$(grep -c "Creating directory" ~/output)" = 1
+'
@@ -0,0 +1,63 @@
+test_description='native if conditions are checked without running a shell'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+for name in a b c d e; do echo ${name} > ${DOTFILES}/${name}; done &&
+mkdir ~/present
+'
+
+test_expect_success 'run' '
+(export FRUIT=apple && run_dotbot -v > ~/output <<EOF
+- link:
+    ~/.a:
+      path: a
+      if: {os: [macos, linux], which: sh, env: HOME, exists: ~/present}
+    ~/.b:
+      path: b
+      if: {which: [sh, no-such-program-anywhere]}
+    ~/.c:
+      path: c
+      if: {env: {FRUIT: apple}, not: {env: NO_SUCH_VARIABLE}}
+    ~/.d:
+      path: d
+      if: {not: {exists: ~/present}}
+    ~/.e:
+      path: e
+      os-constraint: [windows, linux]
+- create:
+    ~/made:
+      if: {os: linux}
+    ~/unmade:
+      if: {os: windows}
+- shell:
+  - command: touch ~/ran
+    if: {exists: ~/.a}
+  - command: touch ~/not-ran
+    if: {os: windows}
+EOF
+)
+'
+
+test_expect_success 'test' '
+grep "a" ~/.a &&
+! test -e ~/.b &&
+grep "c" ~/.c &&
+! test -e ~/.d &&
+grep "e" ~/.e &&
+test -d ~/made &&
+! test -e ~/unmade &&
+test -e ~/ran &&
+! test -e ~/not-ran &&
+grep "Path skipped $HOME/unmade ({os: windows} is false)" ~/output &&
+grep "Skipping command \[touch ~/not-ran\] ({os: windows} is false)" ~/output &&
+grep "Conditions: 0 run, 0 reused from earlier runs, 0 cache hits" ~/output
+'
+
+test_expect_failure 'run unknown fact' '
+run_dotbot <<EOF
+- link:
+    ~/.a:
+      path: a
+      if: {kernel: linux}
+EOF
+'
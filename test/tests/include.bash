@@ -0,0 +1,80 @@
+test_description='include reads tasks from other files, skipping those --only rules out'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/a &&
+echo "grape" > ${DOTFILES}/b &&
+mkdir ${DOTFILES}/conf.d &&
+cat > ${DOTFILES}/conf.d/10-defaults.yaml <<EOF &&
+- defaults:
+    link:
+      create: true
+EOF
+cat > ${DOTFILES}/conf.d/20-links.yaml <<EOF &&
+- link:
+    ~/.config/a: a
+- include: ../more/links.yaml
+EOF
+mkdir ${DOTFILES}/more &&
+cat > ${DOTFILES}/more/links.yaml <<EOF &&
+- link:
+    ~/.deep/b: b
+EOF
+cat > ${DOTFILES}/shell.yaml <<EOF
+- shell:
+  - touch ~/ran
+EOF
+'
+
+test_expect_success 'run' '
+run_dotbot <<EOF
+- include:
+  - conf.d/*.yaml
+  - path: shell.yaml
+    directives: shell
+EOF
+'
+
+test_expect_success 'test' '
+grep "apple" ~/.config/a &&
+grep "grape" ~/.deep/b &&
+test -e ~/ran
+'
+
+test_expect_success 'run only shell' '
+rm ~/ran &&
+run_dotbot --only shell -v > ~/output <<EOF
+- include:
+  - conf.d/*.yaml
+  - path: shell.yaml
+    directives: shell
+EOF
+'
+
+test_expect_success 'test only shell' '
+test -e ~/ran &&
+grep "Not loading ${DOTFILES}/more/links.yaml, none of its directives run" ~/output &&
+! grep "Creating link" ~/output
+'
+
+test_expect_success 'run only link' '
+rm ~/ran &&
+run_dotbot --only link -v > ~/output <<EOF
+- include:
+  - conf.d/*.yaml
+  - path: shell.yaml
+    directives: shell
+EOF
+'
+
+test_expect_success 'test only link' '
+! test -e ~/ran &&
+grep "Not reading ${DOTFILES}/shell.yaml, none of its directives run" ~/output
+'
+
+test_expect_failure 'run self include' '
+echo "- include: loop.yaml" > ${DOTFILES}/loop.yaml &&
+run_dotbot <<EOF
+- include: loop.yaml
+EOF
+'
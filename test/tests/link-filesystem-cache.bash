@@ -0,0 +1,30 @@
+test_description='filesystem lookups are not reused after other directives change things'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/a &&
+echo "grape" > ${DOTFILES}/b
+'
+
+test_expect_success 'run' '
+run_dotbot -v > ~/output <<EOF
+- link:
+    ~/.a: a
+    ~/.b: b
+- shell:
+  - rm ~/.a && mkdir ~/.a && ln -sf ~/nowhere ~/.b
+- link:
+    ~/.a:
+      path: a
+      force: true
+    ~/.b:
+      path: b
+      relink: true
+EOF
+'
+
+test_expect_success 'test' '
+grep "apple" ~/.a &&
+grep "grape" ~/.b &&
+grep "Answered [0-9]* filesystem lookups with [0-9]* system calls" ~/output
+'
@@ -0,0 +1,33 @@
+test_description='link glob with recursive patterns and excludes'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+mkdir -p ${DOTFILES}/config/{foo/deep,bar,skip/deeper} &&
+echo "apple" > ${DOTFILES}/config/foo/a.conf &&
+echo "banana" > ${DOTFILES}/config/foo/deep/b.conf &&
+echo "cherry" > ${DOTFILES}/config/bar/c.conf &&
+echo "donut" > ${DOTFILES}/config/bar/d.txt &&
+echo "egg" > ${DOTFILES}/config/skip/e.conf &&
+echo "fig" > ${DOTFILES}/config/skip/deeper/f.conf
+'
+
+test_expect_success 'run' '
+run_dotbot -v <<EOF
+- defaults:
+    link:
+      glob: true
+      create: true
+- link:
+    ~/.config/:
+      path: config/**/*.conf
+      exclude: [config/skip/**]
+EOF
+'
+
+test_expect_success 'test' '
+grep "apple" ~/.config/foo/a.conf &&
+grep "banana" ~/.config/foo/deep/b.conf &&
+grep "cherry" ~/.config/bar/c.conf &&
+! test -e ~/.config/bar/d.txt &&
+! test -e ~/.config/skip
+'
@@ -0,0 +1,58 @@
+test_description='link if conditions are evaluated once per run'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/f &&
+echo "grape" > ${DOTFILES}/h
+'
+
+test_expect_success 'run' '
+run_dotbot -v > ~/output <<EOF
+- link:
+    ~/.f:
+      path: f
+      if: "echo run >> ~/count"
+    ~/.g:
+      path: f
+      if: "echo run >> ~/count"
+    ~/.h:
+      path: h
+      if: "echo run >> ~/count && false"
+- link:
+    ~/.i:
+      path: f
+      if: "echo run >> ~/count"
+EOF
+'
+
+test_expect_success 'test' '
+grep "apple" ~/.f &&
+grep "apple" ~/.g &&
+grep "apple" ~/.i &&
+! test -e ~/.h &&
+test "$(wc -l < ~/count)" -eq 2 &&
+grep "Conditions: 2 run, 0 reused from earlier runs, 4 cache hits" ~/output
+'
+
+test_expect_success 'setup persistent' '
+rm ~/count &&
+cat > ${DOTFILES}/${INSTALL_CONF} <<EOF
+- defaults:
+    link:
+      if-cache: [FRUIT]
+- link:
+    ~/.j:
+      path: f
+      if: "echo run >> ~/count"
+EOF
+'
+
+test_expect_success 'run persistent' '
+FRUIT=apple ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} &&
+FRUIT=apple ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} &&
+test "$(wc -l < ~/count)" -eq 1 &&
+FRUIT=banana ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} &&
+test "$(wc -l < ~/count)" -eq 2 &&
+FRUIT=banana ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --full &&
+test "$(wc -l < ~/count)" -eq 3
+'
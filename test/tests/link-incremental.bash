@@ -0,0 +1,55 @@
+test_description='unchanged entries are skipped on later runs'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+mkdir -p ${DOTFILES}/config/{foo,bar} &&
+echo "apple" > ${DOTFILES}/f &&
+echo "banana" > ${DOTFILES}/config/foo/a &&
+echo "cherry" > ${DOTFILES}/config/bar/b &&
+cat > ${DOTFILES}/${INSTALL_CONF} <<EOF
+- create:
+    ~/downloads:
+- link:
+    ~/.f: f
+    ~/.config/:
+      glob: true
+      create: true
+      path: config/*/*
+EOF
+'
+
+test_expect_success 'run' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} &&
+ls ~/.local/state/dotbot/state/*.json
+'
+
+test_expect_success 'run 2' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} -v > ~/output &&
+grep "Link exists .*/.f" ~/output &&
+grep "Path exists .*/downloads" ~/output &&
+! grep "Globs from" ~/output
+'
+
+test_expect_success 'run 3' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --full -v > ~/output &&
+grep "Globs from" ~/output
+'
+
+test_expect_success 'run 4' '
+rm ~/.f &&
+echo "grape" > ${DOTFILES}/config/foo/c &&
+rmdir ~/downloads &&
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF}
+'
+
+test_expect_success 'test' '
+grep "apple" ~/.f &&
+grep "grape" ~/.config/foo/c &&
+test -d ~/downloads
+'
+
+test_expect_success 'run 5' '
+rm ~/.config/bar/b &&
+ln -s /nowhere ~/.config/bar/b &&
+! ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF}
+'
@@ -0,0 +1,74 @@
+test_description='linking with multiple jobs'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+mkdir -p ${DOTFILES}/config/{foo,bar} &&
+echo "apple" > ${DOTFILES}/f &&
+echo "banana" > ${DOTFILES}/config/foo/a &&
+echo "cherry" > ${DOTFILES}/config/bar/b &&
+echo "grape" > ${DOTFILES}/g &&
+echo "pear" > ~/.g
+'
+
+test_expect_success 'run' '
+run_dotbot --jobs 4 <<EOF
+- link:
+    ~/.f: f
+    ~/.config/nested/deep/f:
+      path: f
+      create: true
+    ~/.config/:
+      glob: true
+      create: true
+      path: config/*/*
+    ~/.vendor: config
+    ~/.vendor/extra: f
+    ~/.g:
+      path: g
+      force: true
+EOF
+'
+
+test_expect_success 'test' '
+grep "apple" ~/.f &&
+grep "apple" ~/.config/nested/deep/f &&
+grep "banana" ~/.config/foo/a &&
+grep "cherry" ~/.config/bar/b &&
+grep "grape" ~/.g &&
+grep "apple" ${DOTFILES}/config/extra
+'
+
+test_expect_failure 'run 2' '
+run_dotbot <<EOF
+- defaults:
+    link:
+      jobs: 4
+- link:
+    ~/.h: nonexistent
+    ~/.i: f
+EOF
+'
+
+test_expect_success 'test 2' '
+! test -e ~/.h &&
+grep "apple" ~/.i
+'
+
+test_expect_success 'run 3' '
+cat > ${DOTFILES}/${INSTALL_CONF} <<EOF
+- link:
+    ~/.f: f
+    ~/.x: nonexistent
+    ~/.config/:
+      glob: true
+      create: true
+      path: config/*/*
+EOF
+(${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --full --jobs 1 > ~/serial;
+ ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --full --jobs 8 > ~/parallel;
+ true)
+'
+
+test_expect_success 'test 3' '
+diff ~/serial ~/parallel
+'
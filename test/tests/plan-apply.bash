@@ -0,0 +1,101 @@
+test_description='plans can be written and applied'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+mkdir -p ${DOTFILES}/config/{foo,bar} &&
+echo "apple" > ${DOTFILES}/f &&
+echo "banana" > ${DOTFILES}/config/foo/a &&
+echo "cherry" > ${DOTFILES}/config/bar/b &&
+ln -s /nowhere ~/.stale &&
+ln -s ${DOTFILES}/nonexistent ~/.broken
+'
+
+test_expect_success 'plan' '
+run_dotbot --plan ~/plan.json <<EOF
+- defaults:
+    link:
+      relink: true
+- clean: ["~"]
+- create:
+    ~/downloads:
+- link:
+    ~/.f: f
+    ~/.g:
+      path: f
+      if: "true"
+    ~/.h:
+      path: f
+      if: "false"
+    ~/.config/:
+      glob: true
+      create: true
+      path: config/*/*
+- shell:
+  - echo "ran" > ~/shell-ran
+EOF
+'
+
+test_expect_success 'plan has no side effects' '
+test -h ~/.broken &&
+! test -e ~/downloads &&
+! test -e ~/.f &&
+! test -e ~/shell-ran &&
+grep "\"type\": \"symlink\"" ~/plan.json &&
+grep "\"type\": \"remove\"" ~/plan.json &&
+grep "\"type\": \"mkdir\"" ~/plan.json &&
+grep "\"type\": \"run\"" ~/plan.json &&
+grep "\"type\": \"clean\"" ~/plan.json &&
+! grep "\.h\"" ~/plan.json
+'
+
+test_expect_success 'apply' '
+rm ${DOTFILES}/${INSTALL_CONF} &&
+${DOTBOT_EXEC} --apply ~/plan.json
+'
+
+test_expect_success 'test' '
+! test -h ~/.broken &&
+test -h ~/.stale &&
+test -d ~/downloads &&
+grep "apple" ~/.f &&
+grep "apple" ~/.g &&
+! test -e ~/.h &&
+grep "banana" ~/.config/foo/a &&
+grep "cherry" ~/.config/bar/b &&
+grep "ran" ~/shell-ran
+'
+
+test_expect_success 'apply again' '
+${DOTBOT_EXEC} --apply ~/plan.json
+'
+
+test_expect_success 'no drift after apply' '
+echo "- link: {~/.f: f}" > ${DOTFILES}/${INSTALL_CONF} &&
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --plan ~/plan2.json | grep "0 of 1 planned actions are pending"
+'
+
+test_expect_failure 'plan fails for missing sources' '
+run_dotbot --plan ~/plan3.json <<EOF
+- link:
+    ~/.x: nonexistent
+EOF
+'
+
+test_expect_success 'plan relative to home' '
+run_dotbot --plan ~/plan4.json <<EOF
+- link:
+    ~/.f: f
+EOF
+'
+
+test_expect_success 'plan paths follow the home directory' '
+grep "\"destination\": \"~/.f\"" ~/plan4.json &&
+! grep "$HOME" ~/plan4.json &&
+mkdir ~/other &&
+cp -r ${DOTFILES} ~/other/dotfiles &&
+echo "grape" > ~/other/dotfiles/f &&
+HOME=~/other ${DOTBOT_EXEC} --apply ~/plan4.json &&
+grep "grape" ~/other/.f &&
+test "$(readlink ~/other/.f)" = "$HOME/other/dotfiles/f" &&
+test "$(readlink ~/.f)" = "${DOTFILES}/f"
+'
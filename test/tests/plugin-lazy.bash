@@ -0,0 +1,56 @@
+test_description='plugins that declare their directives are only loaded when used'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+mkdir ${DOTFILES}/plugins &&
+cat > ${DOTFILES}/plugins/test.py <<EOF &&
+# dotbot-directives: test, test2
+import dotbot
+import os.path
+
+class Test(dotbot.Plugin):
+    directives = ("test", "test2")
+
+    def handle(self, directive, data):
+        with open(os.path.expanduser("~/flag"), "a") as f:
+            f.write("it works %s\n" % directive)
+        return True
+EOF
+cat > ${DOTFILES}/plugins/unused.py <<EOF
+# dotbot-directives: unused
+import dotbot
+import os.path
+
+with open(os.path.expanduser("~/imported"), "w") as f:
+    f.write("imported")
+
+class Unused(dotbot.Plugin):
+    directives = ("unused",)
+
+    def handle(self, directive, data):
+        return True
+EOF
+'
+
+test_expect_success 'run' '
+run_dotbot --plugin-dir ${DOTFILES}/plugins <<EOF
+- test: ~
+- test2: ~
+EOF
+'
+
+test_expect_success 'test' '
+grep "it works test$" ~/flag &&
+grep "it works test2$" ~/flag &&
+! test -f ~/imported
+'
+
+test_expect_success 'run used' '
+run_dotbot --plugin-dir ${DOTFILES}/plugins <<EOF
+- unused: ~
+EOF
+'
+
+test_expect_success 'test used' '
+test -f ~/imported
+'
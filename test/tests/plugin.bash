@@ -62,3 +62,50 @@ EOF
 test_expect_success 'test 2' '
 grep "it works" ~/flag
 '
+
+test_expect_success 'setup 3' '
+rm -f ${DOTFILES}/test.py ~/flag;
+cat > ${DOTFILES}/test.py <<EOF
+import dotbot
+import os.path
+
+class Test(dotbot.Plugin):
+    def can_handle(self, directive):
+        return directive == "test"
+
+    def handle(self, directive, data):
+        defaults = self._context.defaults()
+        if defaults["test"]["fruits"] != ("apple",):
+            return False
+        try:
+            defaults["test"]["fruits"] = ["banana"]
+        except TypeError:
+            pass
+        else:
+            return False
+        mutable = self._context.mutable_defaults()
+        mutable["test"]["fruits"].append("banana")
+        if self._context.defaults()["test"]["fruits"] != ("apple",):
+            return False
+        options = self._context.mutable_options()
+        options.plugins.append("other.py")
+        if len(self._context.options().plugins) != 1:
+            return False
+        with open(os.path.expanduser("~/flag"), "w") as f:
+            f.write("it works")
+        return True
+EOF
+'
+
+test_expect_success 'run 3' '
+run_dotbot --plugin ${DOTFILES}/test.py <<EOF
+- defaults:
+    test:
+      fruits: [apple]
+- test: ~
+EOF
+'
+
+test_expect_success 'test 3' '
+grep "it works" ~/flag
+'
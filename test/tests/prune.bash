@@ -0,0 +1,46 @@
+test_description='--prune removes the managed links the config no longer produces'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+for name in a b c d; do echo ${name} > ${DOTFILES}/${name}; done &&
+ln -s ${DOTFILES}/b ~/.mine
+'
+
+test_expect_success 'run' '
+run_dotbot <<EOF
+- link:
+    ~/.a: a
+    ~/.b: b
+    ~/.c: c
+    ~/.d: d
+EOF
+'
+
+test_expect_success 'change' '
+rm ${DOTFILES}/c &&
+rm ~/.d && ln -s ${DOTFILES}/a ~/.d
+'
+
+test_expect_success 'run prune' '
+(run_dotbot --prune > ~/output <<EOF
+- link:
+    ~/.a: a
+    ~/.c: c
+EOF
+) || test $? -eq 1
+'
+
+test_expect_success 'test' '
+grep "a" ~/.a &&
+! test -L ~/.b &&
+! test -L ~/.c &&
+test "$(readlink ~/.d)" = ${DOTFILES}/a &&
+test "$(readlink ~/.mine)" = ${DOTFILES}/b &&
+grep "Removing stale link $HOME/.b -> ${DOTFILES}/b" ~/output &&
+grep "Removing stale link $HOME/.c -> ${DOTFILES}/c" ~/output
+'
+
+test_expect_success 'rollback' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --rollback &&
+test "$(readlink ~/.b)" = ${DOTFILES}/b
+'
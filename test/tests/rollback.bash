@@ -0,0 +1,95 @@
+test_description='--rollback undoes the last run from its journal'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/a &&
+echo "grape" > ${DOTFILES}/b &&
+echo "banana" > ~/old &&
+ln -s ~/old ~/.b &&
+echo "pear" > ~/.c &&
+mkdir ~/.d &&
+echo "plum" > ~/.d/e &&
+mkdir ~/stale &&
+ln -s ${DOTFILES}/gone ~/stale/link
+'
+
+test_expect_success 'run' '
+run_dotbot > ~/output <<EOF
+- link:
+    ~/.config/x/.a:
+      path: a
+      create: true
+    ~/.b:
+      path: b
+      relink: true
+    ~/.c:
+      path: b
+      force: true
+    ~/.d:
+      path: b
+      force: true
+- clean:
+    ~/stale:
+EOF
+'
+
+test_expect_success 'test run' '
+grep "apple" ~/.config/x/.a &&
+grep "grape" ~/.b &&
+grep "grape" ~/.c &&
+grep "grape" ~/.d &&
+! test -e ~/stale/link &&
+grep "Replacing $HOME/.b -> ${DOTFILES}/b" ~/output &&
+grep "Replacing $HOME/.c -> ${DOTFILES}/b" ~/output
+'
+
+test_expect_success 'rollback' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --rollback
+'
+
+test_expect_success 'test rollback' '
+! test -e ~/.config &&
+test "$(readlink ~/.b)" = ~/old &&
+grep "pear" ~/.c && ! test -L ~/.c &&
+grep "plum" ~/.d/e && ! test -L ~/.d &&
+test "$(readlink ~/stale/link)" = ${DOTFILES}/gone
+'
+
+test_expect_success 'rollback again' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --rollback > ~/output &&
+grep "There is no run to roll back" ~/output
+'
+
+# with the journal on another filesystem than the home directory, if there
+# is one, what force removes is deleted
+STATE=/dev/shm/dotbot-rollback-$$
+if test -d /dev/shm && test "$(stat -c %d /dev/shm 2>/dev/null)" != "$(stat -c %d ~)"; then
+
+test_expect_success 'run with journal on another filesystem' '
+(export XDG_STATE_HOME=${STATE} && run_dotbot > ~/output 2>&1 <<EOF
+- link:
+    ~/.d:
+      path: b
+      force: true
+EOF
+)
+'
+
+test_expect_success 'test journal on another filesystem' '
+grep "grape" ~/.d &&
+grep "Deleting $HOME/.d instead of keeping it for --rollback" ~/output &&
+test -z "$(ls ${STATE}/dotbot/journal/*/backup)"
+'
+
+test_expect_failure 'rollback with journal on another filesystem' '
+(export XDG_STATE_HOME=${STATE} &&
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --rollback > ~/output 2>&1)
+'
+
+test_expect_success 'test rollback with journal on another filesystem' '
+grep "$HOME/.d was deleted, it cannot be restored" ~/output &&
+! test -e ~/.d &&
+rm -rf ${STATE}
+'
+
+fi
@@ -0,0 +1,56 @@
+test_description='--schedule runs independent tasks concurrently'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/a &&
+echo "grape" > ${DOTFILES}/b
+'
+
+test_expect_success 'run' '
+run_dotbot --schedule 4 --timing > ~/output <<EOF
+- create:
+    ~/.cache/x:
+- link:
+    ~/.config/a:
+      path: a
+      create: true
+- id: slow
+  after: []
+  shell:
+    - sleep 1 && touch ~/slow-done
+- id: warm
+  after: slow
+  shell:
+    - test -e ~/slow-done && touch ~/warm-done
+- link:
+    ~/.b: b
+EOF
+'
+
+test_expect_success 'test' '
+test -d ~/.cache/x &&
+grep "apple" ~/.config/a &&
+grep "grape" ~/.b &&
+test -e ~/warm-done &&
+grep "^Critical path: slow [0-9.]* ms -> warm [0-9.]* ms" ~/output &&
+test "$(grep -n "Creating path" ~/output | cut -d: -f1)" -lt \
+     "$(grep -n "Creating link $HOME/.b" ~/output | cut -d: -f1)"
+'
+
+test_expect_success 'run with a cycle' '
+! run_dotbot --schedule <<EOF
+- id: one
+  after: two
+  shell:
+    - touch ~/one
+- id: two
+  after: one
+  shell:
+    - touch ~/two
+EOF
+'
+
+test_expect_success 'test cycle' '
+! test -e ~/one &&
+! test -e ~/two
+'
@@ -0,0 +1,84 @@
+test_description='parallel shell commands run concurrently and keep their output together'
+. '../test-lib.bash'
+
+test_expect_success 'run' '
+run_dotbot > ~/output <<EOF
+- shell:
+  - command: sleep 2 && echo apple && echo banana
+    parallel: true
+    stdout: true
+  - command: sleep 2 && echo cherry
+    parallel: true
+    stdout: true
+  - command: sleep 2 && echo date
+    parallel: true
+    stdout: true
+  - command: echo fig
+    stdout: true
+EOF
+'
+
+test_expect_success 'test' '
+grep -A1 "^apple" ~/output | grep "^banana" &&
+test "$(grep -n "^banana" ~/output | cut -d: -f1)" -lt "$(grep -n "^cherry" ~/output | cut -d: -f1)" &&
+test "$(grep -n "^date" ~/output | cut -d: -f1)" -lt "$(grep -n "^fig" ~/output | cut -d: -f1)"
+'
+
+test_expect_success 'run prefix' '
+run_dotbot > ~/output <<EOF
+- defaults:
+    shell:
+      parallel: true
+      output: prefix
+      jobs: 2
+- shell:
+  - command: echo apple
+    stdout: true
+  - [echo banana, Bananas]
+EOF
+'
+
+test_expect_success 'test prefix' '
+grep "^echo apple | apple" ~/output
+'
+
+test_expect_failure 'run failure' '
+run_dotbot <<EOF
+- shell:
+  - command: "true"
+    parallel: true
+  - command: "false"
+    parallel: true
+EOF
+'
+
+test_expect_success 'run timing' '
+start=$(date +%s) &&
+run_dotbot <<EOF &&
+- shell:
+  - command: sleep 2
+    parallel: true
+  - command: sleep 2
+    parallel: true
+  - command: sleep 2
+    parallel: true
+EOF
+test $(( $(date +%s) - start )) -lt 6
+'
+
+test_expect_success 'run jobs' '
+rm -f ~/order &&
+run_dotbot --jobs 4 <<EOF
+- shell:
+  - command: sleep 1 && echo apple >> ~/order
+    parallel: true
+    jobs: 1
+  - command: echo banana >> ~/order
+    parallel: true
+    jobs: 1
+EOF
+'
+
+test_expect_success 'test jobs' '
+test "$(cat ~/order | tr "\n" " ")" = "apple banana "
+'
@@ -0,0 +1,52 @@
+test_description='--persistent-shell runs commands and conditions on long-lived shells'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/a &&
+echo "grape" > ${DOTFILES}/b
+'
+
+test_expect_success 'run' '
+(run_dotbot --persistent-shell -v > ~/output 2>&1 <<EOF
+- link:
+    ~/.a:
+      path: a
+      if: test -n "\$HOME"
+    ~/.b:
+      path: b
+      if: "false"
+- shell:
+  - command: cd / && export FRUIT=apple && echo "it'"'"'s \$PWD"
+    stdout: true
+  - command: echo "here \$PWD \${FRUIT:-none}"
+    stdout: true
+  - command: echo cherry >&2; exit 3
+    stderr: true
+  - command: echo date && echo fig
+    stdout: true
+    parallel: true
+  - command: echo kiwi >&2
+    stderr: true
+    parallel: true
+  - command: kill \$\$
+  - command: test "\$(readlink /proc/self/fd/0)" != /dev/null && touch ~/read
+    stdin: true
+  - command: echo lemon > ~/lemon
+EOF
+) || test $? -eq 1
+'
+
+test_expect_success 'test' '
+grep "apple" ~/.a &&
+! test -e ~/.b &&
+grep "^it'"'"'s /$" ~/output &&
+grep "^here ${DOTFILES} none$" ~/output &&
+grep "^cherry$" ~/output &&
+grep "Command \[echo cherry >&2; exit 3\] failed" ~/output &&
+grep -A1 "^date$" ~/output | grep "^fig$" &&
+grep "^kiwi$" ~/output &&
+grep "Command \[kill \$\$\] failed" ~/output &&
+test -e ~/read &&
+grep "lemon" ~/lemon &&
+grep -E "Ran [0-9]* commands on [0-9]* persistent shells|need Python 3.8" ~/output
+'
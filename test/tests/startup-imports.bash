@@ -0,0 +1,91 @@
+test_description='a trivial run only imports what it needs'
+. '../test-lib.bash'
+
+# total import time allowed for a trivial config, in microseconds; this is
+# several times what it takes on a typical machine, to catch regressions such
+# as a heavy module being imported up front again
+BUDGET=150000
+
+test_expect_success 'setup' '
+cat > ${DOTFILES}/${INSTALL_CONF} <<EOF &&
+- create:
+    ~/downloads:
+EOF
+cat > ~/modules.py <<EOF &&
+import atexit
+import sys
+
+output = sys.argv.pop(1)
+
+
+def report():
+    with open(output, "w") as fout:
+        fout.write("\\n".join(sorted(sys.modules)) + "\\n")
+
+
+atexit.register(report)
+sys.argv.pop(0)
+with open(sys.argv[0]) as fin:
+    code = compile(fin.read(), sys.argv[0], "exec")
+exec(code, {"__name__": "__main__", "__file__": sys.argv[0]})
+EOF
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF}
+'
+
+test_expect_success 'run' '
+python ~/modules.py ~/imports ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF}
+'
+
+test_expect_success 'test modules' '
+grep -x "dotbot.cli" ~/imports &&
+grep -x "dotbot.plugins.create" ~/imports &&
+! grep -xE "yaml|subprocess|concurrent\.futures|platform|typing|glob" ~/imports &&
+! grep -xE "dotbot\.plugins\.(link|shell|clean|copy)" ~/imports
+'
+
+test_expect_success 'test import' '
+PYTHONPATH="${BASEDIR}" python -c "import sys, dotbot; print(\"\\n\".join(sorted(sys.modules)))" > ~/package &&
+grep -x "dotbot.dispatcher" ~/package &&
+! grep -xE "dotbot\.(plan|registry|journal|state|conditions)|json" ~/package
+'
+
+# annotations have to resolve without typing being imported up front
+test_expect_success 'test annotations' '
+PYTHONPATH="${BASEDIR}" python - <<EOF
+import importlib, inspect, pkgutil, typing
+import dotbot, dotbot.plugins, dotbot.util
+
+for package in (dotbot, dotbot.plugins, dotbot.util):
+    for info in pkgutil.iter_modules(package.__path__, package.__name__ + "."):
+        module = importlib.import_module(info.name)
+        for _, member in inspect.getmembers(module):
+            if getattr(member, "__module__", None) != module.__name__:
+                continue
+            functions = [member] if inspect.isfunction(member) else []
+            if inspect.isclass(member):
+                functions = [value for value in vars(member).values() if inspect.isfunction(value)]
+            for function in functions:
+                typing.get_type_hints(function)
+EOF
+'
+
+# -X importtime needs Python 3.7
+if python -c "import sys; sys.exit(sys.version_info < (3, 7))"; then
+test_expect_success 'run importtime' '
+python -X importtime ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} 2> ~/importtime
+'
+
+test_expect_success 'test budget' '
+total=$(awk -F"|" "/^import time: +[0-9]/ { sub(/import time: +/, \"\", \$1); sum += \$1 } END { print sum }" ~/importtime) &&
+echo "imports took ${total}us" &&
+test "${total}" -lt "${BUDGET}"
+'
+fi
+
+test_expect_success 'run timing' '
+${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --timing > ~/output &&
+grep "Timing: loading dotbot took" ~/output &&
+grep "Timing: reading the config took" ~/output &&
+grep "Timing: dispatch took" ~/output &&
+grep "Timing: create directive took" ~/output
+'
@@ -0,0 +1,81 @@
+test_description='--summary counts items and --log-file/--log-json record every message'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/f &&
+echo "grape" > ${DOTFILES}/g &&
+echo "pear" > ~/.h &&
+mkdir ~/stale &&
+ln -s ${DOTFILES}/gone ~/stale/link
+'
+
+test_expect_success 'run' '
+ln -s ${DOTFILES}/f ~/.f &&
+(run_dotbot --summary --log-file ~/log.txt --log-json ~/log.json > ~/output <<EOF
+- link:
+    ~/.f: f
+    ~/.g: g
+    ~/.h: g
+    ~/.i:
+      path: g
+      if: "false"
+- clean:
+    ~/stale:
+- shell:
+  - [echo banana, fruit]
+  - ["false", failing]
+EOF
+) || true
+'
+
+test_expect_success 'test summary' '
+grep "^Summary: link: 1 created, 1 existing, 1 skipped, 1 failed$" ~/output &&
+grep "^Summary: clean: 1 removed$" ~/output &&
+grep "^Summary: shell: 1 run, 1 failed$" ~/output &&
+! grep "Creating link" ~/output &&
+grep "already exists but is a regular file" ~/output
+'
+
+test_expect_success 'test log file' '
+grep "lowinfo Creating link $HOME/.g -> ${DOTFILES}/g$" ~/log.txt &&
+grep "debug   Test .false. returned false" ~/log.txt &&
+grep "warning $HOME/.h already exists" ~/log.txt
+'
+
+test_expect_success 'test json log' '
+python - ~/log.json <<EOF
+import json, sys
+with open(sys.argv[1]) as fin:
+    records = [json.loads(line) for line in fin]
+messages = [(record["level"], record["message"]) for record in records]
+assert ("lowinfo", "Removing invalid link %s/stale/link -> %s/gone" % (
+    __import__("os").path.expanduser("~"), "${DOTFILES}")) in messages, messages
+assert ("lowinfo", "fruit [echo banana]") in messages
+assert ("warning", "Command [false] failed") in messages
+assert all(isinstance(record["time"], float) for record in records)
+EOF
+'
+
+test_expect_success 'run summary super quiet' '
+run_dotbot -Q --summary > ~/output <<EOF
+- shell:
+  - [echo banana, fruit]
+EOF
+'
+
+test_expect_success 'test summary super quiet' '
+! grep "Summary" ~/output &&
+! grep "All commands have been executed" ~/output
+'
+
+test_expect_failure 'run unwritable log file' '
+run_dotbot --log-file ~/nowhere/log.txt > ~/output 2>&1 <<EOF
+- shell:
+  - [echo banana, fruit]
+EOF
+'
+
+test_expect_success 'test unwritable log file' '
+grep "Could not open log file $HOME/nowhere/log.txt" ~/output &&
+! grep "Traceback" ~/output
+'
@@ -0,0 +1,66 @@
+test_description='--target-root and --home apply a config to many targets'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/f &&
+mkdir -p ${DOTFILES}/config/foo ~/roots/one ~/roots/two ~/users/bob &&
+echo "banana" > ${DOTFILES}/config/foo/b &&
+echo "grape" > ${DOTFILES}/config/g &&
+echo "pear" > ~/users/bob/.f
+'
+
+test_expect_success 'run homes' '
+(run_dotbot --home ~/users/alice ~/users/bob > ~/output <<EOF
+- defaults:
+    link:
+      create: true
+- link:
+    ~/.f: f
+    ~/.config/:
+      glob: true
+      path: config/*
+- shell:
+  - echo \$HOME >> ${HOME}/homes
+EOF
+) || test $? -eq 1
+'
+
+test_expect_success 'test homes' '
+test "$(readlink ~/users/alice/.f)" = ${DOTFILES}/f &&
+test "$(readlink ~/users/alice/.config/g)" = ${DOTFILES}/config/g &&
+test "$(readlink ~/users/bob/.config/foo)" = ${DOTFILES}/config/foo &&
+grep "pear" ~/users/bob/.f &&
+! test -e ~/.f &&
+grep "^$HOME/users/alice$" ~/homes &&
+grep "^$HOME/users/bob$" ~/homes &&
+grep "Target $HOME/users/alice: succeeded" ~/output &&
+grep "Target $HOME/users/bob: failed" ~/output &&
+grep "1 of 2 targets set up successfully" ~/output
+'
+
+test_expect_success 'test state stays with the user running dotbot' '
+test -z "${XDG_STATE_HOME}" &&
+test "$(ls ~/.local/state/dotbot/journal | wc -l)" -eq 2 &&
+test "$(ls ~/.local/state/dotbot/links | wc -l)" -eq 2 &&
+! test -e ~/users/alice/.local &&
+! test -e ~/users/bob/.local
+'
+
+test_expect_success 'run roots' '
+run_dotbot --target-root ~/roots/one ~/roots/two --home /home/carol --processes 2 <<EOF
+- create:
+    ~/downloads:
+- link:
+    ~/.f:
+      path: f
+      create: true
+      relative: true
+EOF
+'
+
+test_expect_success 'test roots' '
+for root in ~/roots/one ~/roots/two; do
+    test -d ${root}/home/carol/downloads &&
+    test "$(readlink -f ${root}/home/carol/.f)" = ${DOTFILES}/f || return 1
+done
+'
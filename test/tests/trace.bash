@@ -0,0 +1,40 @@
+test_description='--trace writes a Chrome trace of the run'
+. '../test-lib.bash'
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/f &&
+mkdir -p ${DOTFILES}/config/{foo,bar} &&
+echo "banana" > ${DOTFILES}/config/foo/b
+'
+
+test_expect_success 'run' '
+run_dotbot --trace ~/trace.json <<EOF
+- link:
+    ~/.f:
+      path: f
+      if: "true"
+    ~/.config/:
+      glob: true
+      create: true
+      path: config/*
+- shell:
+  - echo apple
+EOF
+'
+
+test_expect_success 'test' '
+python - ~/trace.json <<EOF
+import json, sys
+with open(sys.argv[1]) as fin:
+    events = json.load(fin)["traceEvents"]
+names = set(event["name"] for event in events)
+assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+for name in ["read config", "compile", "task link", "Link.handle", "task shell", "Shell.handle",
+             "run echo apple", "if true"]:
+    assert name in names, name
+assert any(name.startswith("symlink ") for name in names)
+assert any(event["cat"] == "fs" and event["name"].startswith("glob ") for event in events)
+spawns = [event for event in events if event["cat"] == "subprocess"]
+assert len(spawns) == 2, spawns
+EOF
+'
@@ -0,0 +1,118 @@
+test_description='--watch re-runs the directives affected by a change'
+. '../test-lib.bash'
+
+# waits up to 10 seconds for a command to succeed
+wait_for() {
+    for i in $(seq 50); do
+        "$@" && return 0
+        sleep 0.2
+    done
+    return 1
+}
+
+# succeeds if a file has a number of lines matching a pattern
+lines_match() {
+    test "$(grep -c "$2" "$3")" = "$1"
+}
+
+watch_test() {
+    method=$1
+    rm -rf ~/.f ~/.g ~/.config ~/output-${method} ${DOTFILES}/config/new
+    cat > ${DOTFILES}/${INSTALL_CONF} <<EOF
+- link:
+    ~/.f: f
+    ~/.config/:
+      glob: true
+      create: true
+      path: config/*
+- shell:
+  - echo ran >> ~/shell-${method}
+EOF
+    ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --watch ${method} > ~/output-${method} 2>&1 &
+    pid=$!
+    wait_for grep -q "Watching" ~/output-${method} &&
+    test -L ~/.f &&
+    echo "new" > ${DOTFILES}/config/new &&
+    wait_for test -L ~/.config/new &&
+    cat >> ${DOTFILES}/${INSTALL_CONF} <<EOF &&
+- link:
+    ~/.g: g
+EOF
+    wait_for test -L ~/.g &&
+    wait_for lines_match 2 "Applied changes to link in" ~/output-${method} &&
+    kill ${pid} &&
+    wait ${pid} &&
+    grep "Stopped watching" ~/output-${method} &&
+    test "$(wc -l < ~/shell-${method})" = 1
+}
+
+# a config that starts to use a directive, and includes a file from outside
+# the base directory
+watch_reload_test() {
+    method=$1
+    rm -f ~/.h ~/reloaded-${method} ~/output-reload-${method}
+    cat > ${DOTFILES}/${INSTALL_CONF} <<EOF
+- link:
+    ~/.f: f
+EOF
+    cat > ~/extra-${method}.yaml <<EOF
+- shell:
+  - echo ran >> ~/reloaded-${method}
+EOF
+    ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --watch ${method} > ~/output-reload-${method} 2>&1 &
+    pid=$!
+    wait_for grep -q "Watching" ~/output-reload-${method} &&
+    cat >> ${DOTFILES}/${INSTALL_CONF} <<EOF &&
+- include: ~/extra-${method}.yaml
+EOF
+    wait_for test -f ~/reloaded-${method} &&
+    cat >> ~/extra-${method}.yaml <<EOF &&
+- link:
+    ~/.h: g
+EOF
+    wait_for test -L ~/.h &&
+    kill ${pid} &&
+    wait ${pid} &&
+    ! grep "not handled" ~/output-reload-${method}
+}
+
+test_expect_success 'setup' '
+echo "apple" > ${DOTFILES}/f &&
+echo "grape" > ${DOTFILES}/g &&
+mkdir -p ${DOTFILES}/config/foo &&
+echo "banana" > ${DOTFILES}/config/foo/b
+'
+
+test_expect_success 'watch' '
+watch_test auto
+'
+
+test_expect_success 'watch by polling' '
+watch_test poll
+'
+
+test_expect_success 'watch loads plugins and includes added to the config' '
+watch_reload_test auto
+'
+
+test_expect_success 'watch loads plugins and includes added to the config by polling' '
+watch_reload_test poll
+'
+
+test_expect_success 'watch refuses --plan' '
+! ${DOTBOT_EXEC} -c ${DOTFILES}/${INSTALL_CONF} --watch --plan ~/plan.json
+'
+
+test_expect_success 'watch a config given relative to another directory' '
+rm -f ~/.k
+echo "- link: {~/.f: f}" > ${DOTFILES}/${INSTALL_CONF}
+(cd ~ && exec ${DOTBOT_EXEC} -c dotfiles/${INSTALL_CONF} --watch poll > ~/output-relative 2>&1) &
+pid=$!
+wait_for grep -q "Watching" ~/output-relative &&
+echo "- link: {~/.k: g}" >> ${DOTFILES}/${INSTALL_CONF} &&
+wait_for test -L ~/.k;
+result=$?
+kill ${pid}
+wait ${pid}
+test ${result} = 0
+'